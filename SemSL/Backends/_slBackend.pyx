@@ -8,10 +8,10 @@ class slBackend(object):
     def __init__(self):
         raise NotImplementedError
 
-    def connect(self, url, credentials):
+    def connect(self, url, credentials, host_config={}):
         raise NotImplementedError
 
-    def close(self):
+    def close(self, conn):
         raise NotImplementedError
 
     def get_id(self):
@@ -26,6 +26,9 @@ class slBackend(object):
     def upload(self):
         raise NotImplementedError
 
+    def upload_data(self,conn,data,bucket,fname):
+        raise NotImplementedError
+
     def open(self):
         raise NotImplementedError
 
@@ -38,5 +41,14 @@ class slBackend(object):
     def get_head(self,fid):
         raise NotImplementedError
 
+    def get_head_object(self,conn,bucket,fid):
+        raise NotImplementedError
+
+    def get_object_info(self,conn,bucket,fid,n_bytes):
+        raise NotImplementedError
+
     def get_patial(self,fid,start,stop):
+        raise NotImplementedError
+
+    def get_range_url(self,conn,bucket,fid):
         raise NotImplementedError
\ No newline at end of file
@@ -2,31 +2,258 @@ __copyright__ = "(C) 2012 Science and Technology Facilities Council"
 __license__ = "BSD - see LICENSE file in top-level directory"
 
 import ftplib
+import io
+import posixpath
 
 from _slBackend import slBackend
 from SemSL._slExceptions import slIOException, slAPIException
 
+# the block size for RETR / STOR
+FTP_BLOCK_SIZE = 1024 * 1024
+
+
+class slFTPConnection(ftplib.FTP):
+    """A control connection to an FTP server, in binary mode.  The connections are kept in the pool of the
+       slConnectionManager, which limits them to read_connections / write_connections for the host, so the subarray
+       files are transferred in parallel over that many control connections.  As the server may close a connection
+       while it is idle in the pool, the connection can log in again (see reopen)."""
+
+    def __init__(self, host, port, credentials, passive=True, timeout=None):
+        if timeout is None:
+            ftplib.FTP.__init__(self)
+        else:
+            ftplib.FTP.__init__(self, timeout=timeout)
+        self._address = (host, port)
+        self._credentials = credentials
+        self._passive = passive
+        # the directories that are known to exist, so that they are only created once
+        self.directories = set()
+        self.reopen()
+
+    def reopen(self):
+        """Connect and log in to the server"""
+        self.close()
+        self.connect(*self._address)
+        self.login(user=self._credentials.get("user", ""),
+                   passwd=self._credentials.get("password", ""),
+                   acct=self._credentials.get("account", ""))
+        self.set_pasv(self._passive)
+        # SIZE and REST are for binary mode
+        self.voidcmd('TYPE I')
+
+
+def _call(conn, func, *args):
+    """Call func(*args), logging in again and calling it once more if the server has closed the connection"""
+    try:
+        return func(*args)
+    except (EOFError, ConnectionError, ftplib.error_temp) as e:
+        # 421: service not available, closing control connection
+        if isinstance(e, ftplib.error_temp) and not str(e).startswith('421'):
+            raise
+        conn.reopen()
+        return func(*args)
+
+
+def _get_path(bucket, fname=None):
+    """Get the path on the server of the file fname in bucket, or of the bucket if fname is None.  The paths are
+       relative to the directory the user logs in to."""
+    if fname is None:
+        return bucket
+    return posixpath.join(bucket, fname)
+
+
 class slFTPBackend(slBackend):
     """class for the FTP backends.
        This class uses FTPlib to connect to a FTP server.
+       The url of the host is the server, with an optional port (host:port), and the buckets are the directories in
+       the directory the user logs in to.  Whole files are transferred with binary RETR / STOR, and parts of files
+       with REST followed by RETR.
     """
     def __init__(self):
         pass
 
-    def connect(self, endpoint, credentials):
-        """Create connection to FTP using the supplied credentials."""
+    def connect(self, endpoint, credentials, host_config={}):
+        """Create connection to FTP using the supplied credentials.  host_config can set passive (default true) and
+        connect_timeout (seconds)."""
+        if endpoint.startswith('ftp://'):
+            endpoint = endpoint[len('ftp://'):]
+        host, _, port = endpoint.rstrip('/').partition(':')
         try:
-            ftp = ftplib.FTP(endpoint,
-                             user=credentials["user"],
-                             passwd=credentials["password"])
+            ftp = slFTPConnection(host, int(port) if port else 21, credentials,
+                                  passive=host_config.get('passive', True),
+                                  timeout=host_config.get('connect_timeout'))
         except Exception as e:
-            raise slIOException("Could not connect to FTP endpoint {} {}",
-                                endpoint, e)
+            raise slIOException("Could not connect to FTP endpoint {} {}".format(endpoint, e))
         return ftp
 
-    def close(conn):
-        """Static function to close a connection passed in."""
-        conn.quit()
+    def close(self, conn):
+        """Close a connection passed in."""
+        try:
+            conn.quit()
+        except (EOFError, OSError, ftplib.Error):
+            conn.close()
 
     def get_id(self):
         return ("slFTPBackend")
+
+    def remove_obj(self,conn,bucket,key):
+        '''
+        Deletes the required key from the backend.
+        '''
+        try:
+            _call(conn, conn.delete, _get_path(bucket, key))
+        except ftplib.error_perm:
+            raise slIOException('Cannot remove object from backend: File not found')
+
+    def download(self,conn,bucket,key,cacheloc):
+        ''' Downloads file from the FTP server to prescribed place in cache.
+        '''
+        def retrieve():
+            with open(cacheloc, 'wb') as fh:
+                conn.retrbinary('RETR ' + _get_path(bucket, key), fh.write, FTP_BLOCK_SIZE)
+        try:
+            _call(conn, retrieve)
+        except ftplib.error_perm:
+            raise slIOException('Cannot download object: File not found')
+
+    def create_bucket(self,conn,bucket):
+        ''' Creates bucket.
+
+        :param bucket:
+        :return:
+        '''
+        _call(conn, conn.mkd, _get_path(bucket))
+        conn.directories.add(_get_path(bucket))
+
+    def _make_dirs(self,conn,path):
+        # create the directories for the file at path, that are not known to exist
+        directory = posixpath.dirname(path)
+        missing = []
+        while directory and directory not in conn.directories:
+            missing.append(directory)
+            directory = posixpath.dirname(directory)
+        for directory in reversed(missing):
+            try:
+                conn.mkd(directory)
+            except ftplib.error_perm:
+                # already exists
+                pass
+            conn.directories.add(directory)
+
+    def _store(self,conn,fh,path):
+        self._make_dirs(conn, path)
+        conn.storbinary('STOR ' + path, fh, FTP_BLOCK_SIZE)
+
+    def upload(self,conn,cloc,bucket,fname):
+        ''' uploads file to backend
+
+        :param conn:
+        :param cloc:
+        :param bucket:
+        :param fname:
+        :return:
+        '''
+        def store():
+            with open(cloc, 'rb') as fh:
+                self._store(conn, fh, _get_path(bucket, fname))
+        _call(conn, store)
+
+    def upload_data(self,conn,data,bucket,fname):
+        ''' uploads the contents of a file from memory to the backend
+
+        :param conn:
+        :param data: bytes-like object with the contents of the file
+        :param bucket:
+        :param fname:
+        :return:
+        '''
+        _call(conn, lambda: self._store(conn, io.BytesIO(data), _get_path(bucket, fname)))
+
+    def list_buckets(self,conn):
+        try:
+            names = [name for name, facts in _call(conn, lambda: list(conn.mlsd(facts=['type'])))
+                     if facts.get('type') == 'dir']
+        except ftplib.error_perm:
+            # MLSD not supported - every entry in the directory
+            names = [posixpath.basename(name) for name in _call(conn, conn.nlst)]
+        return [{'Name': name} for name in names]
+
+    def get_object_size(self,conn,bucket,fname):
+        return _call(conn, conn.size, _get_path(bucket, fname))
+
+    def object_exists(self,conn,bucket,fname):
+        try:
+            self.get_object_size(conn, bucket, fname)
+            return True
+        except ftplib.error_perm:
+            return False
+
+    def _get_etag(self,conn,path,size):
+        # the modification time of the file from MDTM, with the size, if the server supports it
+        try:
+            mdtm = _call(conn, conn.voidcmd, 'MDTM ' + path)
+        except ftplib.error_perm:
+            return None
+        return '"{}-{}"'.format(mdtm.split()[-1], size)
+
+    def get_head_object(self,conn,bucket,fid):
+        """
+        Returns the size and ETag of a file, as for the head object of S3, or None if the file does not exist.  The
+        ETag is made from the modification time (MDTM) and size of the file.
+        :return:
+        """
+        path = _get_path(bucket, fid)
+        try:
+            size = _call(conn, conn.size, path)
+        except ftplib.error_perm:
+            return None
+        return {'ContentLength': size, 'ETag': self._get_etag(conn, path, size)}
+
+    def _retrieve_range(self,conn,path,start,n_bytes):
+        # REST to the start of the range, RETR and close the data connection once n_bytes have been read
+        if n_bytes <= 0:
+            return b''
+        chunks = []
+        remaining = n_bytes
+        with conn.transfercmd('RETR ' + path, rest=start if start > 0 else None) as sock:
+            while remaining > 0:
+                chunk = sock.recv(min(remaining, FTP_BLOCK_SIZE))
+                if not chunk:
+                    break
+                chunks.append(chunk)
+                remaining -= len(chunk)
+        try:
+            conn.voidresp()
+        except ftplib.error_temp:
+            # 426 / 451 as the transfer was stopped before the end of the file
+            pass
+        return b''.join(chunks)
+
+    def get_partial(self,conn,bucket,fid,start,stop,binary=False):
+        """
+        Returns a partial file defined by bytes
+        :param start: start byte
+        :param stop: stop byte (inclusive)
+        :param binary: return the raw bytes, rather than decoding them as text
+        :return:
+        """
+        try:
+            data = _call(conn, self._retrieve_range, conn, _get_path(bucket, fid), start, stop - start + 1)
+        except ftplib.error_perm:
+            raise slIOException('Cannot read object: File not found')
+        if binary:
+            return data
+        return data.decode('utf8','replace').strip()
+
+    def get_object_info(self,conn,bucket,fid,n_bytes):
+        """
+        Returns the size and ETag of the file (see get_head_object), and its first n_bytes.
+        :param n_bytes: the number of bytes to return from the start of the file
+        :return: dict with 'size', 'etag' and 'data', or None if the file does not exist
+        """
+        head = self.get_head_object(conn, bucket, fid)
+        if head is None:
+            return None
+        size = head['ContentLength']
+        data = _call(conn, self._retrieve_range, conn, _get_path(bucket, fid), 0, min(n_bytes, size))
+        return {'size': size, 'etag': head['ETag'], 'data': data}
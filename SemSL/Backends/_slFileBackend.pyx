@@ -1,2 +1,295 @@
 __copyright__ = "(C) 2012 Science and Technology Facilities Council"
-__license__ = "BSD - see LICENSE file in top-level directory"
\ No newline at end of file
+__license__ = "BSD - see LICENSE file in top-level directory"
+
+import os
+import stat
+import tempfile
+from _slBackend import slBackend
+from SemSL._slExceptions import slIOException, slAPIException
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# the ioctl to clone a file on filesystems that share blocks between files (btrfs, XFS, ...) - see ioctl_ficlone(2)
+FICLONE = 0x40049409
+# how the files are "downloaded" into the cache, the download_method of the host
+DOWNLOAD_METHODS = ('reflink', 'link', 'copy')
+# the largest number of bytes to copy in one call to copy_file_range / sendfile
+COPY_CHUNK_SIZE = 1024 * 1024 * 1024
+
+
+def _reflink(src, dst):
+    """Create or replace dst as a copy-on-write clone of src.  Return False if the filesystem does not support it,
+       leaving dst as it was: an existing dst is not truncated and one that did not exist is removed again."""
+    if fcntl is None:
+        return False
+    created = not os.path.lexists(dst)
+    with open(src, 'rb') as fsrc:
+        fd = os.open(dst, os.O_WRONLY | os.O_CREAT, 0o666)
+        try:
+            fcntl.ioctl(fd, FICLONE, fsrc.fileno())
+            # the clone does not shorten a longer dst
+            os.ftruncate(fd, os.fstat(fsrc.fileno()).st_size)
+            cloned = True
+        except OSError:
+            cloned = False
+        finally:
+            os.close(fd)
+    if not cloned and created:
+        os.remove(dst)
+    return cloned
+
+
+def _new_file_mode():
+    """Get the permissions of a newly created file: 0666 less the umask.  The umask is read from /proc where it is
+       available, as setting the umask to read it is not thread safe."""
+    try:
+        with open('/proc/self/status') as fh:
+            for line in fh:
+                if line.startswith('Umask:'):
+                    return 0o666 & ~int(line.split()[1], 8)
+    except (OSError, ValueError):
+        pass
+    umask = os.umask(0o022)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+def _copy_file(src, dst):
+    """Copy src to dst in the kernel, with copy_file_range (which is itself a clone or a server-side copy on some
+       filesystems) or sendfile, falling back to reading and writing."""
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        fd_in = fsrc.fileno()
+        fd_out = fdst.fileno()
+        size = os.fstat(fd_in).st_size
+        offset = 0
+        if hasattr(os, 'copy_file_range'):
+            try:
+                while offset < size:
+                    n = os.copy_file_range(fd_in, fd_out, min(size - offset, COPY_CHUNK_SIZE), offset, offset)
+                    if n == 0:
+                        break
+                    offset += n
+            except OSError:
+                # e.g. across filesystems on older kernels - carry on from where it stopped
+                pass
+        if offset < size and hasattr(os, 'sendfile'):
+            try:
+                os.lseek(fd_out, offset, os.SEEK_SET)
+                while offset < size:
+                    n = os.sendfile(fd_out, fd_in, offset, min(size - offset, COPY_CHUNK_SIZE))
+                    if n == 0:
+                        break
+                    offset += n
+            except OSError:
+                pass
+        if offset < size:
+            fsrc.seek(offset)
+            fdst.seek(offset)
+            while True:
+                buf = fsrc.read(COPY_CHUNK_SIZE)
+                if not buf:
+                    break
+                fdst.write(buf)
+
+
+class slFileConnection(object):
+    """A "connection" to a directory on a POSIX filesystem: the buckets are the directories in it."""
+    def __init__(self, root, download_method='reflink'):
+        self.root = root
+        self.download_method = download_method
+
+    def get_path(self, bucket, fname=None):
+        """Get the path of the file fname in bucket, or of the bucket if fname is None"""
+        if fname is None:
+            return os.path.join(self.root, bucket)
+        return os.path.join(self.root, bucket, fname)
+
+
+class slFileBackend(slBackend):
+    """Class for the POSIX file SemSL backend.
+       The url of the host is a directory, e.g. on a parallel filesystem, and the buckets are the directories in it.
+       Files are "downloaded" into the cache without copying them where possible, according to the download_method
+       of the host:
+         reflink : a copy-on-write clone of the file, if the filesystem supports it, otherwise a copy (the default)
+         link    : a hard link to the file, if the cache is on the same filesystem, otherwise as reflink.  The copy in
+                   the cache is the file itself, so files opened in 'a' mode are changed in place.
+         copy    : a copy, made with copy_file_range / sendfile
+       With byte_range_reads set for the host the subarray files are read in place, rather than through the cache.
+    """
+    def __init__(self):
+        pass
+
+    def connect(self, url, credentials, host_config={}):
+        """Connect to the directory url.  No credentials are needed."""
+        download_method = host_config.get('download_method', 'reflink')
+        if download_method not in DOWNLOAD_METHODS:
+            raise slAPIException("download_method {} not supported, use one of {}".format(download_method,
+                                                                                          DOWNLOAD_METHODS))
+        if not os.path.isdir(url):
+            raise slIOException("Could not connect to file backend {}: directory does not exist".format(url))
+        return slFileConnection(url, download_method)
+
+    def close(self, conn):
+        """Close a connection passed in."""
+        pass
+
+    def get_id(self):
+        return ("slFileBackend")
+
+    def remove_obj(self,conn,bucket,key):
+        '''
+        Deletes the required key from the backend.
+        '''
+        try:
+            os.remove(conn.get_path(bucket, key))
+        except OSError:
+            raise slIOException('Cannot remove object from backend: File not found')
+
+    def download(self,conn,bucket,key,cacheloc):
+        ''' "Downloads" the file to the prescribed place in the cache, by
+        linking, cloning or copying it, see the download_method of the host.
+        '''
+        path = conn.get_path(bucket, key)
+        if not os.path.isfile(path):
+            raise slIOException('Cannot download object: File not found')
+        # replace, rather than overwrite, an old copy - it may be a link to the file
+        if os.path.lexists(cacheloc):
+            os.remove(cacheloc)
+        if conn.download_method == 'link':
+            try:
+                os.link(path, cacheloc)
+                return
+            except OSError:
+                pass
+        if conn.download_method != 'copy' and _reflink(path, cacheloc):
+            return
+        _copy_file(path, cacheloc)
+
+    def create_bucket(self,conn,bucket):
+        ''' Creates bucket.
+
+        :param bucket:
+        :return:
+        '''
+        os.makedirs(conn.get_path(bucket), exist_ok=True)
+
+    def _replace(self,conn,bucket,fname,write):
+        # write the file to a temporary file next to it and then move it into place, so that the file is never seen
+        # half written, and a link to the file in the cache is not written through
+        path = conn.get_path(bucket, fname)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix='.' + os.path.basename(path), dir=os.path.dirname(path))
+        try:
+            # mkstemp creates the file readable by the user only - give it the permissions of the file it replaces,
+            # or of a new file
+            try:
+                mode = stat.S_IMODE(os.stat(path).st_mode)
+            except FileNotFoundError:
+                mode = _new_file_mode()
+            try:
+                os.fchmod(fd, mode)
+            finally:
+                os.close(fd)
+            write(tmp_path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def upload(self,conn,cloc,bucket,fname):
+        ''' uploads file to backend, by cloning or copying it
+
+        :param conn:
+        :param cloc:
+        :param bucket:
+        :param fname:
+        :return:
+        '''
+        path = conn.get_path(bucket, fname)
+        if os.path.exists(path) and os.path.samefile(cloc, path):
+            # the file in the cache is a link to the file, which has been written in place
+            return
+        def write(tmp_path):
+            if not _reflink(cloc, tmp_path):
+                _copy_file(cloc, tmp_path)
+        self._replace(conn, bucket, fname, write)
+
+    def upload_data(self,conn,data,bucket,fname):
+        ''' uploads the contents of a file from memory to the backend
+
+        :param conn:
+        :param data: bytes-like object with the contents of the file
+        :param bucket:
+        :param fname:
+        :return:
+        '''
+        def write(tmp_path):
+            with open(tmp_path, 'wb') as fh:
+                fh.write(data)
+        self._replace(conn, bucket, fname, write)
+
+    def list_buckets(self,conn):
+        return [{'Name': d} for d in os.listdir(conn.root) if os.path.isdir(os.path.join(conn.root, d))]
+
+    def get_object_size(self,conn,bucket,fname):
+        return os.stat(conn.get_path(bucket, fname)).st_size
+
+    def object_exists(self,conn,bucket,fname):
+        return os.path.isfile(conn.get_path(bucket, fname))
+
+    def get_head_object(self,conn,bucket,fid):
+        """
+        Returns the size and ETag of a file, as for the head object of S3, or None if the file does not exist.  The
+        ETag is made from the modification time and inode of the file.
+        :return:
+        """
+        try:
+            stat = os.stat(conn.get_path(bucket, fid))
+        except OSError:
+            return None
+        return {'ContentLength': stat.st_size, 'ETag': '"{:x}-{:x}"'.format(stat.st_mtime_ns, stat.st_ino)}
+
+    def get_partial(self,conn,bucket,fid,start,stop,binary=False):
+        """
+        Returns a partial file defined by bytes
+        :param start: start byte
+        :param stop: stop byte (inclusive)
+        :param binary: return the raw bytes, rather than decoding them as text
+        :return:
+        """
+        fd = os.open(conn.get_path(bucket, fid), os.O_RDONLY)
+        try:
+            data = os.pread(fd, stop - start + 1, start)
+        finally:
+            os.close(fd)
+        if binary:
+            return data
+        return data.decode('utf8','replace').strip()
+
+    def get_object_info(self,conn,bucket,fid,n_bytes):
+        """
+        Returns the size and ETag of the file, and its first n_bytes, see get_head_object.
+        :param n_bytes: the number of bytes to return from the start of the file
+        :return: dict with 'size', 'etag' and 'data', or None if the file does not exist
+        """
+        try:
+            fd = os.open(conn.get_path(bucket, fid), os.O_RDONLY)
+        except OSError:
+            return None
+        try:
+            stat = os.fstat(fd)
+            data = os.pread(fd, n_bytes, 0)
+        finally:
+            os.close(fd)
+        return {'size': stat.st_size, 'etag': '"{:x}-{:x}"'.format(stat.st_mtime_ns, stat.st_ino), 'data': data}
+
+    def get_range_url(self,conn,bucket,fid,expires=3600):
+        """
+        Returns the path of the file, so that the netCDF library reads the parts of the file that are sliced in place,
+        rather than the file being "downloaded" into the cache.
+        :return:
+        """
+        return conn.get_path(bucket, fid)
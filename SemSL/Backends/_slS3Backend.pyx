@@ -2,12 +2,58 @@ __copyright__ = "(C) 2012 Science and Technology Facilities Council"
 __license__ = "BSD - see LICENSE file in top-level directory"
 
 import boto3
+import io
+import weakref
 from botocore.exceptions import ClientError
-from SemSL._slExceptions import slIOException
 from botocore.client import Config
+from boto3.s3.transfer import TransferConfig
 from _slBackend import slBackend
 from SemSL._slExceptions import slIOException, slAPIException
 
+# the transfer settings if they are not in the host config.  multipart_threshold defaults to the object_size of the
+# host, so that the subarray files of CFA files are uploaded with a single PUT, as they are uploaded in parallel
+DEFAULT_MULTIPART_THRESHOLD = 64 * 1024 * 1024
+DEFAULT_MULTIPART_CHUNKSIZE = 16 * 1024 * 1024
+DEFAULT_MAX_CONCURRENCY = 10
+# the signature version for the api setting of the host
+SIGNATURE_VERSIONS = {'S3v4': 's3v4', 'S3v2': 's3'}
+
+# the TransferConfig for each client created by connect, used by upload and download
+_transfer_configs = weakref.WeakKeyDictionary()
+
+
+def get_client_config(host_config):
+    """Get the botocore Config for the clients of a host from its settings in ~/.sem-sl.json:
+         api                  : S3v4 or S3v2, the signature version
+         max_pool_connections : the number of HTTP connections each client keeps open, which defaults to the
+                                max_concurrency of the transfers, so that the parts are not queued for a connection
+         retries              : the botocore retry policy, e.g. {"mode": "adaptive", "max_attempts": 10}
+         connect_timeout      : seconds
+         read_timeout         : seconds"""
+    settings = {'max_pool_connections': int(host_config.get('max_pool_connections',
+                                                            max(10, get_transfer_config(host_config).max_concurrency)))}
+    if host_config.get('api') in SIGNATURE_VERSIONS:
+        settings['signature_version'] = SIGNATURE_VERSIONS[host_config['api']]
+    if 'retries' in host_config:
+        settings['retries'] = dict(host_config['retries'])
+    for key in ('connect_timeout', 'read_timeout'):
+        if key in host_config:
+            settings[key] = host_config[key]
+    return Config(**settings)
+
+
+def get_transfer_config(host_config):
+    """Get the boto3 TransferConfig for uploads and downloads from the settings for a host in ~/.sem-sl.json:
+         multipart_threshold : files larger than this are transferred in parts, defaults to the object_size
+         multipart_chunksize : the size of the parts
+         max_concurrency     : the number of parts transferred at once, for each file"""
+    threshold = host_config.get('multipart_threshold', host_config.get('object_size', DEFAULT_MULTIPART_THRESHOLD))
+    return TransferConfig(multipart_threshold=int(threshold),
+                          multipart_chunksize=int(host_config.get('multipart_chunksize', DEFAULT_MULTIPART_CHUNKSIZE)),
+                          max_concurrency=int(host_config.get('max_concurrency', DEFAULT_MAX_CONCURRENCY)),
+                          use_threads=True)
+
+
 class slS3Backend(slBackend):
     """Class for the S3 SemSL backend.
        This class uses boto3 to connect to a S3 object store / AWS.
@@ -15,23 +61,26 @@ class slS3Backend(slBackend):
     def __init__(self):
         pass
 
-    def connect(self, endpoint, credentials):
+    def connect(self, endpoint, credentials, host_config={}):
         """Create connection to object store / AWS, using the supplied
-        credentials."""
-        #config = Config(connect_timeout=10, retries={'max_attempts': 0})
+        credentials.  The client and the transfers are tuned with the settings
+        in host_config, see get_client_config and get_transfer_config."""
         try:
             s3c = boto3.client("s3", endpoint_url=endpoint,
                                aws_access_key_id=credentials['access_key'],
-                               aws_secret_access_key=credentials['secret_key'])
+                               aws_secret_access_key=credentials['secret_key'],
+                               config=get_client_config(host_config))
         except Exception as e:
             raise slIOException("Could not connect to S3 endpoint {} {}",
                                 endpoint, e)
+        _transfer_configs[s3c] = get_transfer_config(host_config)
         return s3c
 
-    def close(self):
-        """Static function to close a connection passed in."""
-        # boto3 doesn't have a close connection method!
-        pass
+    def close(self, conn):
+        """Close a connection passed in."""
+        # older versions of boto3 don't have a close connection method
+        if hasattr(conn, "close"):
+            conn.close()
 
     def get_id(self):
         return ("slS3Backend")
@@ -49,7 +98,8 @@ class slS3Backend(slBackend):
         ''' Downloads file from OS to prescribed place in cache.
         '''
         try:
-            conn.download_file(bucket, key, cacheloc)# only works with boto3 client objects
+            # only works with boto3 client objects
+            conn.download_file(bucket, key, cacheloc, Config=_transfer_configs.get(conn))
         except ClientError:
             raise slIOException('Cannot download object: File not found')
 
@@ -70,7 +120,19 @@ class slS3Backend(slBackend):
         :param fname:
         :return:
         '''
-        conn.upload_file(cloc,bucket,fname)
+        conn.upload_file(cloc,bucket,fname,Config=_transfer_configs.get(conn))
+
+    def upload_data(self,conn,data,bucket,fname):
+        ''' uploads the contents of a file from memory to the backend, as a
+        single PUT or in parts, as for upload
+
+        :param conn:
+        :param data: bytes-like object with the contents of the file
+        :param bucket:
+        :param fname:
+        :return:
+        '''
+        conn.upload_fileobj(io.BytesIO(data),bucket,fname,Config=_transfer_configs.get(conn))
 
     def list_buckets(self,conn):
         return conn.list_buckets()['Buckets']
@@ -95,14 +157,55 @@ class slS3Backend(slBackend):
         return conn.head_object(Bucket=bucket,Key=fid)
 
 
-    def get_partial(self,conn,bucket,fid,start,stop):
+    def get_partial(self,conn,bucket,fid,start,stop,binary=False):
         """
         Returns a partial file defined by bytes
         :param start: start byte
-        :param stop: stop byte
+        :param stop: stop byte (inclusive)
+        :param binary: return the raw bytes, rather than decoding them as text
         :return:
         """
         s3_object  = conn.get_object(Bucket=bucket,Key=fid, Range='bytes={}-{}'.format(start,stop))
         body = s3_object['Body']
+        if binary:
+            return body.read()
         return body.read().decode('utf8','replace').strip()
 
+    def get_object_info(self,conn,bucket,fid,n_bytes):
+        """
+        Returns the size and ETag of the object, and its first n_bytes, with a single ranged GET request, rather than a
+        HEAD request followed by a GET.  The size of the object is taken from the Content-Range of the response.
+        :param n_bytes: the number of bytes to return from the start of the object
+        :return: dict with 'size', 'etag' and 'data', or None if the object does not exist
+        """
+        try:
+            s3_object = conn.get_object(Bucket=bucket, Key=fid, Range='bytes=0-{}'.format(n_bytes-1))
+        except ClientError as e:
+            code = e.response.get('Error', {}).get('Code')
+            if code in ('NoSuchKey', '404'):
+                return None
+            if code != 'InvalidRange':
+                raise
+            # a zero length object cannot satisfy the range
+            head = conn.head_object(Bucket=bucket, Key=fid)
+            return {'size': head['ContentLength'], 'etag': head.get('ETag'), 'data': b''}
+        data = s3_object['Body'].read()
+        content_range = s3_object.get('ContentRange')
+        if content_range:
+            # bytes <start>-<stop>/<size>
+            size = int(content_range.split('/')[-1])
+        else:
+            # the range was ignored and the whole object returned
+            size = s3_object['ContentLength']
+        return {'size': size, 'etag': s3_object.get('ETag'), 'data': data[:n_bytes]}
+
+    def get_range_url(self,conn,bucket,fid,expires=3600):
+        """
+        Returns a URL for the object that the netCDF library can open in byte-range mode, i.e. the parts of the file
+        that are read are fetched with HTTP Range GETs.  The URL is presigned so that no credentials are needed.
+        :param expires: time in seconds that the URL is valid for
+        :return:
+        """
+        url = conn.generate_presigned_url('get_object', Params={'Bucket': bucket, 'Key': fid}, ExpiresIn=expires)
+        return url + '#mode=bytes'
+
@@ -13,12 +13,15 @@ from SemSL._CFAFunctions import *
 from psutil import virtual_memory
 
 from SemSL._slConfigManager import slConfig
-from SemSL._baseInterface import _baseInterface as interface
+from SemSL._threadInterface import _threadInterface as interface
 from SemSL._slCacheDB import slCacheDB_lmdb as slCacheDB
 #from SemSL._slCacheDB import slCacheDB_lmdb_nest as slCacheDB
 #from SemSL._slCacheDB import slCacheDB_lmdb_obj as slCacheDB
 #from SemSL._slCacheDB import slCacheDB_sql as slCacheDB
-from SemSL._slCacheManager import slCacheManager as slCache
+from SemSL._slCacheManager import slCacheManager as slCache, release_memory
+from SemSL._slFileHandles import slFileHandles, DEFAULT_OPEN_FILE_HANDLES, DISKLESS_INITIAL_SIZE
+from SemSL._slScratchBuffers import slScratchBuffers
+from SemSL._slWriteBuffer import slWriteBuffer, DEFAULT_WRITE_BUFFER_SIZE
 from SemSL._slExceptions import slConfigFileException, slIOException, slNetCDFException
 
 
@@ -26,6 +29,7 @@ import SemSL._slUtils as slU
 
 import os
 import itertools
+import weakref
 from collections import OrderedDict, deque
 
 # these are class attributes that only exist at the python level (not in the netCDF file).
@@ -71,32 +75,49 @@ class slDataset(object):
         # list of subfiles accessed since intialistion
         self.subfiles_accessed = deque()
 
+        # the subarray files that are kept open between reads / writes of the variables, or created in memory for
+        # diskless files on a backend
+        self._file_handles = slFileHandles(self._sl_config['system'].get('open_file_handles',
+                                                                         DEFAULT_OPEN_FILE_HANDLES),
+                                           self._file_details.diskless)
+        # the memmaps in the cache for slices too large to read into memory
+        self._scratch_buffers = slScratchBuffers()
+        # the size of the write-back buffer of each variable, and the variables (in groups as well) to flush
+        self._write_buffer_size = self._sl_config['system'].get('write_buffer_size', DEFAULT_WRITE_BUFFER_SIZE)
+        self._buffered_variables = []
+
         DB = slCacheDB()
         slC = slCache()
 
         self.mode = mode
 
+        # the CFA metadata parsed by a previous open of the file, and the names of the variables that were parsed
+        self._parsed_cfa_file = None
+        self._parsed_cfa_vars = None
+        self._cfa_validator = None
+
         # switch on the read / write / append mode
         if mode == 'r' or mode == 'a' or mode == 'r+':             # read
+            # the saved CFA metadata is loaded by get_netCDF_file_details, before the master file is fetched into the
+            # cache, so that if the master file has changed its copy in the cache is replaced
+            self._parsed_cfa_file = self._file_details.parsed_cfa_file
+            self._cfa_validator = self._file_details.validator
             # check whether the memory has been set from get_netCDF_file_details (i.e. the file is streamed to memory)
-
-            c_file = slC.open(filename, mode)
-            #self.ncD = netCDF4.Dataset(c_file, mode)
-            if self._file_details.memory != "" or diskless:
-                # we have to first create the dummy file (name held in file_details.memory) - check it exists before creating it
-                if not os.path.exists(self._file_details.filename):
-                    temp_file = netCDF4.Dataset(c_file, 'w', format=self._file_details.format).close()
-                    # create the netCDF4 dataset from the data, using the temp_file
-                    self.ncD = netCDF4.Dataset( self._file_details.filename, mode=mode, clobber=clobber,
-                                         format=self._file_details.format, diskless=True, persist=False,
-                                         keepweakref=keepweakref, memory=self._file_details.memory, **kwargs)
-                    self.variables = self.ncD.variables
+            if self._file_details.memory != "":
+                # the file name in the cache is only used as the name of the dataset
+                memory = self._file_details.memory
+                self.ncD = netCDF4.Dataset(self._file_details.filename, mode=mode, keepweakref=keepweakref,
+                                           memory=memory, **kwargs)
+                # the memory is returned to the budget once the dataset has been closed and freed
+                weakref.finalize(self.ncD, release_memory, len(memory))
             else:
-                # not in memory but has been streamed to disk
+                # not in memory but has been streamed to disk, or is on POSIX disk - diskless reads a POSIX file into
+                # memory
+                c_file = self._get_cache_file(filename, mode)
                 self.ncD = netCDF4.Dataset(c_file, mode=mode, clobber=clobber,
-                                         format=self._file_details.format, diskless=False, persist=persist,
-                                         keepweakref=keepweakref, memory=None, **kwargs)
-                self.variables = self.ncD.variables
+                                         format=self._file_details.format, diskless=diskless and mode == 'r',
+                                         persist=persist, keepweakref=keepweakref, memory=None, **kwargs)
+            self.variables = self.ncD.variables
 
             # check if file is a CFA file, for standard netCDF files
             try:
@@ -108,17 +129,23 @@ class slDataset(object):
             if cfa:
                 # Get the host name in order to get the specific settings
                 try:
-                    host_name = slU._get_hostname(self._file_details.filename)
+                    host_name = slU._get_hostname(self._file_details.s3_uri or self._file_details.filename)
                     obj_size = self._sl_config['hosts'][host_name]['object_size']
                     read_threads = self._sl_config['hosts'][host_name]['read_connections']
                     write_threads = self._sl_config['hosts'][host_name]['write_connections']
-                except slConfigFileException:
+                except (KeyError, slConfigFileException):
                     obj_size = 0
                     read_threads = 1
                     write_threads = 1
-                # Parse the CFA metadata from this class' metadata
-                self._file_details.cfa_file = CFAFile()
-                self._file_details.cfa_file.parse(self)
+                # Parse the CFA metadata from this class' metadata, or use the metadata parsed by a previous open
+                if self._parsed_cfa_file is not None:
+                    self._file_details.cfa_file = self._parsed_cfa_file
+                    self._parsed_cfa_vars = self._get_parsed_cfa_vars()
+                else:
+                    if mode == 'r' and self._cfa_validator is None:
+                        self._cfa_validator = slC.get_validator(self._get_fid())
+                    self._file_details.cfa_file = CFAFile()
+                    self._file_details.cfa_file.parse(self)
                 self._file_details.cfa_file.format = self._file_details.format
                 # recreate the variables as s3Variables and attach the cfa data
 
@@ -131,7 +158,11 @@ class slDataset(object):
                                                              'max_object_size_for_memory' : obj_size,
                                                              'read_threads' : read_threads,
                                                              'write_threads' : write_threads,
-                                                             'mode': mode})
+                                                             'mode': mode,
+                                                             'file_handles': self._file_handles,
+                                                             'scratch_buffers': self._scratch_buffers,
+                                                             'write_buffer_size': self._write_buffer_size,
+                                                             'buffered_variables': self._buffered_variables})
 
                         self._variables_overwritten_by_cfa[v] = self.variables[v]
 
@@ -162,23 +193,27 @@ class slDataset(object):
                 self._file_details.cfa_file = None
                 cfa = None
 
-            # if the file is diskless and an S3 file then we have to persist so that we can upload the file to S3
-            if self._file_details.s3_uri != "" and diskless:
-                persist = True
-            c_file = slC.open(filename,mode)
-            self.ncD = netCDF4.Dataset(c_file, mode=mode, clobber=clobber,
-                                     format=self._file_details.format, diskless=diskless, persist=persist,
-                                     keepweakref=keepweakref, memory=None, **kwargs)
+            c_file = self._get_cache_file(filename, mode)
+            if self._file_details.diskless:
+                # a diskless file on a backend is created in memory and uploaded from there on close, so that
+                # nothing is written to the cache
+                self.ncD = netCDF4.Dataset(c_file, mode=mode, clobber=clobber,
+                                         format=self._file_details.format, keepweakref=keepweakref,
+                                         memory=DISKLESS_INITIAL_SIZE, **kwargs)
+            else:
+                self.ncD = netCDF4.Dataset(c_file, mode=mode, clobber=clobber,
+                                         format=self._file_details.format, diskless=diskless, persist=persist,
+                                         keepweakref=keepweakref, memory=None, **kwargs)
             self.variables = self.ncD.variables
 
             if cfa:
                 # Get the host name in order to get the specific settings
                 try:
-                    host_name = slU._get_hostname(self._file_details.filename)
+                    host_name = slU._get_hostname(self._file_details.s3_uri or self._file_details.filename)
                     obj_size = self._sl_config['hosts'][host_name]['object_size']
                     read_threads = self._sl_config['hosts'][host_name]['read_connections']
                     write_threads = self._sl_config['hosts'][host_name]['write_connections']
-                except slConfigFileException:
+                except (KeyError, slConfigFileException):
                     obj_size = 0
                     read_threads = 1
                     write_threads = 1
@@ -196,7 +231,11 @@ class slDataset(object):
                                                              'max_object_size_for_memory' : obj_size,
                                                              'read_threads' : read_threads,
                                                              'write_threads' : write_threads,
-                                                             'mode' : mode})
+                                                             'mode' : mode,
+                                                             'file_handles' : self._file_handles,
+                                                             'scratch_buffers' : self._scratch_buffers,
+                                                             'write_buffer_size' : self._write_buffer_size,
+                                                             'buffered_variables' : self._buffered_variables})
                         self.variables[v] = self._cfa_variables[v]
             else:
                 self._file_details.cfa_file = None
@@ -280,17 +319,17 @@ class slDataset(object):
 
                 # Get the host name in order to get the obj size, otherwise refer to default
                 try:
-                    host_name = slU._get_hostname(self._file_details.filename)
+                    host_name = slU._get_hostname(self._file_details.s3_uri or self._file_details.filename)
                     obj_size = self._sl_config['hosts'][host_name]['object_size']
                     read_threads = self._sl_config['hosts'][host_name]['read_connections']
                     write_threads = self._sl_config['hosts'][host_name]['write_connections']
-                except slConfigFileException:
+                except (KeyError, slConfigFileException):
                     obj_size = 0
                     obj_size = self._sl_config['system']['default_object_size']
                     read_threads = 1
                     write_threads = 1
 
-                # create the partitions, i.e. a list of CFAPartition, and get the partition shape
+                # create the partitions, i.e. a CFAPartitionTable, and get the partition shape
                 # get the max file size from the s3ClientConfig
 
                 base_filename = self.filename.replace('.nc','')
@@ -351,7 +390,11 @@ class slDataset(object):
                               'max_object_size_for_memory' : obj_size,
                               'write_threads' : write_threads,
                               'read_threads' : read_threads,
-                              'mode':self.mode}
+                              'mode':self.mode,
+                              'file_handles' : self._file_handles,
+                              'scratch_buffers' : self._scratch_buffers,
+                              'write_buffer_size' : self._write_buffer_size,
+                              'buffered_variables' : self._buffered_variables}
 
                 # create the s3Variable which is a reimplementation of the netCDF4 variable
                 self._cfa_variables[varname] = slVariable(var, self._file_details.cfa_file,
@@ -367,6 +410,7 @@ class slDataset(object):
 
         sl_config = slConfig()
 
+        self._flush_variables()
         subfiles = self.get_subfiles_accessed()
 
         if (self._file_details.filemode == 'w' or
@@ -378,12 +422,46 @@ class slDataset(object):
                     self.setncattr("Conventions", conv_attrs + " CFA-0.4")
                 except:
                     self.setncattr("Conventions", "CFA-0.4")
-        netCDF4.Dataset.close(self.ncD)
+        memory = netCDF4.Dataset.close(self.ncD)
+        # close the subarray files before they are uploaded
+        memory_files = self._file_handles.close()
+        self._scratch_buffers.close()
         slC = slCache()
-        if self._file_details.s3_uri == '':
-            slC.close(self._file_details.filename,self.mode,subfiles)
+        if self._file_details.diskless:
+            # upload the master file and the subarray files from memory
+            fids = {slC._get_cache_path(f): f for f in subfiles}
+            memory_files = {fids[path]: m for path, m in memory_files.items() if path in fids}
+            memory_files[self._get_fid()] = memory
+            slC.close(self._get_fid(),self.mode,subfiles,memory_files=memory_files)
         else:
-            slC.close(self._file_details.s3_uri,self.mode,subfiles)
+            slC.close(self._get_fid(),self.mode,subfiles)
+
+        # save the parsed CFA metadata for the next open, if any more of it has been parsed
+        if (self.mode == 'r' and isinstance(self._file_details.cfa_file, CFAFile) and
+                self._get_parsed_cfa_vars() != self._parsed_cfa_vars):
+            slC.save_parsed(self._get_fid(), self._file_details.cfa_file, self._cfa_validator)
+
+    def _flush_variables(self):
+        """Write the values in the write-back buffers of the variables to the subarray files"""
+        for v in self._buffered_variables:
+            v.flush()
+
+    def _get_fid(self):
+        """Get the id of the file for the cache manager - the s3 uri for files on a backend or the path to the file"""
+        if self._file_details.s3_uri == '':
+            return self._file_details.filename
+        return self._file_details.s3_uri
+
+    def _get_cache_file(self, filename, mode):
+        """Get the path to open with netCDF4 - files on a backend have already been opened in the cache by
+           get_netCDF_file_details, so only POSIX paths are checked by the cache manager"""
+        if self._file_details.s3_uri == '':
+            return self.slC.open(filename, mode)
+        return self._file_details.filename
+
+    def _get_parsed_cfa_vars(self):
+        """Get the set of the CFA variables whose metadata has been parsed"""
+        return set(v for v, cfa_var in self._file_details.cfa_file.cfa_vars.items() if cfa_var.is_parsed())
 
     def flush(self):
         return self.sync()
@@ -468,6 +546,7 @@ class slDataset(object):
             Syncs the open dataset to disk and backend as required.
         """
 
+        self._flush_variables()
         subfiles = self.get_subfiles_accessed()
 
         if not self._file_details.s3_uri == '':
@@ -480,6 +559,8 @@ class slDataset(object):
         else:
             self.ncD.sync()
             self.sync_subfiles()
+            # close the subarray files before they are uploaded
+            self._file_handles.close()
             self.slC.close(self._file_details.s3_uri,self.mode,subfiles)
 
         # All subfiles are up to date to clear the list of accessed files
@@ -498,7 +579,8 @@ class slDataset(object):
     def createGroup(self,groupname):
         _group = self.ncD.createGroup(groupname)
 
-        return slGroup(groupname,_group,self._file_details,self.dimensions,self.ncD,self.mode)
+        return slGroup(groupname,_group,self._file_details,self.dimensions,self.ncD,self.mode,self._file_handles,
+                       self._scratch_buffers,self._buffered_variables)
 
     def createVLType(self, datatype, datatype_name):
         return self.ncD.createVLType(datatype,datatype_name)
@@ -558,8 +640,9 @@ class slDataset(object):
         return self.ncD.renameAttribute(oldname,newname)
 
     def close_subfiles(self,file_list):
+        # the files are left open in the cache of open subarray files
         for file in file_list:
-            file.close()
+            self._file_handles.release(file)
 
     def upload_subfiles(self,file_list):
         # upload sub files in bulk, won't do anything if posix files are passed to it
@@ -600,12 +683,17 @@ class slDataset(object):
                 [subfiles.append(i) for i in slist if ".nc" in i]
 
             for file in subfiles:
-                if self.slC._check_whether_posix(file, 'a') == 'Alias exists':
+                if self._file_details.diskless:
+                    # only the subarray files that have been written exist, in memory
+                    if self._file_handles.is_open(self.slC._get_cache_path(file)):
+                        cache_locs.append(self.slC._get_cache_path(file))
+                        all_open_files.append(self.slC._get_cache_path(file))
+                elif self.slC._check_whether_posix(file, 'a') == 'Alias exists':
                     # Build download list
                     if not self.slC.DB.check_cache(file):
                         files_for_download.append(file)
-                    # create list of the paths for each file in the cache
-                    cache_loc = self.slC.DB.get_cache_loc(file)
+                    # create list of the paths for each file in the cache (they may not be downloaded yet)
+                    cache_loc = self.slC._get_cache_path(file)
                     cache_locs.append(cache_loc)
                     all_open_files.append(cache_loc)
                 # if it is a posix file might as well append
@@ -621,7 +709,7 @@ class slDataset(object):
 
             # add any posix files
             for file in posix_files:
-                sf = netCDF4.Dataset(file,'a')
+                sf = self._file_handles.acquire(file,'a')
                 sfs.append(sf)
                 svs.append(sf.variables[var])
                 # check for groups and group vars
@@ -631,8 +719,8 @@ class slDataset(object):
 
             # now add the downloaded vars
             for file in cache_locs:
-                # need to open each subfile
-                sf = netCDF4.Dataset(file,'a')
+                # need to open each subfile, or get it from the open subarray files
+                sf = self._file_handles.acquire(file,'a')
                 sfs.append(sf)
                 svs.append(sf.variables[var])
                 # check for groups and group vars
@@ -643,6 +731,7 @@ class slDataset(object):
         return svs, sfs, sgs, all_open_files, subfiles
 
     def renameDimension(self,oldname,newname):
+        self._flush_variables()
         self.ncD.renameDimension(oldname,newname)
         self.ncD.renameVariable(oldname,newname)
 
@@ -657,6 +746,7 @@ class slDataset(object):
             self.subfiles_accessed.extend(subfiles)
 
     def renameGroup(self,oldname,newname):
+        self._flush_variables()
         self.ncD.renameGroup(oldname,newname)
 
         if self._file_details.cfa_file is not None:
@@ -674,6 +764,10 @@ class slDataset(object):
             os.rename(file, new_path_name)
 
     def renameVariable(self,oldname,newname):
+        self._flush_variables()
+        if self._file_details.diskless and self._file_details.cfa_file is not None:
+            # the subarray files are renamed on disk
+            raise slIOException("Variables in diskless CFA files cannot be renamed.")
         # rename the required variable
         self.ncD.renameVariable(oldname,newname) # this doesn't work for cfa variables
 
@@ -684,6 +778,8 @@ class slDataset(object):
             for sf in sfs:
                 sf.renameVariable(oldname,newname)
             self.close_subfiles(sfs)
+            # the files can't be left open when they are renamed
+            self._file_handles.close()
 
             # Need to rename the files in cache or if posix files
             # new files is a list of the changed subfiles for posix and and backend path
@@ -741,7 +837,8 @@ class slGroup(object):
      attribute to say which group it is in, for rebuilds?
     """
 
-    def __init__(self, groupname, _group, _file_details,_dims,_parent, mode):
+    def __init__(self, groupname, _group, _file_details,_dims,_parent, mode, _file_handles=None,
+                 _scratch_buffers=None, _buffered_variables=None):
         self.groupname = groupname
         self._group = _group
         self._file_details = _file_details
@@ -750,6 +847,21 @@ class slGroup(object):
         self._nc_parent = _parent
         self._sl_config = slConfig()
         self.mode = mode
+        # the open subarray files of the slDataset
+        if _file_handles is None:
+            _file_handles = slFileHandles(self._sl_config['system'].get('open_file_handles',
+                                                                        DEFAULT_OPEN_FILE_HANDLES))
+        self._file_handles = _file_handles
+        if _scratch_buffers is None:
+            _scratch_buffers = slScratchBuffers()
+        self._scratch_buffers = _scratch_buffers
+        # the variables with a write-back buffer are flushed by the slDataset, without one the subarray files are
+        # written on each assignment
+        if _buffered_variables is None:
+            self._write_buffer_size = 0
+        else:
+            self._write_buffer_size = self._sl_config['system'].get('write_buffer_size', DEFAULT_WRITE_BUFFER_SIZE)
+        self._buffered_variables = _buffered_variables
 
 
 
@@ -802,17 +914,17 @@ class slGroup(object):
 
                 # Get the host name in order to get the obj size, otherwise refer to default
                 try:
-                    host_name = slU._get_hostname(self._file_details.filename)
+                    host_name = slU._get_hostname(self._file_details.s3_uri or self._file_details.filename)
                     obj_size = self._sl_config['hosts'][host_name]['object_size']
                     read_threads = self._sl_config['hosts'][host_name]['read_connections']
                     write_threads = self._sl_config['hosts'][host_name]['write_connections']
-                except slConfigFileException:
+                except (KeyError, slConfigFileException):
                     obj_size = 0
                     obj_size = self._sl_config['system']['default_object_size']
                     read_threads = 1
                     write_threads = 1
 
-                # create the partitions, i.e. a list of CFAPartition, and get the partition shape
+                # create the partitions, i.e. a CFAPartitionTable, and get the partition shape
                 # get the max file size from the s3ClientConfig
 
                 base_filename = self._file_details.filename.replace('.nc', '')
@@ -884,7 +996,11 @@ class slGroup(object):
                               'write_threads': write_threads,
                               'read_threads': read_threads,
                               'mode': self.mode,
-                              'nc_parent': self._nc_parent}
+                              'nc_parent': self._nc_parent,
+                              'file_handles': self._file_handles,
+                              'scratch_buffers': self._scratch_buffers,
+                              'write_buffer_size': self._write_buffer_size,
+                              'buffered_variables': self._buffered_variables}
 
                 self._file_details.cfa_file.groups = dict(self._nc_parent.groups)
                 # create the s3Variable which is a reimplementation of the netCDF4 variable
@@ -914,7 +1030,8 @@ class slGroup(object):
     def createGroup(self,groupname):
         _group = self._group.createGroup(groupname)
 
-        return slGroup(groupname, _group, self._file_details, self._nc_parent.dimensions, self._nc_parent, self.mode)
+        return slGroup(groupname, _group, self._file_details, self._nc_parent.dimensions, self._nc_parent, self.mode,
+                       self._file_handles, self._scratch_buffers, self._buffered_variables)
 
     def createVLType(self):
         pass
@@ -1037,13 +1154,19 @@ class slGroup(object):
         return self._group.variables
 
 
+def _get_elem_shape(subset_shape, elem_orders):
+    """Get the shape of a selection in the order of elem, i.e. including any repeated indices, from the shape of the
+       filled slices and the orders returned by fill_selection"""
+    return [n if o is None or type(o) is slice else len(o) for n, o in zip(subset_shape, elem_orders)]
+
+
 class slVariable(object):
     """
       Reimplement the UniData netCDF4 Variable class and override some key methods so as to enable CFA and S3 functionality
     """
 
     _private_atts = ["_cfa_var", "_nc_var", "_cfa_file", "_init_params","subfiles_accessed",
-                     "slC","_varid", "chartostring","_changed_attrs"]
+                     "slC","_varid", "chartostring","_changed_attrs","_write_buffer"]
 
     def __init__(self, nc_var, cfa_file, cfa_var, init_params = {}):
         """Keep a reference to the nc_file, nc_var and cfa_var"""
@@ -1056,6 +1179,10 @@ class slVariable(object):
         self._varid = nc_var._varid
         self.chartostring = nc_var.chartostring
         self._changed_attrs = False
+        # the assignments to the variable that have not been written to the subarray files yet
+        self._write_buffer = slWriteBuffer(init_params.get('write_buffer_size', 0))
+        if init_params.get('buffered_variables') is not None:
+            init_params['buffered_variables'].append(self)
 
     def _accessed_subfiles(self):
         return self.subfiles_accessed
@@ -1070,8 +1197,12 @@ class slVariable(object):
         return self._nc_var.__unicode__()
 
     def close_subfiles(self,file_list):
+        file_handles = self._init_params.get('file_handles')
         for file in file_list:
-            file.close()
+            if file_handles is None:
+                file.close()
+            else:
+                file_handles.release(file)
 
     def upload_subfiles(self,file_list):
         # upload sub files in bulk, won't do anything if posix files are passed to it
@@ -1112,8 +1243,8 @@ class slVariable(object):
                 # Build download list
                 if not self.slC.DB.check_cache(file):
                     files_for_download.append(file)
-                # create list of the paths for each file in the cache
-                cache_loc = self.slC.DB.get_cache_loc(file)
+                # create list of the paths for each file in the cache (they may not be downloaded yet)
+                cache_loc = self.slC._get_cache_path(file)
                 cache_locs.append(cache_loc)
                 all_open_files.append(cache_loc)
             # if it is a posix file might as well append
@@ -1131,19 +1262,26 @@ class slVariable(object):
         # the check for posix files doesn't work if the files don't already exist, i.e on write!
         # add any posix files
         for file in posix_files:
-            sf = netCDF4.Dataset(file,'a')
+            sf = self._open_subfile(file)
             sfs.append(sf)
             svs.append(sf.variables[var])
 
         # now add the downloaded vars
         for file in cache_locs:
             # need to open each subfile
-            sf = netCDF4.Dataset(file,'a')
+            sf = self._open_subfile(file)
             sfs.append(sf)
             svs.append(sf.variables[var])
 
         return svs, sfs, all_open_files
 
+    def _open_subfile(self, file):
+        # open the subfile for appending, from the slDataset's open subarray files if there are any
+        file_handles = self._init_params.get('file_handles')
+        if file_handles is None:
+            return netCDF4.Dataset(file,'a')
+        return file_handles.acquire(file,'a')
+
     @property
     def name(self):
         return self._nc_var.name
@@ -1304,21 +1442,34 @@ class slVariable(object):
 
     def __getitem__(self, elem):
         """Overload the [] operator for getting values from the netCDF variable"""
-        # get the filled slices
-        elem_slices = fill_slices(self.shape, elem)
-        # get the partitions from the slice - created the subset of partitions
-        subset_parts = []
-        # determine which partitions overlap with the indices
-        for p in self._cfa_var.partitions:
-            if partition_overlaps(p, elem_slices):
-                subset_parts.append(p)
+        return self.get(elem)
+
+    def get(self, elem, out=None):
+        """Get the values selected by elem, as for the [] operator.  If out is passed in the values are read into it
+           and it is returned, it must have the shape of the selection.  Otherwise slices that are too large to read
+           into memory are returned in a memmap in the cache, which is reused for the next large slice of the same
+           shape once it is garbage collected."""
+        # the values that have been assigned have to be in the subarray files
+        self.flush()
+        # get the filled slices - these are in increasing order, the orders put the data back into the order of elem
+        elem_slices, elem_orders = fill_selection(self.shape, elem)
         # create the target shape from the elem slices and the size (number of elements)
         subset_size = 1
         subset_shape = []
         for s in elem_slices:
-            dim_size = (s.stop-s.start+1)/s.step
-            subset_shape.append(int(dim_size))
+            dim_size = selection_length(s)
+            subset_shape.append(dim_size)
             subset_size *= dim_size
+        if out is not None and tuple(out.shape) != tuple(_get_elem_shape(subset_shape, elem_orders)):
+            raise ValueError("out has shape {}, the selection has shape {}".format(
+                tuple(out.shape), tuple(_get_elem_shape(subset_shape, elem_orders))))
+        if subset_size == 0:
+            if out is not None:
+                return out
+            return numpy.zeros(subset_shape, dtype=self._nc_var.dtype)
+        # get the partitions from the slice - created the subset of partitions
+        # determine which partitions contain any of the indices
+        subset_parts = get_overlapping_partitions(self._cfa_var, elem_slices)
 
         # calculate the size (in bytes) of the subset of the array
         subset_size *= self._nc_var.dtype.itemsize
@@ -1326,10 +1477,20 @@ class slVariable(object):
         # create the target array
         # this will be a memory mapped array if it is greater than the user_config["max_object_size_for_memory"] or
         # the available memory
-        if subset_size > self._init_params['max_object_size_for_memory'] or subset_size > virtual_memory().available:
+        ordered = all(o is None for o in elem_orders)
+        if out is not None and ordered:
+            # read straight into the output array
+            tgt_arr = out
+        elif subset_size > self._init_params['max_object_size_for_memory'] or subset_size > virtual_memory().available:
             # create a memory mapped array in the cache for the output array
-            mmap_name = self._init_params['cache_location'] + "/" + os.path.basename(subset_parts[0].subarray.file) + "_{}".format(int(numpy.random.uniform(0,1e8)))
-            tgt_arr = numpy.memmap(mmap_name, dtype=self._nc_var.dtype, mode='w+', shape=tuple(subset_shape))
+            scratch_buffers = self._init_params.get('scratch_buffers')
+            if scratch_buffers is None:
+                # the buffer is deleted when it is garbage collected
+                scratch_buffers = slScratchBuffers()
+                tgt_arr = scratch_buffers.get(subset_shape, self._nc_var.dtype)
+                scratch_buffers.close()
+            else:
+                tgt_arr = scratch_buffers.get(subset_shape, self._nc_var.dtype)
         else:
             # create a normal array with no memory map
             tgt_arr = numpy.zeros(subset_shape, dtype=self._nc_var.dtype)
@@ -1337,31 +1498,132 @@ class slVariable(object):
         # create the interface for reading, pass in the target array
         read_interface = interface()
         read_interface.set_read_params(tgt_arr,
-                                       self._init_params['read_threads'])
+                                       self._init_params['read_threads'],
+                                       self._init_params.get('file_handles'))
 
         # use the interface to read the data in
         read_interface.read(subset_parts, elem_slices)
-        return tgt_arr
+        if out is not None and not ordered:
+            out[...] = apply_selection_order(tgt_arr, elem_orders)
+            return out
+        return apply_selection_order(tgt_arr, elem_orders)
 
 
     def __setitem__(self, elem, data):
         """Overload the [] operator for setting values for the netCDF variable"""
         # get the filled slices
-        elem_slices = fill_slices(self.shape, elem)
+        elem_slices, elem_orders = fill_selection(self.shape, elem)
+        subset_shape = [selection_length(s) for s in elem_slices]
+        if 0 in subset_shape:
+            return
+        # put the data into the order of the filled slices
+        if any(o is not None for o in elem_orders):
+            data = numpy.asanyarray(data)
+            if data.ndim > 0:
+                data = remove_selection_order(numpy.broadcast_to(data, _get_elem_shape(subset_shape, elem_orders)),
+                                              elem_orders)
         # get the partitions from the slice - created the subset of partitions
-        subset_parts = deque()
-        # determine which partitions overlap with the indices
-        for p in self._cfa_var.partitions:
-            if partition_overlaps(p, elem_slices):
-                subset_parts.append(p)
+        # determine which partitions contain any of the indices
+        subset_parts = deque(get_overlapping_partitions(self._cfa_var, elem_slices))
+        # broadcast the data to the shape of the filled slices, e.g. for var[t] = field
+        data = numpy.asanyarray(data)
+        if data.shape != tuple(subset_shape):
+            if isinstance(data, numpy.ma.MaskedArray):
+                data = numpy.ma.array(numpy.broadcast_to(data.data, subset_shape),
+                                      mask=numpy.broadcast_to(numpy.ma.getmaskarray(data), subset_shape))
+            else:
+                data = numpy.broadcast_to(data, subset_shape)
+
+        if data.nbytes > self._write_buffer.max_bytes or self._init_params['mode'] == 'r':
+            # too large for the write-back buffer - write it to the subarray files, after the values in the buffer
+            self.flush()
+            self._write_pieces(self._write_buffer.write_through(subset_parts, elem_slices, data))
+        elif self._write_buffer.add(subset_parts, elem_slices, data):
+            self.flush()
 
-        # create the interface for writing, pass in the target array
+    def flush(self):
+        """Write the values in the write-back buffer to the subarray files, each subarray file that has been assigned
+           to is opened and written once.  This is called when the slDataset is synced or closed."""
+        if len(self._write_buffer) > 0:
+            self._write_pieces(self._write_buffer.pop())
+
+    def _write_pieces(self, part_pieces):
+        """Write the (partition, pieces, mode) from the write-back buffer with the write interface"""
+        # create the interface for writing
         write_interface = interface()
         # pass in the required parameters for writing
-        write_interface.set_write_params(data, self._nc_var, self._cfa_var, self._cfa_file,
-                                         self._init_params['write_threads'], self._init_params, self.group())
-        pret = write_interface.write(subset_parts, elem_slices)
+        write_interface.set_write_params(None, self._nc_var, self._cfa_var, self._cfa_file,
+                                         self._init_params['write_threads'], self._init_params, self.group(),
+                                         self._init_params.get('file_handles'))
+        pret = write_interface.write_pieces(part_pieces)
 
         self.subfiles_accessed.extend(pret)
 
+    def iter_partitions(self, prefetch=1):
+        """Iterate over the partitions of the variable, yielding (index, data) for each partition, where index is the
+           tuple of slices of the partition in the variable.  The subarray files of the next prefetch partitions are
+           fetched into the cache while the current one is being processed."""
+        locations = self._get_partition_locations()
+        blocks = []
+        for location in locations:
+            blocks.append(tuple([slice(int(l[0]), int(l[1]) + 1) for l in location]))
+        return self._iter_blocks(blocks, prefetch)
+
+    def iter_chunks(self, axis=0, max_bytes=None, prefetch=1):
+        """Iterate over the variable in blocks along axis, yielding (index, data) for each block, where index is the
+           tuple of slices of the block in the variable.  Each block spans the whole of the other axes and starts and
+           ends on partition boundaries along axis.  Each block contains as many partitions along axis as fit in
+           max_bytes, or one if max_bytes is None.  The subarray files of the next prefetch blocks are fetched into
+           the cache while the current one is being processed."""
+        shape = self.shape
+        ndim = len(shape)
+        if axis < 0:
+            axis += ndim
+        if axis < 0 or axis >= ndim:
+            raise IndexError("axis {} is out of bounds for variable {} with {} dimensions".format(axis, self.name,
+                                                                                                  ndim))
+        locations = self._get_partition_locations()
+        # the boundaries of the partitions along the axis
+        bounds = [int(b) for b in numpy.unique(locations[:, axis, 0]) if 0 < b < shape[axis]]
+        bounds = [0] + bounds + [shape[axis]]
+        # the size of one index along the axis
+        row_bytes = self._nc_var.dtype.itemsize
+        for d in range(0, ndim):
+            if d != axis:
+                row_bytes *= shape[d]
+
+        blocks = []
+        start = 0
+        for b in range(1, len(bounds) - 1):
+            # end the block at this boundary if extending it to the next boundary would exceed max_bytes
+            if max_bytes is None or (bounds[b + 1] - start) * row_bytes > max_bytes:
+                blocks.append((start, bounds[b]))
+                start = bounds[b]
+        blocks.append((start, bounds[-1]))
+        return self._iter_blocks([tuple([slice(None)] * axis + [slice(s, e)] + [slice(None)] * (ndim - axis - 1))
+                                  for s, e in blocks], prefetch)
+
+    def _get_partition_locations(self):
+        """Get the locations of the partitions, see CFAVariable.get_location_index"""
+        locations, grid = self._cfa_var.get_location_index()
+        if locations is None:
+            raise slIOException("Not all the partitions of variable {} have a location.".format(self.name))
+        return locations
+
+    def _iter_blocks(self, blocks, prefetch):
+        """Generator reading each block, a tuple of slices, of the variable, with the subarray files of the next
+           prefetch blocks fetched by the read interface while the current block is being processed."""
+        self.flush()
+        shape = self.shape
+
+        def block_partitions():
+            for index in blocks:
+                yield index, get_overlapping_partitions(self._cfa_var, fill_selection(shape, index)[0])
+
+        prefetch_interface = interface()
+        prefetch_interface.set_read_params(None, self._init_params['read_threads'],
+                                           self._init_params.get('file_handles'))
+        for index in prefetch_interface.prefetch(block_partitions(), prefetch):
+            yield index, self[index]
+
 
@@ -28,8 +28,12 @@
                                                     | pmdimensions   [string]       |
                                                     | pmshape        [int]          |
                                                     | base           string         |
-                                            +-------| partitions     [CFAPartition] |
+                                            +-------| partitions CFAPartitionTable  |
                                             |       +-------------------------------+
+                                            |
+                                            |  (the partitions are held as columns and
+                                            |   a CFAPartition is created for each
+                                            |   partition when it is accessed)
    +-------------------------------+        |
    | CFAPartition                  |<-------+
    +-------------------------------+
@@ -53,6 +57,41 @@ __license__ = "BSD - see LICENSE file in top-level directory"
 import numpy as np
 cimport numpy as np
 import json
+import threading
+from SemSL._slExceptions import CFAException
+
+# lock around the lazy parsing of the cfa_array metadata in CFAVariable
+_parse_lock = threading.Lock()
+# the columns of a CFAPartitionTable, see CFAPartitionTable.columns
+_TABLE_COLUMNS = ("index", "location", "shape", "has_index", "has_location",
+                  "files", "file_ids", "ncvars", "ncvar_ids", "formats", "format_ids")
+
+
+def _pack_attrs(attrs, prefix, arrays):
+    """Add the values of the netCDF attributes in attrs to arrays, as the arrays prefix0, prefix1, ..., and return
+       the list of the attribute names.  Raises TypeError for values that cannot be saved without pickle."""
+    names = []
+    for k, v in attrs.items():
+        value = np.asarray(v)
+        if value.dtype.hasobject:
+            raise TypeError("Cannot save the value of attribute %s" % k)
+        arrays["%s%d" % (prefix, len(names))] = value
+        names.append(k)
+    return names
+
+
+def _unpack_attrs(names, prefix, arrays):
+    """Get the netCDF attributes added to arrays by _pack_attrs"""
+    attrs = {}
+    for i in range(0, len(names)):
+        value = arrays["%s%d" % (prefix, i)]
+        # single values are returned by netCDF as scalars
+        if value.ndim == 0:
+            value = value[()]
+            if isinstance(value, np.str_):
+                value = str(value)
+        attrs[names[i]] = value
+    return attrs
 
 
 cdef class CFAFile:
@@ -77,6 +116,52 @@ cdef class CFAFile:
         self.format = format
 
 
+    def __reduce__(self):
+        """Pickle the CFAFile, without the groups, which are set from the open netCDF file"""
+        return (CFAFile, (self.cfa_dims, self.cfa_metadata, self.cfa_vars, self.format))
+
+
+    cpdef dict arrays(self):
+        """Return the CFAFile as a dictionary of arrays, which can be saved with numpy.savez and loaded without pickle
+           by from_arrays.  The metadata is held as JSON in the "header" array and the partitions as the columns of
+           their tables.  The cfa_array metadata of variables that have not been parsed is kept unparsed.  The groups
+           are not included, as they are set from the open netCDF file."""
+        cdef CFAVariable cfa_var
+        arrays = {}
+        header = {"format"       : self.format,
+                  "cfa_metadata" : _pack_attrs(self.cfa_metadata, "cfa_metadata_", arrays),
+                  "dims"         : [],
+                  "vars"         : []}
+        for i, dim in enumerate(self.cfa_dims.values()):
+            prefix = "dim%d_" % i
+            arrays[prefix + "values"] = np.asarray(dim.values)
+            header["dims"].append({"dim_name" : dim.dim_name,
+                                   "dim_len"  : dim.dim_len,
+                                   "metadata" : _pack_attrs(dim.metadata, prefix + "metadata_", arrays)})
+        for i, cfa_var in enumerate(self.cfa_vars.values()):
+            header["vars"].append(cfa_var._pack("var%d_" % i, arrays))
+        arrays["header"] = np.array(json.dumps(header))
+        return arrays
+
+
+    @staticmethod
+    def from_arrays(arrays):
+        """Create a CFAFile from the dictionary of arrays returned by CFAFile.arrays"""
+        header = json.loads(str(arrays["header"][()]))
+        cfa_file = CFAFile(cfa_metadata=_unpack_attrs(header["cfa_metadata"], "cfa_metadata_", arrays),
+                           format=header["format"])
+        for i, dim_header in enumerate(header["dims"]):
+            prefix = "dim%d_" % i
+            dim = CFADim(dim_name=dim_header["dim_name"], dim_len=dim_header["dim_len"],
+                         metadata=_unpack_attrs(dim_header["metadata"], prefix + "metadata_", arrays))
+            dim.values = arrays[prefix + "values"]
+            cfa_file.cfa_dims[dim.dim_name] = dim
+        for i, var_header in enumerate(header["vars"]):
+            cfa_var = CFAVariable._unpack(var_header, "var%d_" % i, arrays)
+            cfa_file.cfa_vars[cfa_var.var_name] = cfa_var
+        return cfa_file
+
+
     cpdef parse(self, nc_dataset):
         """Parse a netCDF dataset to create the CFA class structures"""
         # check this is a CFA file
@@ -143,16 +228,24 @@ cdef class CFADim:
 cdef class CFAVariable:
     """
        Class containing details of the variables in a CFAFile
+       The cfa_array metadata is not parsed until one of base, pmshape, pmdimensions or partitions is first accessed,
+       so that opening a master array file with many variables and partitions is quick.
     """
 
     cdef public basestring var_name
     cdef public dict metadata
     cdef public basestring cf_role
     cdef public list cfa_dimensions
-    cdef public list pmdimensions
-    cdef public np.ndarray pmshape
-    cdef public basestring base
-    cdef public list partitions
+    cdef list _pmdimensions
+    cdef np.ndarray _pmshape
+    cdef basestring _base
+    cdef CFAPartitionTable _partitions
+    # the unparsed cfa_array metadata
+    cdef object _cfa_array
+    # packed locations of the partitions, see get_location_index
+    cdef object _locations
+    cdef object _partition_grid
+    cdef object _indexed_partitions
 
     def __init__(self, var_name = "",
                  cf_role = "cfa_variable", cfa_dimensions = [],
@@ -165,15 +258,16 @@ cdef class CFAVariable:
         if cfa_dimensions != []:
             self.cfa_dimensions = list(cfa_dimensions)
         if pmdimensions != []:
-            self.pmdimensions = list(pmdimensions)
-        if pmshape != []:
-            self.pmshape = np.array(pmshape, dtype='i')
-        self.base = base
-        self.partitions = list(partitions)
+            self._pmdimensions = list(pmdimensions)
+        if len(pmshape) != 0:
+            self._pmshape = np.array(pmshape, dtype='i')
+        self._base = base
+        self._partitions = CFAPartitionTable.from_partitions(partitions)
 
 
     cpdef parse(self, nc_var):
-        """Parse a netCDF variable that contains CFA metadata"""
+        """Parse a netCDF variable that contains CFA metadata.  The cfa_array metadata is kept and parsed when it is
+           first needed."""
         self.var_name = nc_var.name
 
         # check that it is a CFAVariable - i.e. the metadata is correctly defined
@@ -194,40 +288,409 @@ cdef class CFAVariable:
                 self.cfa_dimensions = nc_var.getncattr(k).split()
             # cfa_array
             elif k == "cfa_array":
-                # cfa is a chunk of JSON so load it
-                cfa_json = json.loads(nc_var.getncattr(k))
-                # check that the partitions are defined in the JSON
-                if not "Partitions" in cfa_json:
-                    raise CFAException("Partitions not defined in %s:cfa_array metadata" % nc_var.name)
-                # load all the data for this class - if it exists
-                if "base" in cfa_json:
-                    self.base = cfa_json["base"]
-                if "pmshape" in cfa_json:
-                    self.pmshape = np.array(cfa_json["pmshape"], dtype='i')
-                if "pmdimensions" in cfa_json:
-                    self.pmdimensions = cfa_json["pmdimensions"]
-                for p in cfa_json["Partitions"]:
-                    cfa_part = CFAPartition()
-                    cfa_part.parse(p)
-                    self.partitions.append(cfa_part)
+                self._cfa_array = nc_var.getncattr(k)
+
+
+    cpdef bint is_parsed(self):
+        """Whether the cfa_array metadata has been parsed"""
+        return self._cfa_array is None
+
+
+    cdef _parse_cfa_array(self):
+        """Parse the cfa_array metadata, if it has not already been parsed"""
+        if self._cfa_array is None:
+            return
+        with _parse_lock:
+            # another thread may have parsed it
+            if self._cfa_array is None:
+                return
+            # cfa is a chunk of JSON so load it
+            cfa_json = json.loads(self._cfa_array)
+            # check that the partitions are defined in the JSON
+            if not "Partitions" in cfa_json:
+                raise CFAException("Partitions not defined in %s:cfa_array metadata" % self.var_name)
+            # load all the data for this class - if it exists
+            if "base" in cfa_json:
+                self._base = cfa_json["base"]
+            if "pmshape" in cfa_json:
+                self._pmshape = np.array(cfa_json["pmshape"], dtype='i')
+            if "pmdimensions" in cfa_json:
+                self._pmdimensions = cfa_json["pmdimensions"]
+            partitions = CFAPartitionTable()
+            partitions.parse(cfa_json["Partitions"])
+            self._partitions = partitions
+            self._cfa_array = None
+
+
+    @property
+    def base(self):
+        self._parse_cfa_array()
+        return self._base
+
+    @base.setter
+    def base(self, base):
+        self._parse_cfa_array()
+        self._base = base
+
+    @property
+    def pmshape(self):
+        self._parse_cfa_array()
+        return self._pmshape
+
+    @pmshape.setter
+    def pmshape(self, pmshape):
+        self._parse_cfa_array()
+        self._pmshape = None if pmshape is None else np.array(pmshape, dtype='i')
+
+    @property
+    def pmdimensions(self):
+        self._parse_cfa_array()
+        return self._pmdimensions
+
+    @pmdimensions.setter
+    def pmdimensions(self, pmdimensions):
+        self._parse_cfa_array()
+        self._pmdimensions = None if pmdimensions is None else list(pmdimensions)
+
+    @property
+    def partitions(self):
+        """The partitions as a CFAPartitionTable"""
+        self._parse_cfa_array()
+        return self._partitions
+
+    @partitions.setter
+    def partitions(self, partitions):
+        self._parse_cfa_array()
+        self._partitions = CFAPartitionTable.from_partitions(partitions)
 
 
     cpdef dict(self):
         """Return the a dictionary representation of the CFAVariable so it can be
            added to the metadata for the variable later."""
+        self._parse_cfa_array()
         cfa_array_dict = {}
-        if self.base != "":
-            cfa_array_dict["base"] = self.base
-        if self.pmshape != []:
-            cfa_array_dict["pmshape"] = self.pmshape.tolist()
-        if self.pmdimensions != []:
-            cfa_array_dict["pmdimensions"] = self.pmdimensions
-        cfa_array_dict["Partitions"] = [p.dict() for p in self.partitions]
+        if self._base != "":
+            cfa_array_dict["base"] = self._base
+        if self._pmshape is not None and len(self._pmshape) != 0:
+            cfa_array_dict["pmshape"] = self._pmshape.tolist()
+        if self._pmdimensions != []:
+            cfa_array_dict["pmdimensions"] = self._pmdimensions
+        cfa_array_dict["Partitions"] = self._partitions.dict()
         return {"cf_role"        : self.cf_role,
                 "cf_dimensions"  : " ".join(self.cfa_dimensions),
                 "cfa_array"      : cfa_array_dict}
 
 
+    cpdef dict _pack(self, prefix, dict arrays):
+        """Return the metadata of the variable as a JSON compatible dictionary, and add the columns of its partition
+           table to arrays, with their names starting with prefix, for CFAFile.arrays.  If the cfa_array metadata has
+           not been parsed then it is returned as it is."""
+        header = {"var_name"       : self.var_name,
+                  "cf_role"        : self.cf_role,
+                  "cfa_dimensions" : self.cfa_dimensions,
+                  "metadata"       : None,
+                  "cfa_array"      : self._cfa_array}
+        if self.metadata is not None:
+            header["metadata"] = _pack_attrs(self.metadata, prefix + "metadata_", arrays)
+        if self._cfa_array is None:
+            header["base"] = self._base
+            header["pmshape"] = None if self._pmshape is None else self._pmshape.tolist()
+            header["pmdimensions"] = self._pmdimensions
+            columns = self._partitions.columns()
+            for k in _TABLE_COLUMNS:
+                arrays[prefix + k] = columns[k]
+        return header
+
+
+    @staticmethod
+    def _unpack(header, prefix, arrays):
+        """Create a CFAVariable from the metadata and arrays from _pack"""
+        cdef CFAVariable cfa_var = CFAVariable(var_name=header["var_name"], cf_role=header["cf_role"])
+        cfa_var.cfa_dimensions = header["cfa_dimensions"]
+        if header["metadata"] is not None:
+            cfa_var.metadata = _unpack_attrs(header["metadata"], prefix + "metadata_", arrays)
+        if header["cfa_array"] is not None:
+            cfa_var._cfa_array = header["cfa_array"]
+            return cfa_var
+        cfa_var._base = header["base"]
+        cfa_var._pmshape = None if header["pmshape"] is None else np.array(header["pmshape"], dtype='i')
+        cfa_var._pmdimensions = header["pmdimensions"]
+        columns = {}
+        for k in _TABLE_COLUMNS:
+            columns[k] = arrays[prefix + k]
+        cfa_var._partitions = CFAPartitionTable.from_columns(columns)
+        return cfa_var
+
+
+    cpdef get_location_index(self):
+        """Return the locations of all the partitions packed into a (n_partitions x ndim x 2) array, and, if the
+           partitions form a regular grid in the order created by create_partitions, the bounds of the partitions
+           along each axis as a list of (pmshape[axis] x 2) arrays (otherwise None).
+           These are built once and rebuilt if the partitions are changed.  The locations are None if any of the
+           partitions do not have a location."""
+        partitions = self.partitions
+        if self._indexed_partitions is partitions:
+            return self._locations, self._partition_grid
+        self._indexed_partitions = partitions
+        self._locations = None
+        self._partition_grid = None
+
+        n_parts = len(partitions)
+        ndim = partitions.ndim
+        if n_parts == 0 or ndim == 0 or not np.all(partitions.has_location):
+            return self._locations, self._partition_grid
+        self._locations = partitions.location
+
+        # check for the regular grid: the partitions are in C order of their index in the partition matrix, and
+        # their location along each axis depends only on their index along that axis
+        if self._pmshape is None or len(self._pmshape) != ndim or np.prod(self._pmshape) != n_parts:
+            return self._locations, self._partition_grid
+        if not np.all(partitions.has_index):
+            return self._locations, self._partition_grid
+        index = partitions.index
+        try:
+            flat_index = np.ravel_multi_index(tuple(index.T), tuple(self._pmshape))
+        except ValueError:
+            return self._locations, self._partition_grid
+        if not np.array_equal(flat_index, np.arange(n_parts)):
+            return self._locations, self._partition_grid
+        grid = []
+        for d in range(0, ndim):
+            bounds = np.zeros((self._pmshape[d], 2), dtype='i')
+            bounds[index[:,d]] = self._locations[:,d,:]
+            # the bounds must be consistent and increasing to be searched
+            if (not np.array_equal(bounds[index[:,d]], self._locations[:,d,:]) or
+                    np.any(np.diff(bounds[:,0]) < 0) or np.any(np.diff(bounds[:,1]) < 0)):
+                return self._locations, self._partition_grid
+            grid.append(bounds)
+        self._partition_grid = grid
+        return self._locations, self._partition_grid
+
+
+def _intern_column(values, n_parts):
+    """Convert a list of strings, one for each partition, to a list of the unique strings and an array of the number
+       of the string for each partition.  values can also be a single string for all of the partitions."""
+    if isinstance(values, basestring):
+        return [values], np.zeros(n_parts, dtype='i')
+    unique = {}
+    ids = np.empty(n_parts, dtype='i')
+    for i in range(0, n_parts):
+        ids[i] = unique.setdefault(values[i], len(unique))
+    return list(unique), ids
+
+
+cdef class CFAPartitionTable:
+    """
+       Class containing the partitions of a CFAVariable as columns, rather than as a list of CFAPartition objects.
+       The index, location and subarray shape of all the partitions are held in contiguous arrays, and the subarray
+       files, ncvars and formats are held once each in a list and referred to by their number in the list.
+       Indexing or iterating over the table creates the CFAPartition objects when they are needed.
+    """
+
+    cdef public int ndim
+    cdef public np.ndarray index           # n_partitions x ndim
+    cdef public np.ndarray location        # n_partitions x ndim x 2
+    cdef public np.ndarray shape           # n_partitions x ndim - the shape of the subarray
+    cdef public np.ndarray has_index       # n_partitions - whether the index is defined for the partition
+    cdef public np.ndarray has_location    # n_partitions - whether the location is defined for the partition
+    cdef public list files
+    cdef public np.ndarray file_ids
+    cdef public list ncvars
+    cdef public np.ndarray ncvar_ids
+    cdef public list formats
+    cdef public np.ndarray format_ids
+
+    def __init__(self, index = [], location = [], shape = [], files = [], ncvars = "", formats = ""):
+        """Initialise the CFAPartitionTable from the columns for the partitions: the index, location and subarray
+           shape arrays, and the subarray file, ncvar and format for each partition.  ncvars and formats can also be
+           a single string for all of the partitions."""
+        cdef int n_parts = len(shape)
+        self.ndim = len(shape[0]) if n_parts > 0 else 0
+        self.shape = np.array(shape, dtype='i').reshape(n_parts, self.ndim)
+        self.has_index = np.full(n_parts, len(index) != 0, dtype=bool)
+        if len(index) != 0:
+            self.index = np.array(index, dtype='i').reshape(n_parts, self.ndim)
+        else:
+            self.index = np.zeros((n_parts, self.ndim), dtype='i')
+        self.has_location = np.full(n_parts, len(location) != 0, dtype=bool)
+        if len(location) != 0:
+            self.location = np.array(location, dtype='i').reshape(n_parts, self.ndim, 2)
+        else:
+            self.location = np.zeros((n_parts, self.ndim, 2), dtype='i')
+        if n_parts == 0:
+            files = []
+        self.files, self.file_ids = _intern_column(files, n_parts)
+        self.ncvars, self.ncvar_ids = _intern_column(ncvars, n_parts)
+        self.formats, self.format_ids = _intern_column(formats, n_parts)
+
+
+    @staticmethod
+    def from_partitions(partitions):
+        """Create a CFAPartitionTable from a list of CFAPartition, or return partitions if it is already a table"""
+        if isinstance(partitions, CFAPartitionTable):
+            return partitions
+        table = CFAPartitionTable()
+        table.parse([p.dict() for p in partitions])
+        return table
+
+
+    cpdef parse(self, partitions):
+        """Parse the list of partition definitions from the cfa_array metadata."""
+        cdef int n_parts = len(partitions)
+        cdef int ndim = 0
+        cdef int i
+        # the columns are built as flat lists and reshaped at the end
+        index = []
+        location = []
+        shape = []
+        files = [""] * n_parts
+        ncvars = [""] * n_parts
+        formats = [""] * n_parts
+        has_index = np.zeros(n_parts, dtype=bool)
+        has_location = np.zeros(n_parts, dtype=bool)
+        for i in range(0, n_parts):
+            part = partitions[i]
+            # Check that the "subarray" item exists in the metadata
+            if not "subarray" in part:
+                raise CFAException("subarray not defined in cfa_array:Partition metadata")
+            subarray = part["subarray"]
+            # the only item which has to be present in the subarray is shape
+            if not "shape" in subarray:
+                raise CFAException("shape not defined in Partition:subarray metadata")
+            if i == 0:
+                ndim = len(subarray["shape"])
+            if len(subarray["shape"]) != ndim:
+                raise CFAException("Partitions have inconsistent numbers of dimensions in cfa_array metadata")
+            shape.extend(subarray["shape"])
+            # fill in the undefined index and location so that the arrays are regular
+            part_index = part.get("index", [])
+            if len(part_index) != 0:
+                if len(part_index) != ndim:
+                    raise CFAException("Partitions have inconsistent numbers of dimensions in cfa_array metadata")
+                index.extend(part_index)
+                has_index[i] = True
+            else:
+                index.extend([0] * ndim)
+            part_location = part.get("location", [])
+            if len(part_location) != 0:
+                if len(part_location) != ndim:
+                    raise CFAException("Partitions have inconsistent numbers of dimensions in cfa_array metadata")
+                for loc in part_location:
+                    location.extend(loc)
+                has_location[i] = True
+            else:
+                location.extend([0, 0] * ndim)
+            if "file" in subarray:
+                files[i] = subarray["file"]
+            if "ncvar" in subarray:
+                ncvars[i] = subarray["ncvar"]
+            if "format" in subarray:
+                formats[i] = subarray["format"]
+
+        self.ndim = ndim
+        self.has_index = has_index
+        self.has_location = has_location
+        try:
+            self.shape = np.array(shape, dtype='i').reshape(n_parts, ndim)
+            self.index = np.array(index, dtype='i').reshape(n_parts, ndim)
+            self.location = np.array(location, dtype='i').reshape(n_parts, ndim, 2)
+        except ValueError:
+            raise CFAException("Partitions have inconsistent numbers of dimensions in cfa_array metadata")
+        self.files, self.file_ids = _intern_column(files, n_parts)
+        self.ncvars, self.ncvar_ids = _intern_column(ncvars, n_parts)
+        self.formats, self.format_ids = _intern_column(formats, n_parts)
+
+
+    cpdef dict columns(self):
+        """Return the columns of the table as a dictionary of arrays, with the files, ncvars and formats as arrays of
+           strings, so that the table can be saved with numpy.savez and loaded without pickle."""
+        return {"index"        : self.index,
+                "location"     : self.location,
+                "shape"        : self.shape,
+                "has_index"    : self.has_index,
+                "has_location" : self.has_location,
+                "files"        : np.array(self.files, dtype='U'),
+                "file_ids"     : self.file_ids,
+                "ncvars"       : np.array(self.ncvars, dtype='U'),
+                "ncvar_ids"    : self.ncvar_ids,
+                "formats"      : np.array(self.formats, dtype='U'),
+                "format_ids"   : self.format_ids}
+
+
+    @staticmethod
+    def from_columns(columns):
+        """Create a CFAPartitionTable from the columns returned by CFAPartitionTable.columns"""
+        cdef CFAPartitionTable table = CFAPartitionTable()
+        shape = np.array(columns["shape"], dtype='i')
+        if shape.ndim != 2:
+            raise CFAException("Partitions have inconsistent numbers of dimensions in the partition table")
+        n_parts, ndim = shape.shape
+        index = np.array(columns["index"], dtype='i')
+        location = np.array(columns["location"], dtype='i')
+        has_index = np.array(columns["has_index"], dtype=bool)
+        has_location = np.array(columns["has_location"], dtype=bool)
+        if (index.shape != (n_parts, ndim) or location.shape != (n_parts, ndim, 2) or
+                has_index.shape != (n_parts,) or has_location.shape != (n_parts,)):
+            raise CFAException("Partitions have inconsistent numbers of dimensions in the partition table")
+        strings = []
+        for k in ("files", "ncvars", "formats"):
+            values = [str(s) for s in columns[k]]
+            ids = np.array(columns[k[:-1] + "_ids"], dtype='i')
+            if ids.shape != (n_parts,) or (n_parts > 0 and (ids.min() < 0 or ids.max() >= len(values))):
+                raise CFAException("Partitions refer to undefined subarrays in the partition table")
+            strings.append((values, ids))
+        table.ndim = ndim
+        table.shape = shape
+        table.index = index
+        table.location = location
+        table.has_index = has_index
+        table.has_location = has_location
+        (table.files, table.file_ids), (table.ncvars, table.ncvar_ids), (table.formats, table.format_ids) = strings
+        return table
+
+
+    def __len__(self):
+        return self.shape.shape[0]
+
+
+    def __getitem__(self, i):
+        """Create the CFAPartition for the partition number i"""
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        n_parts = len(self)
+        if i < 0:
+            i += n_parts
+        if i < 0 or i >= n_parts:
+            raise IndexError("Partition index out of range")
+        subarray = CFASubarray(self.ncvars[self.ncvar_ids[i]], self.files[self.file_ids[i]],
+                               self.formats[self.format_ids[i]], self.shape[i])
+        return CFAPartition(self.index[i] if self.has_index[i] else [],
+                            self.location[i] if self.has_location[i] else [],
+                            subarray)
+
+
+    def __iter__(self):
+        for i in range(0, len(self)):
+            yield self[i]
+
+
+    cpdef list dict(self):
+        """Return the partitions represented as a list of dictionaries so they can be
+           converted to a JSON string later."""
+        index = self.index.tolist()
+        location = self.location.tolist()
+        shape = self.shape.tolist()
+        parts = []
+        for i in range(0, len(self)):
+            parts.append({"index"    : index[i] if self.has_index[i] else [],
+                          "location" : location[i] if self.has_location[i] else [],
+                          "subarray" : {"ncvar"  : self.ncvars[self.ncvar_ids[i]],
+                                        "file"   : self.files[self.file_ids[i]],
+                                        "format" : self.formats[self.format_ids[i]],
+                                        "shape"  : shape[i]}})
+        return parts
+
+
 cdef class CFAPartition:
     """
        Class containing details of the partitions in a CFAVariable
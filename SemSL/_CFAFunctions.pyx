@@ -258,7 +258,7 @@ def create_partitions(base_filepath, dataset, dimensions,
                       varname, var_shape, dtype,
                       max_file_size=DEFAULT_OBJECT_SIZE,
                       format="NETCDF4", group=None, parent=None):
-    """Create the CFAPartition(s) from the input data."""
+    """Create the CFAPartitionTable from the input data."""
     # get the axis types for the dimensions
     #try:
     subarray_shape = _calculate_subarray_shape(dataset, dimensions, var_shape,
@@ -279,124 +279,236 @@ def create_partitions(base_filepath, dataset, dimensions,
     base_filename = os.path.basename(base_filepath)
 
     # each of these is a partition
-    partitions = []
-    for sa in range(0, n_subarrays):
-        # create the subarray first
-        # output shape is just the difference between the location indices
-        out_shape = location[sa,:,1] - location[sa,:,0]
-        # get the sub file name
-        if group:
-            sub_filename = base_filepath + "/" + base_filename + "_" + group + "_" +varname + "_[" + str(sa) + "].nc"
-        else:
-            sub_filename = base_filepath + "/" + base_filename + "_" + varname + "_[" + str(sa) + "].nc"
-        cfa_subarray = CFASubarray(varname, sub_filename, format, out_shape)
-        # create the output location
-        out_location = numpy.array(location[sa])
-        # sub 1 from last output location to reflect that indices are inclusive
-        out_location[:,1] -= 1
-        # create the partition and append to the partition list
-        partition = CFAPartition(pindex[sa], out_location, cfa_subarray)
-        partitions.append(partition)
+    # output shape is just the difference between the location indices
+    out_shape = location[:,:,1] - location[:,:,0]
+    # get the sub file names
+    if group:
+        sub_filepath = base_filepath + "/" + base_filename + "_" + group + "_" + varname + "_["
+    else:
+        sub_filepath = base_filepath + "/" + base_filename + "_" + varname + "_["
+    sub_filenames = [sub_filepath + str(sa) + "].nc" for sa in range(0, n_subarrays)]
+    # create the output location
+    out_location = numpy.array(location)
+    # sub 1 from last output location to reflect that indices are inclusive
+    out_location[:,:,1] -= 1
+    # create the table of partitions
+    partitions = CFAPartitionTable(pindex, out_location, out_shape, sub_filenames, varname, format)
 
     return pmshape, partitions, subarray_shape
 
 
+def _selection_hits(sel, lower, upper):
+    """Check whether the partitions with the (inclusive) lower and upper bounds along an axis contain at least one of
+       the indices in the filled selection sel for that axis.  lower and upper can be scalars or arrays."""
+    if type(sel) is slice:
+        if sel.stop < sel.start:
+            return numpy.zeros(numpy.shape(lower), dtype=bool)
+        # the first and last step of the slice that lie within the bounds
+        first = numpy.maximum(0, -((sel.start - lower) // sel.step))
+        last = numpy.minimum((sel.stop - sel.start) // sel.step, (upper - sel.start) // sel.step)
+        return last >= first
+    return numpy.searchsorted(sel, upper, 'right') > numpy.searchsorted(sel, lower, 'left')
+
+
 def partition_overlaps(partition, slices):
-    """Check whether a partition overlaps with the start and end indices"""
+    """Check whether a partition contains any of the indices in the filled slices"""
     if len(partition.location) == 0:
         return False
     assert(len(partition.location) == len(slices))
-    overlaps = True
     for i in range(0, len(partition.location)):
-        # overlap if the slice start index lies between the start and end index for this partition
-        # OR if the slice end index lies between the start and end index for this partition
-        # OR if the partition is contained entirely within the slice
-        # get the slice
-        s = slices[i]
         p = partition.location[i]
-        start_overlaps = (s.start >= p[0]) & (s.start <= p[1])
-        end_overlaps = (s.stop >= p[0]) & (s.stop <= p[1])
-        partition_in = (p[0] >= s.start) & (p[1] <= s.stop)
-        overlaps &= (start_overlaps | end_overlaps | partition_in)
-    return overlaps
+        if not _selection_hits(slices[i], p[0], p[1]):
+            return False
+    return True
+
+
+def get_overlapping_partitions(cfa_var, slices):
+    """Get the list of partitions in the CFAVariable that contain any of the indices in the filled slices, in the
+       order of the partitions.  This is equivalent to calling partition_overlaps for every partition, but uses the
+       packed location array of the variable.  If the partitions form a regular grid then the partitions along each
+       axis are found from the bounds of the partitions on that axis, rather than checking every partition.
+       Partitions that lie between the points of a strided or indexed selection are not included."""
+    locations, grid = cfa_var.get_location_index()
+    if locations is None:
+        return [p for p in cfa_var.partitions if partition_overlaps(p, slices)]
+    assert(locations.shape[1] == len(slices))
+    if grid is not None:
+        ranges = []
+        for d in range(0, len(grid)):
+            axis_parts = numpy.nonzero(_selection_hits(slices[d], grid[d][:,0], grid[d][:,1]))[0]
+            if len(axis_parts) == 0:
+                return []
+            ranges.append(axis_parts)
+        mesh = numpy.meshgrid(*ranges, indexing='ij')
+        part_numbers = numpy.ravel_multi_index(tuple(mesh), tuple(cfa_var.pmshape)).ravel()
+    else:
+        overlaps = numpy.ones(locations.shape[0], dtype=bool)
+        for d in range(0, locations.shape[1]):
+            overlaps &= _selection_hits(slices[d], locations[:,d,0], locations[:,d,1])
+        part_numbers = numpy.nonzero(overlaps)[0]
+    partitions = cfa_var.partitions
+    return [partitions[i] for i in part_numbers]
+
+
+def _as_slice(indices):
+    """Return a filled (inclusive) slice equivalent to the sorted array of unique indices, if they are evenly spaced,
+       otherwise None."""
+    if len(indices) == 0:
+        return None
+    if len(indices) == 1:
+        return slice(int(indices[0]), int(indices[0]), 1)
+    steps = numpy.diff(indices)
+    if numpy.all(steps == steps[0]):
+        return slice(int(indices[0]), int(indices[-1]), int(steps[0]))
+    return None
+
+
+def _fill_axis(elem, dim_len):
+    """Convert the index for one axis into a filled selection and the order to apply to the data read with it.
+       The selection is either an inclusive slice with a positive step, or a sorted array of unique indices.
+       The order is None, a reversing slice for negative steps, or the array to index the selected data with to
+       get the order (and repeats) of an unsorted integer array index."""
+    if isinstance(elem, slice):
+        start, stop, step = elem.indices(dim_len)
+        n = len(range(start, stop, step))
+        if n == 0:
+            return slice(0, -1, 1), None
+        last = start + (n-1) * step
+        if step > 0:
+            return slice(start, last, step), None
+        # read in increasing order and reverse afterwards
+        return slice(last, start, -step), slice(None, None, -1)
+    if isinstance(elem, (int, numpy.integer)):
+        index = int(elem)
+        if index < 0:
+            index += dim_len
+        if index < 0 or index >= dim_len:
+            raise IndexError("Index {} is out of bounds for axis with size {}".format(elem, dim_len))
+        return slice(index, index, 1), None
+    indices = numpy.asarray(elem)
+    if indices.dtype == bool:
+        if indices.ndim != 1 or len(indices) != dim_len:
+            raise IndexError("Boolean index must be 1-d and the same length as the axis ({})".format(dim_len))
+        indices = numpy.nonzero(indices)[0]
+        sel = _as_slice(indices)
+        if sel is None:
+            if len(indices) == 0:
+                return slice(0, -1, 1), None
+            return indices, None
+        return sel, None
+    if indices.ndim != 1 or (indices.size != 0 and not numpy.issubdtype(indices.dtype, numpy.integer)):
+        raise IndexError("Only integers, slices, and 1-d integer or boolean arrays are valid indices")
+    indices = indices.astype('i8')
+    indices[indices < 0] += dim_len
+    if numpy.any((indices < 0) | (indices >= dim_len)):
+        raise IndexError("Index {} is out of bounds for axis with size {}".format(elem, dim_len))
+    unique, order = numpy.unique(indices, return_inverse=True)
+    if len(unique) == len(indices) and numpy.all(unique == indices):
+        order = None
+    sel = _as_slice(unique)
+    if sel is None:
+        if len(unique) == 0:
+            return slice(0, -1, 1), None
+        return unique, order
+    return sel, order
+
+
+def fill_selection(master_array_shape, elems):
+    """Fill out the index so that there is a selection for each dimension, which contains the indices explicitly.
+       Integers, slices (with any step), Ellipsis and 1-d integer and boolean arrays are supported.  As with
+       netCDF4, the integer and boolean arrays index each dimension independently.
+       Returns the list of selections and the list of orders for each dimension (see _fill_axis).  The selections
+       are all in increasing order, so that the data can be read from each subarray with a single, strided, read."""
+    lmas = len(master_array_shape)
+    if type(elems) is not tuple:
+        elems = (elems,)
+    # expand the Ellipsis to full slices
+    n_ellipsis = sum(1 for e in elems if e is Ellipsis)
+    if n_ellipsis > 1:
+        raise IndexError("An index can only have a single ellipsis ('...')")
+    elif n_ellipsis == 1:
+        e = [i for i in range(0, len(elems)) if elems[i] is Ellipsis][0]
+        elems = elems[:e] + (slice(None),) * (lmas - len(elems) + 1) + elems[e+1:]
+    if len(elems) > lmas:
+        raise IndexError("Too many indices for variable with {} dimensions".format(lmas))
+    # fill out the rest of the dimensions
+    elems = elems + (slice(None),) * (lmas - len(elems))
+
+    slices = []
+    orders = []
+    for s in range(0, lmas):
+        sel, order = _fill_axis(elems[s], master_array_shape[s])
+        slices.append(sel)
+        orders.append(order)
+    return slices, orders
 
 
 def fill_slices(master_array_shape, elems):
     """Fill out the tuple of slices so that there is a slice for each dimension and each slice
-    contains the indices explictly, rather than `None`."""
-    # convert the slice into a "full slice" - i.e. having a slice for each dimension and having all the indices
-    # explicitly numbered in the slice, without any "Nones"
-    lmas = len(master_array_shape)
-    # a list of slices - convert to a tuple at the end
-    slices = []
-    # check first whether this is a single slice or a tuple of them
-    if type(elems) is slice:
-        # fill in the first of the indices
-        elems_list = elems.indices(master_array_shape[0])
-        slices.append(slice(elems_list[0], elems_list[1]-1, elems_list[2]))
-        # how many slices to fill for the rest of the dimensions
-        fill_number = lmas - 1
-        start_number = 1
-    # check whether this is a single integer
-    elif type(elems) is int:
-        # loop over the array
-        slices.append(slice(elems, elems, 1))
-        fill_number = len(master_array_shape) - 1
-        start_number = 1
-    else:
-        # check that length of elems is equal to or less than the master_array_shape
-        assert(len(elems) <= len(master_array_shape))
-        # fill the indices from the 0 index upwards
-        for s in range(0, len(elems)):
-            if type(elems[s]) is int:
-                slices.append(slice(elems[s], elems[s], 1))
-            else:
-                elems_list = elems[s].indices(master_array_shape[s])
-                slices.append(slice(elems_list[0], elems_list[1]-1, elems_list[2]))
+    contains the indices explictly, rather than `None`.  See fill_selection for the order of the data."""
+    return fill_selection(master_array_shape, elems)[0]
+
+
+def selection_length(sel):
+    """Number of indices in a filled selection"""
+    if type(sel) is slice:
+        return max(0, (sel.stop - sel.start) // sel.step + 1)
+    return len(sel)
+
 
-        # where to fill out the rest of the indicates
-        fill_number = lmas - len(elems)
-        start_number = len(elems)
-    # fill out the rest of the slices
-    for s in range(0, fill_number):
-        slices.append(slice(0, master_array_shape[start_number+s]-1, 1))
-    return slices
+def apply_selection_order(data, orders):
+    """Reorder the data read with the filled selections into the order of the original index"""
+    for d in range(0, len(orders)):
+        if orders[d] is not None:
+            data = data[(slice(None),) * d + (orders[d],)]
+    return data
+
+
+def remove_selection_order(data, orders):
+    """Reorder the data to be written into the order of the filled selections.  For repeated indices the last value
+       is written, as with numpy."""
+    for d in range(0, len(orders)):
+        if orders[d] is None:
+            continue
+        if type(orders[d]) is slice:
+            data = data[(slice(None),) * d + (orders[d],)]
+        else:
+            # the last position of each unique index
+            positions = numpy.zeros(orders[d].max()+1, dtype='i8')
+            positions[orders[d]] = numpy.arange(len(orders[d]))
+            data = numpy.take(data, positions, axis=d)
+    return data
 
 
 def get_source_target_slices(partition, elem_slices):
     """Get the slice into the source subarray and the target slice for the destination subarray,
        based on the information in the partition and the subdomain of the master array defined
-       by elem_slices.  elem_slices are the filled slices from the function above."""
-
-    # create the default source slice: this is the shape of the subarray
-    source_slice = []
-    for sl in partition.subarray.shape:
-        source_slice.append(CFASlice(0, sl, 1))
-    # create the target slice from the location and the passed in elements
-    # create the default slice first - we will modify this
-    target_slice = []
-    for pl in partition.location:
-        target_slice.append(CFASlice(pl[0], pl[1], 1))
-
-    # now modify the slice based on the elements passed in
+       by elem_slices.  elem_slices are the filled selections from fill_selection.
+       The source selection is a strided slice, or a sorted array of indices where the selection is not evenly
+       spaced in the subarray.  The target is always a contiguous slice."""
     py_source_slice = []
     py_target_slice = []
-    for p in range(0, len(target_slice)):
-        # adjust the end target_slice if we are taking a subset of the data
-        if elem_slices[p].stop < target_slice[p].stop:
-            source_slice[p].stop -= target_slice[p].stop - elem_slices[p].stop
-            target_slice[p].stop = elem_slices[p].stop
-        # adjust the target start and end for the sub_slice
-        target_slice[p].start -= elem_slices[p].start
-        target_slice[p].stop -= elem_slices[p].start - 1
-        # check if the elem started within the location
-        if target_slice[p].start < 0:
-            # source_slice.start is absolute value of ts
-            source_slice[p].start = -1 * target_slice[p].start
-            # target start is 0
-            target_slice[p].start = 0
-
-        py_source_slice.append(source_slice[p].to_pyslice())
-        py_target_slice.append(target_slice[p].to_pyslice())
+    for p in range(0, len(elem_slices)):
+        sel = elem_slices[p]
+        lower = int(partition.location[p][0])
+        upper = int(partition.location[p][1])
+        if type(sel) is slice:
+            # the first and last step of the selection that lie in this partition
+            first = max(0, -((sel.start - lower) // sel.step))
+            last = min((sel.stop - sel.start) // sel.step, (upper - sel.start) // sel.step)
+            source_start = sel.start + first * sel.step - lower
+            source_stop = sel.start + last * sel.step - lower
+            py_source_slice.append(slice(source_start, source_stop+1, sel.step))
+            py_target_slice.append(slice(first, last+1, 1))
+        else:
+            first = int(numpy.searchsorted(sel, lower, 'left'))
+            last = int(numpy.searchsorted(sel, upper, 'right'))
+            source = sel[first:last] - lower
+            source_slice = _as_slice(source)
+            if source_slice is None:
+                py_source_slice.append(source)
+            else:
+                py_source_slice.append(slice(source_slice.start, source_slice.stop+1, source_slice.step))
+            py_target_slice.append(slice(first, last, 1))
 
     return py_source_slice, py_target_slice
@@ -10,11 +10,175 @@ __license__ = "BSD - see LICENSE file in top-level directory"
 #from ._s3netCDFIO import get_netCDF_file_details, put_netCDF_file
 import netCDF4._netCDF4 as netCDF4
 import os
+import ctypes
+import weakref
 from ._CFAFunctions import get_source_target_slices
 import numpy
 from queue import Queue
-from SemSL._slCacheManager import slCacheManager as slCache
+from SemSL._slCacheManager import slCacheManager as slCache, release_memory
 from SemSL._slExceptions import slIOException, slInterfaceException
+import SemSL._slUtils as slU
+
+# nc_get_vars from the netCDF-C library that netCDF4 is linked against, loaded on first use - False if not available
+_nc_get_vars = None
+
+# netCDF4 alters the values read from variables with these attributes
+_CONVERTING_ATTRS = ('scale_factor', 'add_offset', '_Unsigned')
+
+# the smallest contiguous block of the target that is worth a call to nc_get_vars - for smaller blocks the overhead of
+# the calls is greater than the cost of netCDF4 reading into a new array and copying it
+DIRECT_MIN_BLOCK = 256 * 1024
+
+# the parameters of createVariable for the subarray variables, taken from the init params of the slVariable
+VARIABLE_PARAMS = ('zlib', 'complevel', 'shuffle', 'fletcher32', 'contiguous', 'chunksizes', 'endian',
+                   'least_significant_digit', 'fill_value', 'chunk_cache')
+
+
+def _load_nc_get_vars():
+    global _nc_get_vars
+    if _nc_get_vars is None:
+        try:
+            # the symbols of the libraries netCDF4 is linked against can be found through its own library
+            func = ctypes.CDLL(netCDF4.__file__).nc_get_vars
+            func.argtypes = [ctypes.c_int, ctypes.c_int,
+                             ctypes.POINTER(ctypes.c_size_t), ctypes.POINTER(ctypes.c_size_t),
+                             ctypes.POINTER(ctypes.c_ssize_t), ctypes.c_void_p]
+            func.restype = ctypes.c_int
+            _nc_get_vars = func
+        except (OSError, AttributeError):
+            _nc_get_vars = False
+    return _nc_get_vars
+
+
+def read_direct(nc_var, source_slice, target):
+    """Read the values of nc_var selected by source_slice straight into target, a view of the array being read into,
+       rather than into a new array which is then copied.  The netCDF-C library reads each contiguous block of target
+       with nc_get_vars.
+       Returns False, without reading anything, if the values should be read through netCDF4: the netCDF-C library
+       cannot be found, source_slice contains index arrays, the dtypes differ, netCDF4 would convert the values or
+       the contiguous blocks of target are smaller than DIRECT_MIN_BLOCK."""
+    nc_get_vars = _load_nc_get_vars()
+    if not nc_get_vars:
+        return False
+    dtype = target.dtype
+    ndim = target.ndim
+    if (dtype != nc_var.dtype or not dtype.isnative or dtype.kind not in 'biuf' or not target.flags.writeable
+            or ndim == 0 or ndim != len(source_slice) or ndim != nc_var.ndim):
+        return False
+
+    # the contiguous block is formed by the dimensions from block_dim onwards
+    block_dim = ndim
+    block_size = dtype.itemsize
+    while block_dim > 0 and (target.shape[block_dim - 1] == 1 or target.strides[block_dim - 1] == block_size):
+        block_dim -= 1
+        block_size *= target.shape[block_dim]
+    if block_size < DIRECT_MIN_BLOCK and block_dim > 0:
+        return False
+
+    attrs = nc_var.ncattrs()
+    for attr in _CONVERTING_ATTRS:
+        if attr in attrs:
+            return False
+
+    start = (ctypes.c_size_t * ndim)()
+    count = (ctypes.c_size_t * ndim)()
+    stride = (ctypes.c_ssize_t * ndim)()
+    shape = nc_var.shape
+    for d in range(0, ndim):
+        s = source_slice[d]
+        if type(s) is not slice:
+            return False
+        s_start, s_stop, s_step = s.indices(shape[d])
+        n = len(range(s_start, s_stop, s_step))
+        if s_step <= 0 or n != target.shape[d]:
+            return False
+        start[d] = s_start
+        # one index along the dimensions outside of the block
+        count[d] = n if d >= block_dim else 1
+        stride[d] = s_step
+    if target.size == 0:
+        return True
+
+    source_start = [start[d] for d in range(0, block_dim)]
+    for index in numpy.ndindex(*target.shape[:block_dim]):
+        for d in range(0, block_dim):
+            start[d] = source_start[d] + index[d] * stride[d]
+        if nc_get_vars(nc_var._grpid, nc_var._varid, start, count, stride, target[index].ctypes.data) != 0:
+            raise slIOException("Could not read variable {} from subarray file {}".format(nc_var.name,
+                                                                                           nc_var.group().filepath()))
+    return True
+
+
+def _subarray_index_error(e):
+    """Add a hint to an IndexError raised when setting the values of a subarray"""
+    return IndexError('{}\n\nIf trying to set the values in an array, the number of dimensions in the '
+                      'subarray must match the number of dimensions in the variable.'.format(e))
+
+
+def _write_values(var, values):
+    """Write values, a list of (target_slice, data), to the variable in a subarray file"""
+    try:
+        for target_slice, data in values:
+            var[target_slice] = data
+    except IndexError as e:
+        raise _subarray_index_error(e)
+
+
+def create_fragment(ncfile, spec):
+    """Create the groups, dimensions and variable of a partition in a new subarray file, from the description returned
+       by _baseInterface._fragment_spec.  Return the variable."""
+    # create any required groups
+    group = ncfile
+    if spec['group'] is not None:
+        group = ncfile.createGroup(spec['group'])
+
+    # create the dimensions - the dimensions of the parent of a group are created in the root group
+    for dim_name, unlimited, dim_size, values, metadata, in_root in spec['dimensions']:
+        dim_group = ncfile if in_root else group
+        if unlimited:       # allow for unlimited dimension
+            dim_group.createDimension(dim_name, None)
+        else:
+            dim_group.createDimension(dim_name, dim_size)
+        # create the dimension variable
+        dim_var = dim_group.createVariable(dim_name, values.dtype, (dim_name,))
+        # add the metadata as attributes
+        dim_var.setncatts(metadata)
+        # add the values for the dimension
+        dim_var[:] = values
+
+    # create the variable - match the parameters to those used in the createVariable function in s3Dataset
+    var = group.createVariable(spec['name'], spec['datatype'], spec['pmdimensions'], **spec['var_params'])
+    # add the variable cfa_metadata
+    if spec['metadata']:
+        var.setncatts(spec['metadata'])
+    #TODO get attrbute percolation working working
+    # vattr = {}
+    # for at in self._nc_var.ncattrs():
+    #     vattr[at] = self._cfa_file.variables[self._nc_var.name].getncattr(at)
+    # var.setncatts(vattr)
+    if spec['group_metadata'] is not None:
+        group.setncatts(spec['group_metadata'])
+    return var
+
+
+def write_fragment(file_details, mode, spec, values):
+    """Write values, a list of (target_slice, data), to the subarray file of a partition.  In 'w' mode the file is
+       created from spec (see create_fragment), in 'a' / 'r+' mode the file is opened and written to the variable
+       named in spec.  The file is opened and closed here, rather than in the cache of open files, so that this can
+       be run in another process - see _threadInterface."""
+    if mode == 'w':
+        ncfile = netCDF4.Dataset(file_details, mode=mode, format=spec['format'])
+    else:
+        ncfile = netCDF4.Dataset(file_details, mode=mode)
+    try:
+        if mode == 'w':
+            var = create_fragment(ncfile, spec)
+        else:
+            var = ncfile.variables[spec['name']]
+        _write_values(var, values)
+    finally:
+        ncfile.close()
+
 
 class _baseInterface(object):
     """Class to represent a base for reading / writing / uploading netCDF files to disk or S3.
@@ -28,16 +192,99 @@ class _baseInterface(object):
          filled to contain absolute values for all boundaries (rather than -1, None, etc.)
     """
 
-    def _read_partition(self, thread_number, return_queue, part, elem_slices):
-        """Read a single partition.  This is overloaded so we can have local data for each thread."""
-        # get the filename, either in the cache for s3 files or on disk for POSIX
-
+    def _fetch_partition(self, part, mode):
+        """Get the filename of the subarray file for a single partition, either in the cache for s3 files or on disk
+           for POSIX.  For files on a backend this will stream the file into the cache, if it is not already there, or
+           return a byte-range URL for the file if byte_range_reads is set for the host, or read it into memory if it
+           is small enough (see _fetch_to_memory).
+           For diskless datasets the files are created in memory by the cache of open files, and the path in the
+           cache is only used as their key."""
         slC = slCache()
+        if self._is_diskless():
+            return slC._get_cache_path(part.subarray.file)
+        if mode == 'r':
+            # if the host supports it, read only the required byte ranges rather than fetching the whole file
+            range_url = slC.open_range(part.subarray.file)
+            if range_url is not None:
+                return range_url
+            path = self._fetch_to_memory(slC, part)
+            if path is not None:
+                return path
         try:
-            file_details = slC.open(part.subarray.file, access_type='r')
+            file_details = slC.open(part.subarray.file, access_type=mode)
         except slIOException:
-            os.makedirs(os.path.dirname(part.subarray.file))
-            file_details = slC.open(part.subarray.file, access_type='r')
+            # exist_ok as other threads may be creating the same directory
+            os.makedirs(os.path.dirname(part.subarray.file), exist_ok=True)
+            file_details = slC.open(part.subarray.file, access_type=mode)
+        return file_details
+
+
+    def _fetch_to_memory(self, slC, part):
+        """Read the subarray file of a partition into memory, rather than into the cache, if the values in it are no
+           larger than object_size_for_memory (see slCacheManager.read_to_memory).  Files are only read into memory
+           by read, and not if they are already open.
+           Return the path in the cache, which is used as the name of the file by _open_partition, or None if the file
+           should be fetched into the cache."""
+        fid = part.subarray.file
+        if self._memory_files is None or slU._get_alias(fid) is None:
+            return None
+        path = slC._get_cache_path(fid)
+        if self._file_handles is not None and self._file_handles.is_open(path):
+            return path
+        size = int(numpy.prod(part.subarray.shape)) * self._data.dtype.itemsize
+        if size > slC.sl_config['system'].get('object_size_for_memory', 0):
+            return None
+        # the size of the file is not known, so object_size_for_memory is used as the upper limit on it
+        memory = slC.read_to_memory(fid)
+        if memory is None:
+            return None
+        self._memory_files[path] = memory
+        return path
+
+
+    def _open_partition(self, file_details, mode, **kwargs):
+        """Open the subarray file as a netCDF4.Dataset, from the cache of open files if one has been passed in the
+           read / write params.  The Dataset should be closed with _close_partition."""
+        memory = None
+        if self._memory_files:
+            memory = self._memory_files.pop(file_details, None)
+        if memory is not None:
+            kwargs['memory'] = memory
+        try:
+            if self._file_handles is None:
+                nc_file = netCDF4.Dataset(file_details, mode=mode, **kwargs)
+            else:
+                nc_file = self._file_handles.acquire(file_details, mode, **kwargs)
+        except BaseException:
+            if memory is not None:
+                release_memory(len(memory))
+            raise
+        if memory is not None:
+            # the memory is returned to the budget once the Dataset has been closed and freed
+            weakref.finalize(nc_file, release_memory, len(memory))
+        return nc_file
+
+
+    def _is_diskless(self):
+        """Return whether the subarray files are created in memory, see slFileHandles"""
+        return self._file_handles is not None and self._file_handles.diskless
+
+
+    def _close_partition(self, nc_file):
+        """Close a Dataset opened by _open_partition.  If it is in the cache of open files it is left open, to be
+           reused by the next read / write of the same subarray file."""
+        if self._file_handles is None:
+            nc_file.close()
+        else:
+            self._file_handles.release(nc_file)
+
+
+    def _read_partition(self, thread_number, return_queue, part, elem_slices, file_details=None):
+        """Read a single partition.  This is overloaded so we can have local data for each thread.
+           file_details can be passed in if the partition has already been fetched by _fetch_partition."""
+        # get the filename, either in the cache for s3 files or on disk for POSIX
+        if file_details is None:
+            file_details = self._fetch_partition(part, 'r')
 
 
         # open the file as a dataset - see if it is first streamed to memory
@@ -52,7 +299,7 @@ class _baseInterface(object):
         #                               diskless=True, persist=False, memory=file_details.memory)
         # else:
         # not in memory but has been streamed to disk - persist in the cache
-        nc_file = netCDF4.Dataset(file_details, mode='r')
+        nc_file = self._open_partition(file_details, 'r')
 
         # get the source and target slices - use the filled slices from above
         py_source_slice, py_target_slice = get_source_target_slices(part, elem_slices)
@@ -62,145 +309,112 @@ class _baseInterface(object):
         return nc_file
 
 
-    def _write_partition(self, part, elem_slices, mode):
-        """Write a single partition.  This should be used by subclasses."""
-        ip = self._init_params # just a shorthand
+    def _copy_from_partition(self, nc_var, py_source_slice, py_target_slice):
+        """Copy the values of the subarray variable into the target array, directly if possible (see read_direct)"""
+        # the target has to be a view of the array, i.e. only slices, for the values to be read into it
+        direct = type(self._data) in (numpy.ndarray, numpy.memmap)
+        for s in py_target_slice:
+            direct = direct and type(s) is slice
+        if not direct or not read_direct(nc_var, py_source_slice, self._data[tuple(py_target_slice)]):
+            self._data[tuple(py_target_slice)] = nc_var[tuple(py_source_slice)]
 
-        # get the filename, either in the cache for s3 files or on disk for POSIX
-        #file_details = get_netCDF_file_details(part.subarray.file, 'w')
-        slC = slCache()
 
+    def _fetch_write_partition(self, part, mode):
+        """Get the filename of the subarray file to write a single partition to (see _fetch_partition), and create
+           the directory for it if the file is to be created.  This does not call the netCDF library, so the
+           parallel interfaces can fetch the files for some partitions while others are being written."""
+        file_details = self._fetch_partition(part, mode)
+        if mode == 'w':
+            # first create the destination directory, if it doesn't exist - exist_ok as other threads may be
+            # creating the same directory
+            dest_dir = os.path.dirname(file_details)
+            if not self._is_diskless() and not os.path.isdir(dest_dir):
+                os.makedirs(dest_dir, exist_ok=True)
+        return file_details
+
+
+    def _fragment_spec(self, part, mode):
+        """Return a picklable description of the subarray file of a partition: how to create it with create_fragment
+           in 'w' mode, or just the name of the variable to write to in an existing file.  This reads the dimensions
+           and metadata from the master file, so calls the netCDF library."""
+        spec = {'name': self._nc_var.name}
+        if mode != 'w':
+            return spec
+        ip = self._init_params # just a shorthand
+        group_path = self._nc_var.group().path
+        dimensions = []
+        for d in range(0, len(self._cfa_var.pmdimensions)):
+            # get the dimension details from the _cfa_var
+            dim_name = self._cfa_var.pmdimensions[d]
+            cfa_dim = self._cfa_file.cfa_dims[dim_name]
+            # Check whether the dimension is part of the rootgroup or the group
+            in_root = group_path == '/' or dim_name in ip['nc_parent'].dimensions
+            # the dimension lengths come from the subarray, and the values for the partition are sliced from the
+            # values for the dimension
+            dimensions.append((cfa_dim.dim_name, cfa_dim.dim_len == -1, part.subarray.shape[d],
+                               cfa_dim.values[part.location[d,0]:part.location[d,1]+1], cfa_dim.metadata, in_root))
+        # add group metadata if necessary
+        group_metadata = None
+        if not type(self._group) == netCDF4.Dataset:
+            # create dict of group attrs
+            group_metadata = {}
+            for at in self._group.ncattrs():
+                group_metadata[at] = self._cfa_file.groups[self._group.name].getncattr(at)
+        spec.update({'format': self._cfa_file.format,
+                     'group': group_path.replace('/','') if group_path != '/' else None,
+                     'dimensions': dimensions,
+                     'datatype': self._nc_var.datatype,
+                     'pmdimensions': self._cfa_var.pmdimensions,
+                     'var_params': {param: ip[param] for param in VARIABLE_PARAMS},
+                     'metadata': self._cfa_var.metadata,
+                     'group_metadata': group_metadata})
+        return spec
+
+
+    def _fragment_values(self, part, pieces):
+        """Get the values to write to the subarray file of a partition from pieces, a list of (elem_slices, data):
+           return a list of (target_slice, data) with data sliced to the partition."""
+        # We have to decide where to copy this fragment of the data to (target) and from where in the original data
+        # we want to copy it (source)
+        values = []
         try:
-            file_details = slC.open(part.subarray.file, access_type=mode)
-        except slIOException:
-            os.makedirs(os.path.dirname(part.subarray.file))
-            file_details = slC.open(part.subarray.file, access_type=mode)
-        # check if the file has already been created
-        # This logic doesn't work if the files do not currently exist in cache
-        #if os.path.exists(part.subarray.file) and mode != 'w':
+            for elem_slices, data in pieces:
+                # get the source and target slices - these are flipped in relation to __getitem__
+                py_target_slice, py_source_slice = get_source_target_slices(part, elem_slices)
+                values.append((tuple(py_target_slice), data[tuple(py_source_slice)]))
+        except IndexError as e:
+            raise _subarray_index_error(e)
+        return values
+
+
+    def _write_partition(self, part, pieces, mode, file_details=None):
+        """Write a single partition.  This should be used by subclasses.
+           pieces is a list of (elem_slices, data), which are written to the subarray file in order, with the file
+           opened once.  file_details can be passed in if the partition has already been fetched by
+           _fetch_write_partition."""
+        # get the filename, either in the cache for s3 files or on disk for POSIX
+        if file_details is None:
+            file_details = self._fetch_write_partition(part, mode)
+        # checking if the file has already been created doesn't work if the files do not currently exist in cache
         # instead only check the mode!
-            # open the file in append mode
         if mode == 'r':
             raise slInterfaceException('Cannot change values in variable in read mode.')
-            # ncfile = netCDF4.Dataset(file_details, mode=mode)
-            # var = ncfile.variables[self._nc_var.name]
         elif mode == 'a' or mode == 'r+':
-            ncfile = netCDF4.Dataset(file_details, mode=mode)
+            # open the file in append mode
+            ncfile = self._open_partition(file_details, mode)
             var = ncfile.variables[self._nc_var.name]
-
         elif mode =='w':
-            # first create the destination directory, if it doesn't exist
-            dest_dir = os.path.dirname(file_details)
-            if not os.path.isdir(dest_dir):
-                os.makedirs(dest_dir)
-
             # create the netCDF file
-            ncfile = netCDF4.Dataset(file_details, mode, format=self._cfa_file.format)
-
-            # create any required groups
-            if self._nc_var.group().path != '/':
-                group = ncfile.createGroup(self._nc_var.group().path.replace('/',''))
-
-            # create the dimensions
-            for d in range(0, len(self._cfa_var.pmdimensions)):
-                # get the dimension details from the _cfa_var
-                dim_name = self._cfa_var.pmdimensions[d]
-                cfa_dim = self._cfa_file.cfa_dims[dim_name]
-
-                # the dimension lengths come from the subarray
-                dim_size = part.subarray.shape[d]
-                # create the dimension
-                # Check whether the dimension is part of the rootgroup or the group
-                if self._nc_var.group().path != '/':
-                    if dim_name in ip['nc_parent'].dimensions:
-                        if cfa_dim.dim_len == -1:       # allow for unlimited dimension
-                            ncfile.createDimension(cfa_dim.dim_name, None)
-                        else:
-                            ncfile.createDimension(cfa_dim.dim_name, dim_size)
-
-                        # create the dimension variable
-                        dim_var = ncfile.createVariable(cfa_dim.dim_name, cfa_dim.values.dtype, (cfa_dim.dim_name,))
-                        # add the metadata as attributes
-                        dim_var.setncatts(cfa_dim.metadata)
-                        # add the values for the dimension - we need to build the indices
-                        dim_var[:] = cfa_dim.values[part.location[d,0]:part.location[d,1]+1]
-
-                    else:
-                        if cfa_dim.dim_len == -1:       # allow for unlimited dimension
-                            group.createDimension(cfa_dim.dim_name, None)
-                        else:
-                            group.createDimension(cfa_dim.dim_name, dim_size)
-
-                        # create the dimension variable
-                        dim_var = group.createVariable(cfa_dim.dim_name, cfa_dim.values.dtype, (cfa_dim.dim_name,))
-                        # add the metadata as attributes
-                        dim_var.setncatts(cfa_dim.metadata)
-                        # add the values for the dimension - we need to build the indices
-                        dim_var[:] = cfa_dim.values[part.location[d,0]:part.location[d,1]+1]
-                else:
-                    if cfa_dim.dim_len == -1:       # allow for unlimited dimension
-                        ncfile.createDimension(cfa_dim.dim_name, None)
-                    else:
-                        ncfile.createDimension(cfa_dim.dim_name, dim_size)
-
-                    # create the dimension variable
-                    dim_var = ncfile.createVariable(cfa_dim.dim_name, cfa_dim.values.dtype, (cfa_dim.dim_name,))
-                    # add the metadata as attributes
-                    dim_var.setncatts(cfa_dim.metadata)
-                    # add the values for the dimension - we need to build the indices
-                    dim_var[:] = cfa_dim.values[part.location[d,0]:part.location[d,1]+1]
-
-            # create the variable - match the parameters to those used in the createVariable function in s3Dataset
-            if self._nc_var.group().path != '/':
-                var = group.createVariable(self._nc_var.name, self._nc_var.datatype, self._cfa_var.pmdimensions,
-                                            zlib = ip['zlib'], complevel = ip['complevel'], shuffle = ip['shuffle'],
-                                            fletcher32 = ip['fletcher32'], contiguous = ip['contiguous'],
-                                            chunksizes = ip['chunksizes'], endian = ip['endian'],
-                                            least_significant_digit = ip['least_significant_digit'],
-                                            fill_value = ip['fill_value'], chunk_cache = ip['chunk_cache'])
-            else:
-                var = ncfile.createVariable(self._nc_var.name, self._nc_var.datatype, self._cfa_var.pmdimensions,
-                                            zlib = ip['zlib'], complevel = ip['complevel'], shuffle = ip['shuffle'],
-                                            fletcher32 = ip['fletcher32'], contiguous = ip['contiguous'],
-                                            chunksizes = ip['chunksizes'], endian = ip['endian'],
-                                            least_significant_digit = ip['least_significant_digit'],
-                                            fill_value = ip['fill_value'], chunk_cache = ip['chunk_cache'])
-            # add the variable cfa_metadata
-            if self._cfa_var.metadata:
-                var.setncatts(self._cfa_var.metadata)
-            #TODO get attrbute percolation working working
-            # vattr = {}
-            # for at in self._nc_var.ncattrs():
-            #     vattr[at] = self._cfa_file.variables[self._nc_var.name].getncattr(at)
-            # var.setncatts(vattr)
-            # add group metadata if necessary
-            if not type(self._group) == netCDF4.Dataset:
-                # create dict of group attrs
-                gattr = {}
-                for at in self._group.ncattrs():
-                    gattr[at] = self._cfa_file.groups[self._group.name].getncattr(at)
-                group.setncatts(gattr)
-
-            # Need too add attributes not directly related to a variable
-            # fattr = {}
-            # for at in self.p.ncattrs(self.):
-            #     gattr[at] = self._cfa_file.groups[self._group.name].getncattr(at)
-            # group.setncatts(gattr)
+            ncfile = self._open_partition(file_details, mode, format=self._cfa_file.format)
+            var = create_fragment(ncfile, self._fragment_spec(part, mode))
         else:
             raise slIOException('Invalid file access mode in partition access.')
 
-
-        # now copy the data in.  We have to decide where to copy this fragment of the data to (target)
-        # and from where in the original data we want to copy it (source)
-        # get the source and target slices - these are flipped in relation to __getitem__
-        py_target_slice, py_source_slice = get_source_target_slices(part, elem_slices)
-        # copy the data in
+        # now copy the data in
         try:
-            var[tuple(py_target_slice)] = self._data[tuple(py_source_slice)]
-        except IndexError as e:
-            raise IndexError('{}\n\nIf trying to set the values in an array, the number of dimensions in the '
-                             'subarray must match the number of dimensions in the variable.'.format(e))
-        ncfile.close()
+            _write_values(var, self._fragment_values(part, pieces))
+        finally:
+            self._close_partition(ncfile)
         return part.subarray.file
 
 
@@ -209,13 +423,20 @@ class _baseInterface(object):
         return "baseInterface"
 
 
-    def set_read_params(self, data, read_threads):
-        """Set the required input papramenets to successfully read the CFA files"""
+    def set_read_params(self, data, read_threads, file_handles=None):
+        """Set the required input papramenets to successfully read the CFA files.
+           file_handles is an slFileHandles cache of open subarray files, if None the files are opened and closed
+           for each read."""
         self._data = data
         self._read_threads = read_threads
+        self._file_handles = file_handles
+        # {path: contents} of the subarray files read into memory by _fetch_partition, until they are opened - not
+        # when prefetching (data is None), as the files are fetched into the cache for a later read
+        self._memory_files = {} if data is not None else None
 
 
-    def set_write_params(self, data, nc_var, cfa_var, cfa_file, write_threads, init_params, group={'name':'root group'}):
+    def set_write_params(self, data, nc_var, cfa_var, cfa_file, write_threads, init_params, group={'name':'root group'},
+                         file_handles=None):
         """Set the required input parameters to successfully write the CFA files"""
         self._data = data
         self._nc_var = nc_var
@@ -224,6 +445,8 @@ class _baseInterface(object):
         self._write_threads = write_threads
         self._init_params = init_params
         self._group = group
+        self._file_handles = file_handles
+        self._memory_files = None
 
 
     def set_upload_params(self, file_details, cfa_variables, upload_threads):
@@ -246,27 +469,57 @@ class _baseInterface(object):
             nc_var = ret_vals[0]
             py_source_slice = ret_vals[1]
             py_target_slice = ret_vals[2]
-            self._data[tuple(py_target_slice)] = nc_var[tuple(py_source_slice)]
-            nc_file.close()
+            self._copy_from_partition(nc_var, py_source_slice, py_target_slice)
+            self._close_partition(nc_file)
+
+
+    def prefetch(self, blocks, n_ahead):
+        """Iterate over blocks, a sequence of (key, partitions), yielding each key once the subarray files of its
+           partitions have been fetched.  In serial the files are fetched just before each key is yielded, n_ahead is
+           used by the parallel interfaces to fetch the files for the following blocks while the caller processes the
+           current one."""
+        for key, partitions in blocks:
+            for part in partitions:
+                self._fetch_partition(part, 'r')
+            yield key
+
+
+    def _get_write_mode(self, part, mode=None):
+        """Get the mode to write a partition in.  In append mode we need to check whether the subfile exists, if it
+           doesn't, append mode is overwritten with 'w'.  mode overrides the mode of the file, e.g. to append to a
+           subarray file that has already been created by an earlier write to a file opened in 'w' mode."""
+        if self._is_diskless():
+            # the file exists if it has been created in memory
+            if self._file_handles.is_open(self._fetch_partition(part, 'a')):
+                return 'a'
+            return 'w'
+        if mode is None:
+            mode = self._init_params['mode']
+        if mode == 'a': # we only want this check when the mode is 'a'
+            # Cache open needed to get the cache path for checking if the file exists for appends
+            slC = slCache()
+            try:
+                path_exists_bool = os.path.exists(slC.open(part.subarray.file, mode))
+            except ValueError:
+                path_exists_bool = False
+            if not path_exists_bool:
+                mode = 'w'
+        return mode
 
 
     def write(self, partitions, elem_slices):
         """Write (in serial) the list of partitions which are in the subgroup determined by S3Variable.__setitem__"""
-        slC = slCache()
         # write all the paritions (serially)
+        return self.write_pieces([(part, [(elem_slices, self._data)], None) for part in partitions])
+
+
+    def write_pieces(self, part_pieces):
+        """Write (in serial) a list of (partition, pieces, mode), where pieces is a list of (elem_slices, data) to
+           write to the partition in order, and mode is the mode to write the partition in (see _get_write_mode).
+           Used to write the pieces gathered by the slWriteBuffer of an slVariable."""
         partitions_accessed = []
-        for part in partitions:
-            # need to check on append mode whether the subfiles exist, if they don't, overwrite append mode with 'w'
-            # Cache open needed to get the cache path for checking if the file exists for appends
-            if  self._init_params['mode'] == 'a': # we only want this check when the mode is 'a'
-                try:
-                    path_exists_bool = os.path.exists(slC.open(part.subarray.file,self._init_params['mode']))
-                except ValueError:
-                    path_exists_bool = False
-            if self._init_params['mode'] == 'a' and not path_exists_bool:
-                p = self._write_partition(part, elem_slices,'w')
-            else:
-                p = self._write_partition(part, elem_slices,self._init_params['mode'])
+        for part, pieces, mode in part_pieces:
+            p = self._write_partition(part, pieces, self._get_write_mode(part, mode))
             partitions_accessed.append(p)
 
         return partitions_accessed
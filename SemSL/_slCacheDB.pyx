@@ -8,7 +8,10 @@ import time
 import sys
 import numpy as np
 import pickle
+import struct
+import threading
 import collections
+import contextlib
 import datetime
 from SemSL._slConfigManager import slConfig
 import SemSL._slUtils as slU
@@ -80,6 +83,26 @@ class slCacheDB(object):
         # returns a list off all the file ids in the database
         raise NotImplementedError
 
+    def batch(self):
+        # context manager to make all the changes inside the with block in one transaction
+        raise NotImplementedError
+
+    def after_commit(self,callback):
+        # calls callback once the changes in the current batch have been committed
+        raise NotImplementedError
+
+    def add_entries(self,fids,sizes=None):
+        # adds many entries in one transaction
+        raise NotImplementedError
+
+    def touch_many(self,fids):
+        # updates the access times of the file ids that are in the cache, in one transaction
+        raise NotImplementedError
+
+    def remove_many(self,fids):
+        # removes many entries in one transaction
+        raise NotImplementedError
+
 class __slDBObject(object):
     '''
     Base object for storing cache fileobject data in lmdb
@@ -380,58 +403,224 @@ class slCacheDB_lmdb_nest(slCacheDB):
         self.env.close()
 
 
+# The access times and the total size of the files in the cache are indexed in two named sub-databases, so that
+# finding the least recently accessed file, or the space used by the cache, does not require a walk of every entry.
+# The times are stored as big-endian microseconds since EPOCH, and the sizes as big-endian integers.  The keys in the
+# access time index are the access time, so that they sort in time order, followed by the fid.
+INDEX_DB = b'access_index'
+META_DB = b'meta'
+TOTAL_SIZE_KEY = b'total_size'
+INDEX_VERSION_KEY = b'index_version'
+INDEX_VERSION = b'2'
+# the format of the times in databases created before INDEX_VERSION 2, which also stored the sizes as strings
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+EPOCH = datetime.datetime(1970, 1, 1)
+
+# lmdb only allows an environment to be opened once in a process, so the environments (and the handles to the
+# sub-databases) are shared between all the slCacheDB_lmdb instances.  Each entry is [env, index_db, meta_db, refs],
+# and the environment is closed when the last instance using it is closed.
+_lmdb_envs = {}
+_lmdb_envs_lock = threading.Lock()
+
+def _open_env(path, map_size):
+    """Return the entry for the cache database at path, opening it if it is not already open, and add a reference
+       to it."""
+    with _lmdb_envs_lock:
+        entry = _lmdb_envs.get(path)
+        # the database may have been removed (see slCacheManager._clear_cache) while it is still open
+        if entry is None or not os.path.exists(os.path.join(path, 'data.mdb')):
+            env = lmdb.open(path, map_size=map_size, max_dbs=2)
+            entry = [env, env.open_db(INDEX_DB), env.open_db(META_DB), 0]
+            _lmdb_envs[path] = entry
+        entry[3] += 1
+        return entry
+
+def _close_env(path, entry):
+    """Remove a reference to the entry from _open_env, closing the environment if it was the last one."""
+    with _lmdb_envs_lock:
+        entry[3] -= 1
+        if entry[3] > 0:
+            return
+        entry[0].close()
+        if _lmdb_envs.get(path) is entry:
+            del _lmdb_envs[path]
+
+def _pack_time(date):
+    """Pack a datetime as the big-endian microseconds since EPOCH."""
+    return struct.pack('>Q', (date - EPOCH) // datetime.timedelta(microseconds=1))
+
+def _unpack_time(value):
+    """Unpack a time packed by _pack_time to a datetime."""
+    return EPOCH + datetime.timedelta(microseconds=struct.unpack('>Q', value)[0])
+
+def _pack_size(size):
+    """Pack a size in bytes as a big-endian integer."""
+    return struct.pack('>Q', max(0, int(size)))
+
+def _unpack_size(value):
+    """Unpack a size packed by _pack_size."""
+    return struct.unpack('>Q', value)[0]
+
+def _time_key(time, fid):
+    """Key for the access time index from a time packed by _pack_time and the fid."""
+    return time + fid.encode()
+
 class slCacheDB_lmdb(slCacheDB):
     def __init__(self):
-        MAP_SIZE = 10*2**20
-        MAX_DBS = 0
+        # this is the maximum size the database can grow to, space is only used on disk as entries are added
+        MAP_SIZE = 2**30
         self.sl_config = slConfig()
         self.cache_loc =  self.sl_config['cache']['location']
         if not self.cache_loc[-1] == '/':
-            self.env = lmdb.open('{}/semslcachedb'.format(self.cache_loc),map_size=MAP_SIZE)
+            self.db_path = '{}/semslcachedb'.format(self.cache_loc)
+        else:
+            self.db_path = '{}semslcachedb'.format(self.cache_loc)
+        self._env_entry = _open_env(self.db_path, MAP_SIZE)
+        self.env, self.index_db, self.meta_db = self._env_entry[:3]
+        # the transaction for batch(), per thread as lmdb transactions cannot be shared between threads
+        self._batch = threading.local()
+        self._build_index()
+
+    def _begin(self,write=False):
+        """Return the transaction of the current batch, if there is one, otherwise begin a new transaction."""
+        txn = getattr(self._batch, 'txn', None)
+        if txn is not None:
+            return contextlib.nullcontext(txn)
+        return self.env.begin(write=write)
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Context manager to make all the changes to the database inside the with block in a single transaction,
+           which is committed (and synced to disk) once at the end of the block.  Batches can be nested.
+        """
+        if getattr(self._batch, 'txn', None) is not None:
+            yield self
+            return
+        callbacks = []
+        with self.env.begin(write=True) as txn:
+            self._batch.txn = txn
+            self._batch.callbacks = callbacks
+            try:
+                yield self
+            finally:
+                self._batch.txn = None
+                self._batch.callbacks = None
+        # the transaction has been committed
+        for callback in callbacks:
+            callback()
+
+    def after_commit(self,callback):
+        """Call callback once the changes in the current batch have been committed, after the database is unlocked,
+           or now if there isn't a batch.  The callback is not called if the batch fails."""
+        if getattr(self._batch, 'txn', None) is None:
+            callback()
         else:
-            self.env = lmdb.open('{}semslcachedb'.format(self.cache_loc),map_size=MAP_SIZE)
+            self._batch.callbacks.append(callback)
 
+    def _build_index(self):
+        """Build the access time index and the total size from the entries, if the database was created before
+           the index was added.  The times and sizes of entries from before INDEX_VERSION 2 are converted from
+           strings."""
+        # only take the write lock on the database if the index has to be built
+        with self.env.begin() as txn:
+            if txn.get(INDEX_VERSION_KEY, db=self.meta_db) == INDEX_VERSION:
+                return
+        with self.env.begin(write=True) as txn:
+            # another instance, or process, may have built the index in the meantime
+            if txn.get(INDEX_VERSION_KEY, db=self.meta_db) == INDEX_VERSION:
+                return
+            txn.drop(self.index_db, delete=False)
+            size_tot = 0
+            fids = [key.decode()[:-len('_cache_loc')] for key in txn.cursor().iternext(values=False)
+                    if key.endswith(b'_cache_loc')]
+            for fid in fids:
+                key_ct = '{}_create_time'.format(fid).encode()
+                key_at = '{}_access_time'.format(fid).encode()
+                key_fs = '{}_file_size'.format(fid).encode()
+                for key in (key_ct, key_at):
+                    value = txn.get(key)
+                    if len(value) != 8:
+                        txn.put(key, _pack_time(datetime.datetime.strptime(value.decode(), DATE_FORMAT)))
+                size = txn.get(key_fs)
+                if len(size) != 8:
+                    size = _pack_size(float(size.decode()))
+                    txn.put(key_fs, size)
+                txn.put(_time_key(txn.get(key_at), fid), b'', db=self.index_db)
+                size_tot += _unpack_size(size)
+            txn.put(TOTAL_SIZE_KEY, _pack_size(size_tot), db=self.meta_db)
+            txn.put(INDEX_VERSION_KEY, INDEX_VERSION, db=self.meta_db)
+
+    def _add_to_total(self,txn,size):
+        size_tot = _unpack_size(txn.get(TOTAL_SIZE_KEY, _pack_size(0), db=self.meta_db))
+        txn.put(TOTAL_SIZE_KEY, _pack_size(size_tot + size), db=self.meta_db)
+
+    def _remove_from_index(self,txn,fid):
+        """Remove an existing entry from the access time index and the total size, in the transaction txn."""
+        key_cl = '{}_cache_loc'.format(fid)
+        if txn.get(key_cl.encode()) is None:
+            return
+        key_at = '{}_access_time'.format(fid)
+        key_fs = '{}_file_size'.format(fid)
+        txn.delete(_time_key(txn.get(key_at.encode()), fid), db=self.index_db)
+        self._add_to_total(txn, -_unpack_size(txn.get(key_fs.encode())))
 
     def add_entry(self,fid,size=0):
         # need to convert to bytes string
         #print('FID IN CACHE ADD: {}'.format(fid))
-        now = datetime.datetime.now()
-        sDate = now.strftime('%Y-%m-%d %H:%M:%S.%f')
-        with self.env.begin(write=True) as txn:
+        now = _pack_time(datetime.datetime.now())
+        with self._begin(write=True) as txn:
+            # an existing entry is replaced
+            self._remove_from_index(txn, fid)
             cursor = txn.cursor()
             key_ct = '{}_create_time'.format(fid)
             key_at = '{}_access_time'.format(fid)
             key_fs = '{}_file_size'.format(fid)
             key_cl = '{}_cache_loc'.format(fid)
-            cursor.put(key_ct.encode(), sDate.encode())
-            cursor.put(key_at.encode(), sDate.encode())
-            cursor.put(key_fs.encode(), str(size).encode())
+            cursor.put(key_ct.encode(), now)
+            cursor.put(key_at.encode(), now)
+            cursor.put(key_fs.encode(), _pack_size(size))
 
             # remove alias and bucket from fid (can't assume last element in path is whole filepath)
-            bucket = slU._get_bucket(fid)
-            alias = slU._get_alias(fid)
-            fpath =  fid.replace(bucket,'')
-            fpath = fpath.replace(alias,'')
-            while fpath[0] == '/':
-                fpath = fpath[1:]
+            fpath = slU._get_key(fid)
             if self.cache_loc[-1] != '/':
                 cache_loc = '{}/{}'.format(self.cache_loc, fpath)
             else:
                 cache_loc = '{}{}'.format(self.cache_loc, fpath)
             cursor.put(key_cl.encode(), cache_loc.encode())
 
+            txn.put(_time_key(now, fid), b'', db=self.index_db)
+            self._add_to_total(txn, int(size))
+
+    def add_entries(self,fids,sizes=None):
+        # add many entries in one transaction
+        if sizes is None:
+            sizes = [0] * len(fids)
+        with self.batch():
+            for fid, size in zip(fids, sizes):
+                self.add_entry(fid, size)
+
+    def touch_many(self,fids):
+        # update the access time of the fids that are in the cache, in one transaction
+        with self.batch():
+            for fid in fids:
+                if self.check_cache(fid):
+                    self.update_access_time(fid)
+
+    def remove_many(self,fids):
+        # remove many entries in one transaction
+        with self.batch():
+            for fid in fids:
+                self.remove_entry(fid)
+
     def rename_entry(self,oldnames,newnames):
-        # get size of old entry
-        #print(self.get_all_fids())
-        for i in range(len(oldnames)):
-            #print('new name {}'.format(newnames[i]))
-            #print('old name {}'.format(oldnames[i]))
-            filesize = self.get_file_size(oldnames[i])
-            # add new entry
-
-            self.add_entry(newnames[i])#,filesize)
-            # delete old entry
-            self.remove_entry(oldnames[i])
+        with self.batch():
+            for i in range(len(oldnames)):
+                # get size of old entry so the total size of the cache is unchanged
+                filesize = self.get_file_size(oldnames[i])
+                # add new entry
+                self.add_entry(newnames[i],filesize)
+                # delete old entry
+                self.remove_entry(oldnames[i])
 
     def remove_entry(self,fid):
         # need to convert to bytes string
@@ -439,7 +628,8 @@ class slCacheDB_lmdb(slCacheDB):
         key_at = '{}_access_time'.format(fid)
         key_fs = '{}_file_size'.format(fid)
         key_cl = '{}_cache_loc'.format(fid)
-        with self.env.begin(write=True) as txn:
+        with self._begin(write=True) as txn:
+            self._remove_from_index(txn, fid)
             txn.delete(key_cl.encode())
             txn.delete(key_ct.encode())
             txn.delete(key_at.encode())
@@ -447,18 +637,22 @@ class slCacheDB_lmdb(slCacheDB):
 
     def update_access_time(self,fid):
         # need to convert to bytes string
-        with self.env.begin(write=True) as txn:
+        with self._begin(write=True) as txn:
             cursor = txn.cursor()
-            now = datetime.datetime.now()
-            sDate = now.strftime('%Y-%m-%d %H:%M:%S.%f')
+            now = _pack_time(datetime.datetime.now())
 
             key_at = '{}_access_time'.format(fid)
-            cursor.put(key_at.encode(), sDate.encode())
+            key_cl = '{}_cache_loc'.format(fid)
+            # move the entry to its new position in the access time index
+            if txn.get(key_cl.encode()) is not None:
+                txn.delete(_time_key(txn.get(key_at.encode()), fid), db=self.index_db)
+                txn.put(_time_key(now, fid), b'', db=self.index_db)
+            cursor.put(key_at.encode(), now)
 
     def check_cache(self,fid):
         # need to convert to bytes string
         key_cl = '{}_cache_loc'.format(fid)
-        with self.env.begin() as txn:
+        with self._begin() as txn:
             value = txn.get(key_cl.encode())
             if not value == None:
                 return True
@@ -466,14 +660,9 @@ class slCacheDB_lmdb(slCacheDB):
                 return False
 
     def check_db_empty(self):
-        with self.env.begin() as txn:
-            cursor = txn.cursor()
-            for key,value in cursor:
-                if key == None:
-                    continue
-                else:
-                    return False
-            return True
+        with self._begin() as txn:
+            cursor = txn.cursor(db=self.index_db)
+            return not cursor.first()
 
     def get_entry(self,fid):
         # need to convert to bytes string
@@ -482,7 +671,7 @@ class slCacheDB_lmdb(slCacheDB):
         key_fs = '{}_file_size'.format(fid)
         key_cl = '{}_cache_loc'.format(fid)
 
-        with self.env.begin() as txn:
+        with self._begin() as txn:
             cursor = txn.cursor()
             if cursor.get(key_cl.encode()):
                 return {'create_time':cursor.get(key_ct.encode()),
@@ -494,7 +683,7 @@ class slCacheDB_lmdb(slCacheDB):
 
     def get_fid(self,fid):
         # need to convert to bytes string
-        with self.env.begin() as txn:
+        with self._begin() as txn:
             cursor = txn.cursor()
             key_cl = '{}_cache_loc'.format(fid)
             if cursor.get(key_cl.encode()):
@@ -504,71 +693,54 @@ class slCacheDB_lmdb(slCacheDB):
 
     def get_cache_loc(self,fid):
         # need to convert to bytes string
-        with self.env.begin() as txn:
+        with self._begin() as txn:
             cursor = txn.cursor()
             key_cl = '{}_cache_loc'.format(fid)
             return cursor.get(key_cl.encode()).decode()
 
     def get_access_time(self,fid):
         # need to convert to bytes string
-        with self.env.begin() as txn:
+        with self._begin() as txn:
             cursor = txn.cursor()
             key_at = '{}_access_time'.format(fid)
-            sDate = cursor.get(key_at.encode())
-            oDate = datetime.datetime.strptime(sDate.decode(), '%Y-%m-%d %H:%M:%S.%f')
-            return oDate
+            return _unpack_time(cursor.get(key_at.encode()))
 
     def get_creation_time(self,fid):
         # need to convert to bytes string
-        with self.env.begin() as txn:
+        with self._begin() as txn:
             cursor = txn.cursor()
             key_ct = '{}_create_time'.format(fid)
-            sDate = cursor.get(key_ct.encode())
-            oDate = datetime.datetime.strptime(sDate.decode(), '%Y-%m-%d %H:%M:%S.%f')
-            return oDate
+            return _unpack_time(cursor.get(key_ct.encode()))
 
     def get_file_size(self,fid):
-        with self.env.begin() as txn:
+        with self._begin() as txn:
             cursor = txn.cursor()
-            key_at = '{}_file_size'.format(fid)
-            return float(cursor.get(key_at.encode()).decode())
+            key_fs = '{}_file_size'.format(fid)
+            return _unpack_size(cursor.get(key_fs.encode()))
 
     def get_total_cache_size(self):
-        size_tot = 0
-        fids = self.get_all_fids()
-        with self.env.begin() as txn:
-            for fid in fids:
-                size_tot += self.get_file_size(fid)
-        return size_tot
+        # the running total is maintained by add_entry / remove_entry
+        with self._begin() as txn:
+            return _unpack_size(txn.get(TOTAL_SIZE_KEY, _pack_size(0), db=self.meta_db))
 
     def get_least_recent(self):
-        least_recent = None
-        access_time = datetime.datetime.now()
-        fids = self.get_all_fids()
-        for fid in fids:
-            with self.env.begin() as txn:
-                cursor = txn.cursor()
-                key_ct = '{}_access_time'.format(fid)
-                sDate = cursor.get(key_ct.encode())
-                obj_accessed = datetime.datetime.strptime(sDate.decode(), '%Y-%m-%d %H:%M:%S.%f')
-                if obj_accessed < access_time:
-                    least_recent = fid
-                    access_time = obj_accessed
-        return least_recent
+        # the first key in the access time index
+        with self._begin() as txn:
+            cursor = txn.cursor(db=self.index_db)
+            if cursor.first():
+                return cursor.key()[8:].decode()
+        return None
 
     def get_all_fids(self):
-        file_list = collections.deque()
-        with self.env.begin() as txn:
-            cursor = txn.cursor()
-            for key,value in cursor:
-                removestr = key.decode().split('.nc')[-1]
-                fid_key = key.decode().replace(removestr,'')
-                if not fid_key in file_list:
-                    file_list.append(fid_key)
-        return list(set(file_list))
+        # returned in order of access time, least recent first
+        with self._begin() as txn:
+            cursor = txn.cursor(db=self.index_db)
+            return [key[8:].decode() for key in cursor.iternext(values=False)]
 
     def close_db(self):
-        self.env.close()
+        if self._env_entry is not None:
+            _close_env(self.db_path, self._env_entry)
+            self._env_entry = None
 
 # We need a database interface to not use lmdb potentially without a refactor
 class slCacheDB_sql(object):
@@ -10,16 +10,39 @@ __copyright__ = "(C) 2012 Science and Technology Facilities Council"
 __license__ = "BSD - see LICENSE file in top-level directory"
 
 import os
+import contextlib
+import hashlib
+import json
+import shutil
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from SemSL._slConfigManager import slConfig
 from SemSL._slConnectionManager import slConnectionManager
-from SemSL._slExceptions import slIOException, slCacheException
+from SemSL._slExceptions import slIOException, slCacheException, slConfigFileException
 import SemSL._slUtils as slU
+from psutil import virtual_memory
+import numpy as np
+from SemSL._CFAClasses import CFAFile
 
 from SemSL._slCacheDB import slCacheDB_lmdb as slCacheDB
 #from SemSL._slCacheDB import slCacheDB_lmdb_nest as slCacheDB
 #from SemSL._slCacheDB import slCacheDB_lmdb_obj as slCacheDB
 #from SemSL._slCacheDB import slCacheDB_sql as slCacheDB
 
+# the memory taken by the files read into memory by read_to_memory, for all the slCacheManagers in the process
+_memory_used = 0
+_memory_lock = threading.Lock()
+
+
+def release_memory(size):
+    """ Return the memory of a file read by slCacheManager.read_to_memory to the memory budget, once the file has
+        been closed.
+    """
+    global _memory_used
+    with _memory_lock:
+        _memory_used = max(0, _memory_used - size)
+
 
 class slCacheManager(object):
 
@@ -30,25 +53,19 @@ class slCacheManager(object):
         self.cache_loc =  self.sl_config['cache']['location']
         self.access_type = 'r'
 
-    def _return_client(self,fid):
-
+    @contextlib.contextmanager
+    def _client(self,fid,access_type='r'):
+        """ Context manager to get a client for the backend of the file from the connection pool.  The connection is
+            released back to the pool at the end of the with block.
+        """
         conn_man = slConnectionManager(self.sl_config)
         alias = slU._get_alias(fid)
-        conn = conn_man.open(alias)
-        client = conn.get()
-        return client
+        with conn_man.open(alias, access_type) as conn:
+            yield conn.get()
 
     def _get_fname(self,fid):
-        fname = fid[:]
-        alias = slU._get_alias(fid)
-        bucket = slU._get_bucket(fid)
-        fname = fname.replace(alias,'')
-        fname = fname.replace(bucket,'')
-        #remove preceeding /
-        while fname[0] == '/':
-            fname = fname[1:]
-
-        return fname
+        # the key of the file, without the alias and bucket
+        return slU._get_key(fid)
 
     def _space_in_cache(self,size):
         """ Calculates whether there is space in the cache for the new file.
@@ -66,43 +83,50 @@ class slCacheManager(object):
         """ Remove the oldest files from the cache giving at least space for
             the required size.
             size is the required amount of space for the new file
+            The entries are removed from the DB in one transaction, and the files are only deleted once it has been
+            committed (at the end of the caller's batch if this is called inside one), so that a failure leaves both
+            the entries and the files in the cache.
         """
-        while not self._space_in_cache(size):
-            rem_id = self.DB.get_least_recent()
-            self.DB.remove_entry(rem_id)
-            self._remove_file(rem_id)
+        if size > self.sl_config['cache']['cache_size']:
+            raise slCacheException('File of size {} is larger than the cache'.format(size))
+        removed = []
+        with self.DB.batch():
+            while not self._space_in_cache(size):
+                rem_id = self.DB.get_least_recent()
+                if rem_id is None:
+                    raise slCacheException('File of size {} is larger than the cache'.format(size))
+                self.DB.remove_entry(rem_id)
+                removed.append(rem_id)
+            self.DB.after_commit(lambda: self._remove_files(removed))
+
+    def _remove_files(self,fids):
+        for fid in fids:
+            self._remove_file(fid)
 
     def _write_to_cache(self,fid,test=False,file_size=None):
         if not self.DB.check_cache(fid):
 
             bucket = slU._get_bucket(fid)
-            client = self._return_client(fid)
             alias = slU._get_alias(fid)
             fname = self._get_fname(fid)
             # get the correct backend for the file
             backend = slU._get_backend(fid)
 
-
-            # Need to get the size of the file
-            if test:
-                if file_size is None:
-                    file_size = 90*10**6
-            else:
-                # need to calculate or query the files size
-                file_size = backend.get_object_size(client,bucket,fname)
-            # remove oldest cached files if need be
-            self._remove_oldest(file_size)
-
-
-            if '/' in fname:
-                try:
-                    os.makedirs(str.join('',fname.split('/')[:-1]))
-                except FileExistsError:
-                    pass
-
+            with self._client(fid) as client:
+                # Need to get the size of the file, if it wasn't passed in
+                if test:
+                    if file_size is None:
+                        file_size = 90*10**6
+                elif file_size is None:
+                    # need to calculate or query the files size
+                    file_size = backend.get_object_size(client,bucket,fname)
+                # remove oldest cached files if need be
+                self._remove_oldest(file_size)
 
 
-            backend.download(client,bucket,fname, self.DB.cache_loc+'/'+fname)
+                # the directory for the file in the cache
+                os.makedirs(os.path.dirname(self.DB.cache_loc+'/'+fname), exist_ok=True)
+                backend.download(client,bucket,fname, self.DB.cache_loc+'/'+fname)
 
             # update cachedb
             # set access and creation time, and filesize
@@ -112,35 +136,283 @@ class slCacheManager(object):
 
     def _upload_from_cache(self,fid,test=False):
         """
-        Uploads the required file from cache to the backend. Called from close().
+        Uploads the required file from cache to the backend.
         :param fid: the file name
         :param test: determines whether the call is from a test
         :return:
         """
+        self._upload_files([fid])
 
-        # get location of file
-        #print('file for upload {}'.format(fid))
-        cloc = self.DB.get_cache_loc(fid)
-        client = self._return_client(fid)
-        bucket = slU._get_bucket(fid)
+    def _group_by_alias(self,file_list):
+        """ Group the files in file_list by their alias, removing duplicates.  Files without an alias (i.e. POSIX
+            files) are not included.
+        """
+        groups = OrderedDict()
+        seen = set()
+        for file in file_list:
+            if file in seen:
+                continue
+            seen.add(file)
+            alias = slU._get_alias(file)
+            if alias is not None:
+                groups.setdefault(alias, []).append(file)
+        return groups
+
+    def _get_connections(self,fid,connection_type):
+        """ Get the number of connections ('read_connections' or 'write_connections') from the config for the host
+            of the file.  Defaults to 1 if they are not defined.
+        """
+        try:
+            host_name = slU._get_hostname(fid)
+            return max(1, int(self.sl_config['hosts'][host_name][connection_type]))
+        except (KeyError, TypeError, ValueError, slConfigFileException):
+            return 1
 
-        # get backend object
+    def _get_cache_path(self,fid):
+        """ Get the path to the file in the cache, from the DB if it has an entry.
+        """
+        if self.DB.check_cache(fid):
+            return self.DB.get_cache_loc(fid)
+        return os.path.join(self.DB.cache_loc, self._get_fname(fid))
+
+    def open_range(self,fid):
+        """ Get a URL that netCDF can read with HTTP byte-range requests, so that only the parts of the file that are
+            sliced are transferred, rather than downloading the whole file into the cache.
+            Returns None if the file should be opened through the cache instead: it is not on a backend, it is
+            already in the cache, byte_range_reads is not set for the host or the backend does not support it.
+        """
+        if slU._get_alias(fid) is None or self.DB.check_cache(fid):
+            return None
+        try:
+            host_name = slU._get_hostname(fid)
+            if not self.sl_config['hosts'][host_name].get('byte_range_reads', False):
+                return None
+        except (KeyError, slConfigFileException):
+            return None
         backend = slU._get_backend(fid)
+        try:
+            with self._client(fid) as client:
+                return backend.get_range_url(client, slU._get_bucket(fid), self._get_fname(fid))
+        except NotImplementedError:
+            return None
+
+    def _reserve_memory(self,size,force=False):
+        """ Take size bytes from the memory budget (memory_budget in the system section of the config file, or a
+            quarter of the physical memory).  Returns False if the budget would be exceeded, unless force is set.
+        """
+        global _memory_used
+        budget = self.sl_config['system'].get('memory_budget')
+        if budget is None:
+            budget = virtual_memory().total // 4
+        with _memory_lock:
+            if not force and _memory_used + size > budget:
+                return False
+            _memory_used += size
+            return True
+
+    def read_to_memory(self,fid,file_size=None,data=b'',force=False):
+        """ Read a file on a backend into memory, to be opened with netCDF4.Dataset(memory=...), rather than
+            fetching it into the cache and reading it from disk.
+            Only files no larger than object_size_for_memory in the system section of the config file are read, while
+            there is room in the memory budget.  file_size is the size of the file, or an upper limit on it, if known.
+            data is the start of the file if it has already been fetched - if it is the whole file no request is made.
+            force reads the file whatever its size.
+            The memory is taken from the budget until release_memory is called with the length of the data.
+            Returns the contents of the file, or None if it should be opened through the cache instead: it is not on a
+            backend, it is already in the cache, it is too large or there is no room in the budget.
+        """
+        if slU._get_alias(fid) is None or self.DB.check_cache(fid):
+            return None
+        max_size = self.sl_config['system'].get('object_size_for_memory', 0)
+        if file_size is None:
+            file_size = max_size
+        elif file_size > max_size and not force:
+            return None
+        if file_size <= len(data):
+            # the whole file has already been fetched
+            data = bytes(data[:file_size])
+            return data if self._reserve_memory(len(data), force) else None
+
+        n_bytes = int(file_size)
+        if n_bytes <= 0 or not self._reserve_memory(n_bytes, force):
+            return None
+        backend = slU._get_backend(fid)
+        try:
+            with self._client(fid) as client:
+                object_info = backend.get_object_info(client, slU._get_bucket(fid), self._get_fname(fid), n_bytes)
+        except NotImplementedError:
+            release_memory(n_bytes)
+            return None
+        except BaseException:
+            release_memory(n_bytes)
+            raise
+        if object_info is None:
+            release_memory(n_bytes)
+            raise slIOException("Error: " + fid + " not found.")
+        data = object_info['data']
+        # only the memory for the data that was returned is kept
+        release_memory(n_bytes - len(data))
+        if object_info['size'] > len(data):
+            # larger than the upper limit on its size
+            release_memory(len(data))
+            return None
+        return data
+
+    def get_validator(self,fid):
+        """ Get a value that changes when the file changes: the (ETag, size) of the object on the backend, with a single
+            HEAD request, or the (modification time, size) for POSIX files.  Returns None if the backend does not
+            support HEAD requests.
+        """
+        if slU._get_alias(fid) is None:
+            stat = os.stat(fid)
+            return (stat.st_mtime_ns, stat.st_size)
+        backend = slU._get_backend(fid)
+        try:
+            with self._client(fid) as client:
+                head = backend.get_head_object(client,slU._get_bucket(fid),self._get_fname(fid))
+        except NotImplementedError:
+            return None
+        return (head.get('ETag'), head.get('ContentLength'))
+
+    def _get_parsed_path(self,fid):
+        """ Get the path to the file holding the parsed CFA metadata of the master file fid, in the semslparsed
+            directory next to the cache DB.
+        """
+        return os.path.join(self.cache_loc, 'semslparsed', hashlib.sha1(fid.encode()).hexdigest() + '.npz')
+
+    def load_parsed(self,fid,validator=None):
+        """ Load the parsed CFA metadata (CFAFile) of the master file fid, saved by save_parsed.
+            Returns a tuple of the CFAFile, or None if there isn't a valid one, and the validator of the file (see
+            get_validator), which should be passed to save_parsed.  If the validator is not passed in then it is only
+            fetched from the backend if there is a saved CFAFile, so that files without one do not need a HEAD
+            request.
+            If the master file has changed since the CFAFile was saved then it is removed, along with the copy of the
+            master file in the cache, so that this should be called before the master file is opened.
+            The file is loaded without pickle, as the cache directory may be shared with other users.
+        """
+        path = self._get_parsed_path(fid)
+        try:
+            with np.load(path, allow_pickle=False) as npz:
+                saved = {k: npz[k] for k in npz.files}
+            saved_fid = str(saved.pop('fid')[()])
+            saved_validator = str(saved.pop('validator')[()])
+        except FileNotFoundError:
+            return None, validator
+        except Exception:
+            # truncated or from an incompatible version of SemSL - ignore it
+            self.remove_parsed(fid)
+            return None, validator
+
+        if validator is None:
+            try:
+                validator = self.get_validator(fid)
+            except OSError:
+                # the POSIX file has been removed
+                self.remove_parsed(fid)
+                return None, None
+        if validator is not None and saved_fid == fid and saved_validator == json.dumps(validator):
+            try:
+                return CFAFile.from_arrays(saved), validator
+            except Exception:
+                self.remove_parsed(fid)
+                return None, validator
+
+        # the master file has changed - the copy in the cache is out of date too
+        self.remove_parsed(fid)
+        if slU._get_alias(fid) is not None and self.DB.check_cache(fid):
+            self.DB.remove_entry(fid)
+            self._remove_file(fid)
+        return None, validator
+
+    def save_parsed(self,fid,cfa_file,validator):
+        """ Save the parsed CFA metadata (CFAFile) of the master file fid, so that subsequent opens can use it rather
+            than parsing the metadata again.  validator should be fetched, by load_parsed or get_validator, when the
+            master file is opened.  Nothing is saved if the validator is None.
+            The CFAFile is saved as numpy arrays (see CFAFile.arrays) rather than pickled.
+        """
+        if validator is None:
+            return
+        path = self._get_parsed_path(fid)
+        # write to a temporary file and move it into place so that other processes never read a partial file
+        tmp_path = '{}.{}'.format(path, os.getpid())
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            arrays = cfa_file.arrays()
+            with open(tmp_path, 'wb') as fh:
+                np.savez(fh, fid=np.array(fid), validator=np.array(json.dumps(validator)), **arrays)
+            os.replace(tmp_path, path)
+        except (OSError, TypeError):
+            # the saved metadata is only an optimisation
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    def remove_parsed(self,fid):
+        """ Remove the parsed CFA metadata of the master file fid, if it has been saved.
+        """
+        try:
+            os.remove(self._get_parsed_path(fid))
+        except OSError:
+            pass
 
-        # create list of buckets to check through
-        buckets_dict = backend.list_buckets(client)
-        bucket_check = False
-        for i in range(len(buckets_dict)):
-            if buckets_dict[i]['Name'] == bucket:
-                bucket_check = True
+    def _check_buckets(self,backend,client,buckets):
+        """ Check that the buckets exist on the backend and create any that don't.  The list of buckets is only
+            retrieved from the backend once.
+        """
+        existing_buckets = [b['Name'] for b in backend.list_buckets(client)]
+        for bucket in buckets:
+            if not bucket in existing_buckets:
+                backend.create_bucket(client,bucket)
+
+    def _upload_file(self,backend,fid,cloc,bucket,fname,data=None):
+        """ Upload a single file, run in a worker thread.  Returns None on success, or a tuple of the fid and the
+            exception on failure, so that every file can be attempted before the failures are reported.
+            If data is not None the file is uploaded from it, rather than from cloc in the cache.
+        """
+        try:
+            with self._client(fid,'w') as client:
+                if data is None:
+                    backend.upload(client,cloc,bucket,fname)
+                else:
+                    backend.upload_data(client,data,bucket,fname)
+        except Exception as e:
+            return (fid, e)
+        return None
+
+    def _upload_files(self,file_list,memory_files=None):
+        """ Upload the files in file_list from the cache to their backends.  For each backend, the buckets are checked
+            once and then the files are uploaded in parallel across the number of write_connections for the host.
+            Raises slIOException, listing the files that failed, once all of the uploads have been attempted.
+            The files in memory_files, {fid: buffer}, are uploaded from memory.
+        """
+        if memory_files is None:
+            memory_files = {}
+        failed = []
+        for alias, files_in_backend in self._group_by_alias(file_list).items():
+            # get the correct backend for the files
+            backend = slU._get_backend(files_in_backend[0])
+
+            # get the cache path, bucket and key for each file
+            uploads = []
+            for file in files_in_backend:
+                uploads.append((file, self._get_cache_path(file), slU._get_bucket(file), self._get_fname(file),
+                                memory_files.get(file)))
 
+            # create the buckets if they don't exist
+            with self._client(files_in_backend[0],'w') as client:
+                self._check_buckets(backend, client, set([u[2] for u in uploads]))
 
-        # create bucket if it doen't exist
-        if not bucket_check:
-            backend.create_bucket(client,bucket)
+            n_threads = min(self._get_connections(files_in_backend[0], 'write_connections'), len(uploads))
+            with ThreadPoolExecutor(max_workers=n_threads) as pool:
+                futures = [pool.submit(self._upload_file, backend, *u) for u in uploads]
+                for future in futures:
+                    if future.result() is not None:
+                        failed.append(future.result())
 
-        fname = self._get_fname(fid)
-        backend.upload(client,cloc,bucket,fname)
+        if len(failed) > 0:
+            raise slIOException("Failed to upload {} file(s) to the backend: {}".format(
+                                len(failed), ", ".join(["{} ({})".format(f, e) for f, e in failed])))
 
     def _check_whether_posix(self,fid,access_type):
         # Check whether there is an alias in the file path if not, assume it is a posix filepath and pass back the
@@ -193,6 +465,10 @@ class slCacheManager(object):
 
 
         if self.diskless:
+            if access_type == 'w':
+                # the file is created in memory and uploaded from there by close, so it is not added to the cache -
+                # the path is only used as the name of the file
+                return self._get_cache_path(fid)
             raise NotImplementedError
             # we need to assert whether the required file can fit into memory before we try
             # this, and if it doesn't, then throw an error?
@@ -205,16 +481,13 @@ class slCacheManager(object):
             else:
                 if test:
                     self._write_to_cache(fid,test=True,file_size=file_size)
-                    self.DB.add_entry(fid)
                 else:
                     # retrieve file from backend
                     if not diskless:
-                        # write file to cache
+                        # write file to cache, this adds the entry to the DB with the file size
                         # a 'download' avoids reading too much into memory and crashing as opposed to a 'read'
-                        #file_size= GET FILESIZE
+                        # file_size can be passed in if it is already known, to save a HEAD request
                         self._write_to_cache(fid,file_size=file_size)
-                        self.DB.add_entry(fid)
-                        #self._write_to_cache(fid,file_size=file_size)
                     else: # diskless
                         # 'get' file, don't write to cache
                         # if too large for memory, throw execption
@@ -231,13 +504,15 @@ class slCacheManager(object):
             raise slIOException('Invalid access type')
 
 
-    def close(self,fid,mode,subfiles_accessed=[],test=False):
+    def close(self,fid,mode,subfiles_accessed=[],test=False,memory_files=None):
         """ Uploads the file from cache, or directly to the backend, if not in cache, will save to cache
         :param test:
+        :param memory_files: {fid: buffer} the contents of the files of a diskless dataset, which are uploaded from
+                             memory rather than from the cache
         :return: 0 on success
         """
-        # update access db
-        self.DB.update_access_time(fid)
+        # update access db - for the master file and subfiles in one transaction
+        self.DB.touch_many([fid] + list(subfiles_accessed))
 
         #fid = self.fid
         if mode == 'r':
@@ -248,63 +523,81 @@ class slCacheManager(object):
             #    # do something
             #else:
             # do something else
+            # the CFA metadata may have changed
+            self.remove_parsed(fid)
             if self._check_whether_posix(fid,mode) == 'Alias exists':
-                self._upload_from_cache(fid)
-                # upload subfiles
-                for sf in subfiles_accessed:
-                    self._upload_from_cache(sf)
+                # upload the master file and subfiles together
+                self._upload_files([fid] + list(subfiles_accessed), memory_files)
 
 
         else:
             raise slIOException('Access mode not supported')
 
-    def bulk_download(self,file_list):
-        # Download all the files in the list in one backend call
-
-        # Get all the aliases in the file_list then do the download for each backend
-        aliases = []
-        for file in file_list:
-
-            file_alias = slU._get_alias(file)
-            if not file_alias in aliases:
-                aliases.append(file_alias)
+    def _get_file_size(self,backend,fid):
+        """ Get the size of a single file on the backend, run in a worker thread.
+        """
+        with self._client(fid) as client:
+            return backend.get_object_size(client,slU._get_bucket(fid),self._get_fname(fid))
 
+    def _download_file(self,backend,fid,cloc):
+        """ Download a single file into the cache, run in a worker thread.  Returns None on success, or a tuple of
+            the fid and the exception on failure.
+        """
+        try:
+            os.makedirs(os.path.dirname(cloc), exist_ok=True)
+            with self._client(fid) as client:
+                backend.download(client,slU._get_bucket(fid),self._get_fname(fid),cloc)
+        except Exception as e:
+            return (fid, e)
+        return None
 
-        # Keep track of file size total
+    def bulk_download(self,file_list):
+        """ Download all the files in file_list that are not already in the cache.  For each backend, the sizes of
+            the files are first retrieved in parallel, space in the cache is then reserved once for the whole set,
+            and the files are downloaded in parallel across the number of read_connections for the host.
+        """
+        # Get the files that need downloading for each backend, and their sizes
+        to_download = []
         tot_size = 0
-
-        for alias in aliases:
-            # build the  list for the backend
-            files_in_backend = []
-            for file in file_list:
-                if alias in file:
-                    files_in_backend.append(file)
-
-            bucket = slU._get_bucket(file)
-            client = self._return_client(file)
-            # get the correct backend for the file
-            backend = slU._get_backend(file_list[0])
-
-            # Do bulk download
-            for file in file_list:
-
-                fname = self._get_fname(file)
-                file_size = backend.get_object_size(client,bucket,fname)
-                tot_size+=file_size
-                if tot_size > self.sl_config['cache']['cache_size']:
-                    raise slCacheException("When updating subfile metadata the subfile's total size exceeded the"
-                                     "size of the cache")
-            # remove oldest cached files if need be
-                self._remove_oldest(file_size)
-
-            if '/' in fname:
-                try:
-                    os.makedirs(str.join('',fname.split('/')[:-1]))
-                except FileExistsError:
-                    pass
-            for file in files_in_backend:
-                fname = self._get_fname(file)
-                backend.download(client,bucket,fname, self.DB.cache_loc+'/'+fname)
+        for alias, files_in_backend in self._group_by_alias(file_list).items():
+            # get the correct backend for the files
+            backend = slU._get_backend(files_in_backend[0])
+
+            files = [file for file in files_in_backend if not self.DB.check_cache(file)]
+            # mark those already in the cache as recently used so they are not removed to make space for the rest
+            # of the set
+            self.DB.touch_many(files_in_backend)
+            if len(files) == 0:
+                continue
+
+            n_threads = min(self._get_connections(files[0], 'read_connections'), len(files))
+            with ThreadPoolExecutor(max_workers=n_threads) as pool:
+                sizes = list(pool.map(lambda f: self._get_file_size(backend, f), files))
+            tot_size += sum(sizes)
+            to_download.append((backend, n_threads, files, sizes))
+
+        if tot_size > self.sl_config['cache']['cache_size']:
+            raise slCacheException("When updating subfile metadata the subfile's total size exceeded the"
+                                   " size of the cache")
+        # remove oldest cached files if need be - once for the whole set
+        self._remove_oldest(tot_size)
+
+        # Do bulk download
+        failed = []
+        for backend, n_threads, files, sizes in to_download:
+            with ThreadPoolExecutor(max_workers=n_threads) as pool:
+                futures = [pool.submit(self._download_file, backend, file,
+                                       os.path.join(self.DB.cache_loc, self._get_fname(file)))
+                           for file in files]
+                results = [future.result() for future in futures]
+            # add the files that were downloaded to the DB
+            downloaded = [(file, size) for file, size, result in zip(files, sizes, results) if result is None]
+            self.DB.add_entries([file for file, size in downloaded], [size for file, size in downloaded])
+            failed.extend([result for result in results if result is not None])
+
+        if len(failed) > 0:
+            raise slIOException("Failed to download {} file(s) from the backend: {}".format(
+                                len(failed), ", ".join(["{} ({})".format(f, e) for f, e in failed])))
 
     def remove_from_backend(self,file_list):
         # remove all these files from the backend
@@ -328,48 +621,19 @@ class slCacheManager(object):
                         files_in_backend.append(file)
 
                 bucket = slU._get_bucket(file)
-                client = self._return_client(file)
                 # get the correct backend for the file
                 backend = slU._get_backend(file_list[0])
 
                 # Do bulk download
-                for file in file_list:
-                    fname = self._get_fname(file)
-                    backend.remove_obj(client,bucket,fname)
+                with self._client(file,'w') as client:
+                    for file in file_list:
+                        fname = self._get_fname(file)
+                        backend.remove_obj(client,bucket,fname)
 
 
     def bulk_upload(self,file_list):
-        # Download all the files in the list in one backend call
-
-        # Get all the aliases in the file_list then do the download for each backend
-        aliases = []
-        for file in file_list:
-            file_alias = slU._get_alias(file)
-            if not file_alias in aliases:
-                aliases.append(file_alias)
-
-        # Keep track of file size total
-        tot_size = 0
-
-        for alias in aliases:
-            # build the  list for the backend
-            if alias != None:
-                files_in_backend = []
-                for file in file_list:
-
-                    if alias in file:
-                        files_in_backend.append(file)
-
-                bucket = slU._get_bucket(file)
-                client = self._return_client(file)
-                # get the correct backend for the file
-                backend = slU._get_backend(file_list[0])
-
-                for file in files_in_backend:
-                    fname = self._get_fname(file)
-                    cachedfile = self.DB.cache_loc+'/'+fname
-                    cachedfile.replace('//','/')
-                    backend.upload(client,cachedfile,bucket,fname)
+        # Upload all the files in the list, in parallel for each backend
+        self._upload_files(file_list)
 
     def _remove_file(self,fid,silent=True):
         key = slU._get_key(fid)
@@ -392,8 +656,9 @@ class slCacheManager(object):
         file_list = self.DB.get_all_fids()
         for fid in file_list:
             self._remove_file(fid)
-            self.DB.remove_entry(fid)
+        self.DB.remove_many(file_list)
         self.DB.close_db()
+        shutil.rmtree(os.path.join(self.cache_loc, 'semslparsed'), ignore_errors=True)
         if self.DB.cache_loc[-1] != '/':
             try:
                 path = '{}/semslcachedb'.format(self.cache_loc)
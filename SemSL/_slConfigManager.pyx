@@ -8,8 +8,16 @@ __license__ = "BSD - see LICENSE file in top-level directory"
 
 import os
 import json
+import threading
+from types import MappingProxyType
 from _slExceptions import slIOException, slAPIException
 
+# The config is read once per process and shared by every slConfig instance.  It is only re-read if the
+# modification time or size of the file changes, or if slConfig.reload is called.
+# _config_cache maps the path of the config file to a tuple of (mtime, size, config)
+_config_cache = {}
+_config_lock = threading.Lock()
+
 def convert_file_size_string(value):
     """Convert a string containing a file size and suffix to an integer number
     of bytes.
@@ -52,40 +60,76 @@ def interpret_config_file(node, keys_to_convert):
             node[key] = convert_file_size_string(item)
 
 
-class slConfig(object):
-    """Class to read in config file, interpret it and make the information
-    available.
-    """
-
-    def __init__(self):
-        """Initialise SemSL for this user by reading the config file from their
-        home directory.  Config file is called ~/.sem-sl.json"""
-        # First read the JSON config file from the user home directory
-        # get user home directory
-        user_home = os.environ["HOME"]
+def freeze_config(node):
+    """Recursively convert the dictionaries (and lists) in the config to read-only mappings (and tuples), so that
+    the shared config cannot be altered by one of its users."""
+    if isinstance(node, dict):
+        return MappingProxyType({key: freeze_config(item) for key, item in node.items()})
+    elif isinstance(node, list):
+        return tuple(freeze_config(item) for item in node)
+    return node
 
-        # create the path
-        sl_config_path = os.path.join(user_home, ".sem-sl.json")
 
+def load_config(sl_config_path, reload=False):
+    """Return the interpreted, read-only config from the file at sl_config_path.  The file is only read and
+    parsed if it has not been read before, it has changed since it was last read, or reload is True."""
+    try:
+        stat = os.stat(sl_config_path)
+    except OSError:
+        raise slIOException("User config file does not exist with path: " +
+                            sl_config_path)
+    with _config_lock:
+        if not reload and sl_config_path in _config_cache:
+            mtime, size, config = _config_cache[sl_config_path]
+            if mtime == stat.st_mtime and size == stat.st_size:
+                return config
         # open the file
         try:
             fp = open(sl_config_path)
             # deserialize from the JSON
-            self._sl_user_config = json.load(fp)
+            sl_user_config = json.load(fp)
             # add the filename to the config so we can refer to it in error
             # messages
-            self._sl_user_config["filename"] = sl_config_path
+            sl_user_config["filename"] = sl_config_path
             keys_to_convert = ["object_size",
                                "cache_size",
                                "object_size_for_memory",
-                               "default_object_size"]
+                               "default_object_size",
+                               "write_buffer_size",
+                               "memory_budget",
+                               "multipart_threshold",
+                               "multipart_chunksize"]
             # interpret the config file, converting the above keys
-            interpret_config_file(self._sl_user_config, keys_to_convert)
+            interpret_config_file(sl_user_config, keys_to_convert)
             # close the config file
             fp.close()
         except IOError:
             raise slIOException("User config file does not exist with path: " +
                                 sl_config_path)
+        config = freeze_config(sl_user_config)
+        _config_cache[sl_config_path] = (stat.st_mtime, stat.st_size, config)
+        return config
+
+
+class slConfig(object):
+    """Class to read in config file, interpret it and make the information
+    available.  The config is cached for the process, see load_config.
+    """
+
+    def __init__(self):
+        """Initialise SemSL for this user by reading the config file from their
+        home directory.  Config file is called ~/.sem-sl.json"""
+        # First read the JSON config file from the user home directory
+        # get user home directory
+        user_home = os.environ["HOME"]
+
+        # create the path
+        self._sl_config_path = os.path.join(user_home, ".sem-sl.json")
+        self._sl_user_config = load_config(self._sl_config_path)
+
+    def reload(self):
+        """Force the config file to be re-read, for this and all subsequently created slConfig instances"""
+        self._sl_user_config = load_config(self._sl_config_path, reload=True)
 
     def __getitem__(self, name):
         """Get a value from the s3 config"""
@@ -4,14 +4,43 @@ o. Connections are made via the backends and kept in a "Connection Pool".
 o. When connections are made they are locked and then can be released so that
    they can be reused without having to re-establish the connection.
 o. When a connection is closed it is removed from the pool.
+o. The pool is shared by every slConnectionManager in the process, and is
+   thread safe.  The number of connections in use to a host is limited to the
+   read_connections / write_connections in the user config file.  open will
+   wait for a connection to be released if the limit has been reached.
+o. Connections should be used in a with block, which releases them at the
+   end of the block.  A connection that is garbage collected without being
+   released no longer counts against the limit, and is closed rather than
+   returned to the pool - it may be garbage collected in a reference cycle,
+   after the client has been finalised.
 """
 
 __copyright__ = "(C) 2012 Science and Technology Facilities Council"
 __license__ = "BSD - see LICENSE file in top-level directory"
 
+import threading
+from collections import Counter
 from _slExceptions import slIOException, slAPIException
 from SemSL import Backends
 
+# The process wide connection pool:
+#   _idle_connections     : {endpoint: [slConnection]} connections that are available for reuse
+#   _connections_in_use   : {(endpoint, access_type): n} the number of connections locked for reading / writing
+#   _connections_held     : {(endpoint, access_type, thread_id): n} the connections locked by each thread
+# all protected by _pool_condition, which is notified whenever a connection is released or closed
+_idle_connections = {}
+_connections_in_use = Counter()
+_connections_held = Counter()
+_pool_condition = threading.Condition()
+
+
+def _get_limit_key(access_type):
+    """Get the config key for the limit of the number of connections for the access type."""
+    if access_type == 'r':
+        return 'read_connections'
+    return 'write_connections'
+
+
 class slConnection(object):
     """Object to store in the connection pool."""
     def __init__(self, alias, backend_name, conn):
@@ -20,6 +49,34 @@ class slConnection(object):
         self._backend_name = backend_name
         self._conn = conn
         self._available = False
+        self._closed = False
+        # the endpoint, access type and thread that the connection is locked for
+        self._lock_key = None
+
+    def __del__(self):
+        """Remove a connection that was not released from the number in use,
+        so that other threads are not kept waiting for it, and close its
+        client.  The client is not put back in the pool, as it may already have
+        been finalised if the connection was in a reference cycle."""
+        if self._lock_key is not None and not self._closed:
+            with _pool_condition:
+                self._closed = True
+                _unlock(self._lock_key)
+                self._lock_key = None
+                _pool_condition.notify_all()
+            try:
+                Backends.get_backend_from_id(self._backend_name)().close(self._conn)
+            except Exception:
+                # the client or backend may have been finalised already
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Release the connection at the end of a with block."""
+        self.release()
+        return False
 
     def alias(self):
         """Get the alias for the connection."""
@@ -27,24 +84,46 @@ class slConnection(object):
 
     def backend(self):
         """Connection type, i.e. which backend does the connection use?"""
-        return self._backend
+        return self._backend_name
 
     def release(self):
         """Release the connection object to allow it to be reused."""
-        self._available = True
+        with _pool_condition:
+            if self._lock_key is not None:
+                endpoint = self._lock_key[0]
+                _unlock(self._lock_key)
+                self._lock_key = None
+                if not self._closed:
+                    _idle_connections.setdefault(endpoint, []).append(self)
+            self._available = True
+            _pool_condition.notify_all()
 
-    def lock(self):
+    def lock(self, endpoint=None, access_type='r'):
         """Lock the connection object to prevent it from being reused."""
-        self._available = False
+        with _pool_condition:
+            if endpoint is not None:
+                self._lock_key = (endpoint, access_type, threading.get_ident())
+                _connections_in_use[self._lock_key[:2]] += 1
+                _connections_held[self._lock_key] += 1
+            self._available = False
 
     def close(self):
         """Close the connection pointed at by the _conn object."""
         # get the backend - this should always return as checking is performed
         # when the slConnection object is created
-        backend = Backends.get_backend_from_id(self._backend_name)
+        backend = Backends.get_backend_from_id(self._backend_name)()
         backend.close(self._conn)
-        # mark the connection as unavailable
-        self._available = False
+        # mark the connection as unavailable and remove it from the pool
+        with _pool_condition:
+            self._closed = True
+            if self._lock_key is not None:
+                _unlock(self._lock_key)
+                self._lock_key = None
+            for idle in _idle_connections.values():
+                if self in idle:
+                    idle.remove(self)
+            self._available = False
+            _pool_condition.notify_all()
 
     def get(self):
         """Return the underlying connection object, e.g. FTP lib object,
@@ -60,17 +139,26 @@ class slConnection(object):
         return not self._available
 
 
+def _unlock(lock_key):
+    """Remove a locked connection from the counts, must be called with _pool_condition held."""
+    _connections_in_use[lock_key[:2]] -= 1
+    _connections_held[lock_key] -= 1
+    if _connections_held[lock_key] <= 0:
+        del _connections_held[lock_key]
+
+
 class slConnectionManager(object):
     """Connection manager for Sem-SL.  Stores connections in a connection pool
     and persists connections to remove the overhead of establishing the
-    connection for every fragment when writing / reading."""
+    connection for every fragment when writing / reading.  The connection pool
+    is shared by all instances of slConnectionManager."""
 
     def __init__(self, sl_config):
         """Initialise by passing in the config dictionary."""
         self._sl_config = sl_config
-        self._connection_pool = {}
+        self._connection_pool = _idle_connections
 
-    def open(self, endpoint):
+    def open(self, endpoint, access_type='r'):
         """Open or retrieve a connection to the connection_uri.  Operation:
         o. Identify what type of connection to make and read the details from
         the config.
@@ -78,13 +166,20 @@ class slConnectionManager(object):
         connection pool and return if there is.
         o. Create a new connection if there isn't and add to the connection pool
         setting available to false.
+        o. If the number of connections in use for the access_type ('r'ead or
+        'w'rite / 'a'ppend) has reached the limit in the config then wait for a
+        connection to be released.  A thread that already holds a connection
+        to the endpoint does not wait, so that it cannot deadlock itself.
+        The connection should be released once it has been used.
         """
         # set the host name to not-found
         host_name = None
         try:
             hosts = self._sl_config["hosts"]
             for h in hosts:
-                if endpoint in hosts[h]['alias']:
+                # match the whole alias, so that an alias which is a
+                # substring of another alias is not matched
+                if hosts[h]['alias'].rstrip('/') == endpoint.rstrip('/'):
                     host_name = h
         except Exception as e:
             raise slIOException("Error in config file {} {}".format(
@@ -108,69 +203,69 @@ class slConnectionManager(object):
             credentials = host_config['required_credentials']
         except:
             raise slIOException("Error in config file {}".format(
-                                   self._s3_user_config["filename"])
+                                   self._sl_config["filename"])
                                )
+        # get the maximum number of connections for this access type
+        try:
+            max_connections = max(1, int(host_config[_get_limit_key(access_type)]))
+        except (KeyError, TypeError, ValueError):
+            max_connections = 1
+
         # Check that the desired backend is in the list
         if backend_name not in Backends.get_backend_ids():
             raise slIOException("Error backend {} not found or not supported".format(
                                    backend_name)
                                )
-        # Otherwise, try to create the backend
+
+        # try to find a free connection to this endpoint, waiting for one to
+        # be released if the limit has been reached
+        thread_key = (endpoint, access_type, threading.get_ident())
+        with _pool_condition:
+            while (_connections_in_use[(endpoint, access_type)] >= max_connections
+                   and _connections_held[thread_key] == 0):
+                _pool_condition.wait()
+            idle = _idle_connections.get(endpoint, [])
+            if len(idle) > 0:
+                # a connection is available so lock it and return it
+                sl_conn = idle.pop()
+                sl_conn.lock(endpoint, access_type)
+                return sl_conn
+            # reserve the connection while it is created
+            _connections_in_use[(endpoint, access_type)] += 1
+            _connections_held[thread_key] += 1
+
+        # now try to create the backend and connect to it
         try:
             backend = Backends.get_backend_from_id(backend_name)()
+            conn = backend.connect(url_name, credentials, host_config)
         except Exception as e:
-            raise slIOException("Error creating backend {} {}".format(
-                                backend_name, e)
+            with _pool_condition:
+                _unlock(thread_key)
+                _pool_condition.notify_all()
+            raise slIOException("Error connecting to backend {} {} {}".format(
+                                backend_name, url_name, e)
                                )
 
-        # try to find a free connection to this endpoint
-        create_connection = True
-        if endpoint in self._connection_pool:
-            # loop over to see if there are any available connections
-            for sl_conn in self._connection_pool[endpoint]:
-                if sl_conn.available():
-                    # a connection is available so lock it
-                    sl_conn.lock()
-                    # we don't need to create a connection, we have this one
-                    create_connection = False
-                    # sl_conn will be returned
-                    break
-
-        if create_connection:
-            # now try to connect to the backend
-            try:
-                conn = backend.connect(url_name, credentials)
-            except Exception as e:
-                raise slIOException("Error connecting to backend {} {} {}".format(
-                                    backend_name, url_name, e)
-                                   )
-
-            # add the connection to the connection pool
-            sl_conn = slConnection(host_name, backend_name, conn)
-            # indicate we are using the connection
-            sl_conn.lock()
-            # add to the pool
-            if endpoint in self._connection_pool:
-                self._connection_pool[endpoint].append(sl_conn)
-            else:
-                self._connection_pool[endpoint] = [sl_conn]
+        # the connection joins the pool when it is released
+        sl_conn = slConnection(host_name, backend_name, conn)
+        # indicate we are using the connection - the reservation above is
+        # transferred to the connection
+        sl_conn._lock_key = thread_key
+        sl_conn._available = False
         return sl_conn
 
     def total_connections(self, endpoint):
         """Get the number of connections to a particular host / alias."""
-        if endpoint in self._connection_pool:
-            return len(self._connection_pool[endpoint])
-        else:
-            return 0
+        with _pool_condition:
+            return (len(_idle_connections.get(endpoint, [])) +
+                    self.open_connections(endpoint))
 
     def open_connections(self, endpoint):
         """Get the number of connections that are in use to a particular
         host / alias."""
-        if endpoint in self._connection_pool:
+        with _pool_condition:
             total = 0
-            for sl_conn in self._connection_pool[endpoint]:
-                if sl_conn.locked():
-                    total += 1
+            for (ep, access_type), n in _connections_in_use.items():
+                if ep == endpoint:
+                    total += n
             return total
-        else:
-            return 0
@@ -22,4 +22,7 @@ class slDBException(BaseException):
     pass
 
 class slNetCDFException(BaseException):
+    pass
+
+class CFAException(BaseException):
     pass
\ No newline at end of file
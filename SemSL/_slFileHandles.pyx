@@ -0,0 +1,145 @@
+"""
+Cache of open netCDF4.Datasets for the subarray files of a slDataset.  Operation:
+o. Reading or writing a partition acquires the netCDF4.Dataset for its subarray
+   file from the cache, which opens the file if it is not already open, and
+   releases it afterwards.  The Dataset is left open so that repeated slicing of
+   the same variable does not have to reopen the (HDF5) file each time.
+o. The Datasets are keyed by the path to the file (in the cache for files on a
+   backend) and the mode: 'r' for reading and 'a' for writing.  Files created in
+   'w' mode are kept as 'a', and a Dataset open for writing is also used for
+   reading.
+o. The number of open Datasets is limited to open_file_handles in the system
+   section of ~/.sem-sl.json.  When the limit is reached the least recently used
+   Dataset that is not acquired is closed.
+o. All the Datasets are closed when the slDataset is closed or synced, so that
+   the subarray files are complete before they are uploaded to the backend.
+o. Opening and closing the files calls the netCDF library, so the cache is
+   protected by NC_LOCK.
+o. For diskless slDatasets the files created in 'w' mode are built in memory,
+   with the path only used as their key.  They are not closed to stay within
+   the limit, as closing them returns their contents, which close returns so
+   that they can be uploaded to the backend.
+"""
+
+__copyright__ = "(C) 2012 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+
+from collections import OrderedDict
+import netCDF4._netCDF4 as netCDF4
+from SemSL._threadInterface import NC_LOCK
+from SemSL._slExceptions import slIOException
+
+# the number of open files if open_file_handles is not in the config file
+DEFAULT_OPEN_FILE_HANDLES = 16
+# the initial size of the memory for files created in memory, the netCDF library grows it as required
+DISKLESS_INITIAL_SIZE = 64 * 1024
+
+
+class slFileHandles(object):
+    """LRU cache of the open netCDF4.Datasets of subarray files."""
+
+    def __init__(self, max_handles=DEFAULT_OPEN_FILE_HANDLES, diskless=False):
+        self._max_handles = max(1, int(max_handles))
+        self.diskless = diskless
+        # {(path, mode): [nc_file, number of times acquired]}, least recently used first
+        self._handles = OrderedDict()
+        # the keys of the files created in memory
+        self._in_memory = set()
+
+    def __len__(self):
+        return len(self._handles)
+
+    def acquire(self, path, mode, **kwargs):
+        """Get an open netCDF4.Dataset for the file at path.  In 'w' mode the file is always created, in 'r', 'a'
+           and 'r+' mode an already open Dataset is returned if there is one.  kwargs are passed to
+           netCDF4.Dataset if the file is opened.  release should be called when the Dataset is no longer used."""
+        if mode == 'r':
+            keys = [(path, 'r'), (path, 'a')]
+        else:
+            keys = [(path, 'a')]
+        with NC_LOCK:
+            if mode != 'w':
+                for key in keys:
+                    entry = self._handles.get(key)
+                    if entry is None:
+                        continue
+                    if not entry[0].isopen():
+                        # closed by the user of the Dataset
+                        del self._handles[key]
+                        continue
+                    entry[1] += 1
+                    self._handles.move_to_end(key)
+                    return entry[0]
+            if mode != 'r':
+                # the file cannot be open in any other mode when it is written to
+                self.discard(path)
+            if mode == 'w' and self.diskless:
+                nc_file = netCDF4.Dataset(path, mode=mode, memory=DISKLESS_INITIAL_SIZE, **kwargs)
+                self._in_memory.add(keys[0])
+            else:
+                nc_file = netCDF4.Dataset(path, mode=mode, **kwargs)
+            self._handles[keys[0]] = [nc_file, 1]
+            self._trim()
+            return nc_file
+
+    def release(self, nc_file):
+        """Release a Dataset returned by acquire, which allows it to be closed when the cache is full."""
+        with NC_LOCK:
+            for entry in self._handles.values():
+                if entry[0] is nc_file:
+                    entry[1] = max(0, entry[1] - 1)
+                    break
+            self._trim()
+
+    def discard(self, path):
+        """Close the Datasets for the file at path.  Raise an slIOException if one of them is acquired."""
+        with NC_LOCK:
+            for key in [(path, 'r'), (path, 'a')]:
+                entry = self._handles.get(key)
+                if entry is None:
+                    continue
+                if entry[1] > 0 and entry[0].isopen():
+                    raise slIOException("Subarray file {} is already open.".format(path))
+                self._close_entry(key)
+
+    def is_open(self, path):
+        """Return whether there is an open Dataset for the file at path"""
+        with NC_LOCK:
+            for key in [(path, 'r'), (path, 'a')]:
+                entry = self._handles.get(key)
+                if entry is not None and entry[0].isopen():
+                    return True
+            return False
+
+    def close(self):
+        """Close all the Datasets, whether they are acquired or not.  Return {path: memoryview} of the contents of
+           the files created in memory."""
+        memory_files = {}
+        with NC_LOCK:
+            while self._handles:
+                key = next(iter(self._handles))
+                memory = self._close_entry(key)
+                if memory is not None:
+                    memory_files[key[0]] = memory
+        return memory_files
+
+    def _trim(self):
+        """Close the least recently used Datasets, that are not acquired, until the number open is within the limit"""
+        if len(self._handles) <= self._max_handles:
+            return
+        for key in list(self._handles.keys()):
+            if self._handles[key][1] == 0 and key not in self._in_memory:
+                self._close_entry(key)
+                if len(self._handles) <= self._max_handles:
+                    break
+
+    def _close_entry(self, key):
+        """Close the Dataset, returning the contents of a file created in memory"""
+        nc_file = self._handles.pop(key)[0]
+        memory = None
+        if nc_file.isopen():
+            memory = nc_file.close()
+        if key not in self._in_memory:
+            return None
+        self._in_memory.discard(key)
+        return memory
@@ -0,0 +1,109 @@
+"""
+Scratch buffers for the slices of CFA variables that are too large to read into memory.  Operation:
+o. A scratch buffer is a numpy.memmap of a file in the semslscratch directory in
+   the cache.  The file is added to the cache DB, so that it counts towards the
+   cache_size, and the least recently used files in the cache are removed to
+   make space for it.
+o. When the memmap is garbage collected its file is kept for the next slice of
+   the same shape and dtype, unless the cache has removed it in the meantime.
+   The file is zeroed before it is reused, as a new file is.
+o. When the slDataset is closed the unused files are deleted, and files that are
+   still in use are deleted when their memmap is garbage collected.
+"""
+
+__copyright__ = "(C) 2012 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+
+import os
+import uuid
+import threading
+import weakref
+import numpy
+from SemSL._slCacheManager import slCacheManager
+from SemSL._slExceptions import slCacheException
+
+# the directory in the cache, and the prefix of the file ids in the cache DB
+SCRATCH_DIR = 'semslscratch'
+
+
+class slScratchBuffers(object):
+    """The scratch buffers of an slDataset, see above."""
+
+    def __init__(self):
+        self._sl_cache = slCacheManager()
+        # {(shape, dtype): [fid]} the files that are not in use
+        self._idle = {}
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def get(self, shape, dtype):
+        """Get a numpy.memmap of the shape and dtype, filled with zeros."""
+        shape = tuple([int(s) for s in shape])
+        dtype = numpy.dtype(dtype)
+        key = (shape, dtype.str)
+        buffer = None
+        with self._lock:
+            if self._closed:
+                raise slCacheException("Scratch buffers have been closed.")
+            fids = self._idle.get(key, [])
+            while fids and buffer is None:
+                fid = fids.pop()
+                if self._sl_cache.DB.check_cache(fid):
+                    self._sl_cache.DB.update_access_time(fid)
+                    # discard the data of the previous slice - truncating the file zeroes it without writing every
+                    # page
+                    path = self._get_path(fid)
+                    os.truncate(path, 0)
+                    os.truncate(path, self._get_size(shape, dtype))
+                    buffer = numpy.memmap(path, dtype=dtype, mode='r+', shape=shape)
+                else:
+                    # removed from the cache to make space for other files
+                    self._sl_cache._remove_file(fid)
+            if buffer is None:
+                fid, buffer = self._create(shape, dtype)
+        # return the file when the memmap is garbage collected
+        weakref.finalize(buffer, self._release, fid, key)
+        return buffer
+
+    def close(self):
+        """Delete the files that are not in use, the rest are deleted when they are garbage collected."""
+        with self._lock:
+            self._closed = True
+            for fids in self._idle.values():
+                for fid in fids:
+                    self._remove(fid)
+            self._idle = {}
+
+    def _create(self, shape, dtype):
+        size = self._get_size(shape, dtype)
+        if size > self._sl_cache.sl_config['cache']['cache_size']:
+            raise slCacheException("Slice of size {} is larger than the cache, read it into an array passed in with "
+                                   "out= instead".format(size))
+        fid = '{}/{}.dat'.format(SCRATCH_DIR, uuid.uuid4().hex)
+        # the files removed to make space are deleted once the batch has been committed
+        with self._sl_cache.DB.batch():
+            self._sl_cache._remove_oldest(size)
+            self._sl_cache.DB.add_entry(fid, size)
+        path = self._get_path(fid)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return fid, numpy.memmap(path, dtype=dtype, mode='w+', shape=shape)
+
+    def _release(self, fid, key):
+        with self._lock:
+            if self._closed:
+                self._remove(fid)
+            else:
+                self._idle.setdefault(key, []).append(fid)
+
+    def _remove(self, fid):
+        self._sl_cache.DB.remove_entry(fid)
+        self._sl_cache._remove_file(fid)
+
+    def _get_size(self, shape, dtype):
+        size = dtype.itemsize
+        for s in shape:
+            size *= s
+        return size
+
+    def _get_path(self, fid):
+        return os.path.join(self._sl_cache.cache_loc, fid)
@@ -1,42 +1,98 @@
 __copyright__ = "(C) 2012 Science and Technology Facilities Council"
 __license__ = "BSD - see LICENSE file in top-level directory"
 
+import threading
+from collections import namedtuple
+from functools import lru_cache
 from SemSL._slConfigManager import slConfig
 from SemSL import Backends
 from SemSL._slExceptions import slConfigFileException
 
-sl_config = slConfig()
+# The parts of a file id, as returned by parse_fid.  alias, host_name and backend_name are None for POSIX files.
+slFid = namedtuple('slFid', ['alias', 'host_name', 'bucket', 'key', 'backend_name'])
 
-def _get_alias(fid):
+# The alias index maps each alias in the config (without a trailing /) to its host name.  It is built from the hosts
+# in the config, and rebuilt when the config file is changed or reloaded, which replaces the (read-only) hosts in the
+# config, see load_config.  _alias_index is a tuple of the index and the hosts it was built from.
+_alias_index = ({}, None)
+_alias_index_lock = threading.Lock()
 
-    # get all host keys
+def _get_alias_index():
+    """Return the alias index and the hosts in the config, building the index if the hosts have changed.  The config
+    is got each time, as load_config only reads the file again if it has changed."""
+    global _alias_index
+    sl_config = slConfig()
     hosts = sl_config['hosts']
-    host_keys = hosts.keys()
-    # Iterate through config to get all aliases
-    aliases = []
-    for host_name in iter(host_keys):
-        aliases.append(sl_config['hosts'][host_name]['alias'])
+    alias_index = _alias_index
+    if hosts is not alias_index[1]:
+        with _alias_index_lock:
+            if hosts is not _alias_index[1]:
+                try:
+                    _alias_index = ({hosts[h]['alias'].rstrip('/'): h for h in hosts}, hosts)
+                except Exception as e:
+                    raise slConfigFileException("Error in config file {} {}".format(
+                        sl_config["filename"],
+                        e))
+                _parse_fid.cache_clear()
+            alias_index = _alias_index
+    return alias_index
+
+def _match_alias(fid, alias_index):
+    """Return the longest alias in alias_index that fid starts with, matching whole path components, so that an
+    alias that is a substring of another alias (or of a bucket) is not matched by mistake."""
+    match = None
+    pos = fid.find('/')
+    while pos != -1:
+        if fid[:pos] in alias_index:
+            match = fid[:pos]
+        pos = fid.find('/', pos + 1)
+    if fid.rstrip('/') in alias_index:
+        match = fid.rstrip('/')
+    return match
+
+@lru_cache(maxsize=2**16)
+def _parse_fid(fid):
+    alias_index, hosts = _get_alias_index()
+    alias = _match_alias(fid, alias_index)
+    if alias is None:
+        # POSIX file - the bucket is the first directory in the path and the key is the whole path
+        parts = fid.split('/')
+        bucket = parts[1] if len(parts) > 1 else None
+        return slFid(None, None, bucket, fid, None)
+    host_name = alias_index[alias]
+    # split the remainder into the bucket and the key
+    remainder = fid[len(alias):].lstrip('/')
+    bucket, _, key = remainder.partition('/')
+    return slFid(hosts[host_name]['alias'], host_name, bucket, key.lstrip('/'), hosts[host_name]['backend'])
 
-    for alias in aliases:
+def parse_fid(fid):
+    """Split the file id into the alias, host name, bucket, key and backend name, in one pass.  The results are
+    cached as these are needed several times for every partition that is read or written.
+
+    :param fid: the file id, e.g. s3://alias/bucket/path/to/key.nc, or a POSIX path
+    :return: slFid namedtuple
+    """
+    # make sure the alias index is up to date before looking in the cache
+    _get_alias_index()
+    return _parse_fid(fid)
 
-        if alias in fid:
-            return alias
-    # return None if alias isn't found in list
-    return None
+def _get_alias(fid):
+    # return None if alias isn't found in the config
+    return parse_fid(fid).alias
 
 def _get_hostname(fid):
+    """ Get the name of the host in the config file that the file id's alias belongs to.
 
-    alias = _get_alias(fid)
-    host_name = None
-    try:
-        hosts = sl_config["hosts"]
-        for h in hosts:
-            if alias in hosts[h]['alias']:
-                host_name = h
-    except Exception as e:
-        raise slConfigFileException("Error in config file {} {}".format(
-            sl_config["filename"],
-            e))
+    Raises slConfigFileException if the fid has no alias, e.g. a POSIX path outside any host.  Callers that also
+    handle POSIX files catch it and use the default settings.
+    :param fid:
+    :return:
+    """
+    host_name = parse_fid(fid).host_name
+    if host_name is None:
+        raise slConfigFileException("Error in config file {} no alias for {}".format(
+            slConfig()["filename"],
+            fid))
     return host_name
 
 def _get_bucket(fid):
@@ -45,14 +101,7 @@ def _get_bucket(fid):
     :param fid:
     :return:
     """
-    fname = fid[:]
-    alias = _get_alias(fid)
-    try:
-        bucket = fname.replace(alias,'')
-    except TypeError:
-        bucket = fname[:]
-    #assert bucket.split('/')[0] == ''
-    return bucket.split('/')[1]
+    return parse_fid(fid).bucket
 
 def _get_key(fid):
     """
@@ -60,29 +109,22 @@ def _get_key(fid):
     :param fid:
     :return:
     """
-    alias = _get_alias(fid)
-    if not alias == None: # if no alias, just return the file name
-        bucket = _get_bucket(fid)
-        key = fid[:]
-        key = key.replace(alias,'')
-        key = key.replace(bucket,'')
-        while key[0] == '/':
-            key = key[1:]
-        return key
-    else:
-        return fid
+    # if no alias, this is just the file name
+    return parse_fid(fid).key
 
 def _get_backend(fid):
     """ Get the correct backend object inorder to interact with the backend
 
+    Raises slConfigFileException if the fid has no alias, as _get_hostname does.
     :param fid:
     :return:
     """
 
-    host_name = _get_hostname(fid)
-
-    host_config = sl_config["hosts"][host_name]
-    backend_name = host_config['backend']
+    backend_name = parse_fid(fid).backend_name
+    if backend_name is None:
+        raise slConfigFileException("Error in config file {} no alias for {}".format(
+            slConfig()["filename"],
+            fid))
     backend = Backends.get_backend_from_id(backend_name)
 
-    return backend()
\ No newline at end of file
+    return backend()
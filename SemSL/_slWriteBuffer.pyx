@@ -0,0 +1,142 @@
+"""
+Write-back buffer for the assignments to a CFA variable.  Operation:
+o. Assigning to a slice of an slVariable copies the values that fall in each
+   partition into the buffer, rather than opening and writing each subarray file
+   straight away.
+o. The pieces for each partition are kept in the order they were assigned.  A
+   piece that continues the previous piece of the partition along one axis, with
+   the same selection on the other axes (e.g. successive time steps of a model
+   output writer), is merged with it, so that it is written in one go.
+o. The buffer is flushed, writing each subarray file that has been assigned to
+   once, when the slDataset is synced or closed, before the variable is read, or
+   when the pieces in the buffer take up more than write_buffer_size in the
+   system section of ~/.sem-sl.json.  Assignments larger than write_buffer_size
+   are written straight away, without being copied, so setting it to 0 writes
+   the subarray files on each assignment.
+o. A subarray file created in 'w' mode is appended to by the following writes,
+   rather than being created again.
+"""
+
+__copyright__ = "(C) 2012 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+
+from collections import OrderedDict
+import numpy
+from SemSL._CFAFunctions import get_source_target_slices
+
+# the size of the buffer if write_buffer_size is not in the config file
+DEFAULT_WRITE_BUFFER_SIZE = 64 * 1024 * 1024
+
+
+def _continues(slices, new_slices):
+    """Get the axis along which the filled selection new_slices directly follows slices, with the same selection on
+       all the other axes, or None if it does not."""
+    axis = None
+    for a in range(0, len(slices)):
+        s = slices[a]
+        n = new_slices[a]
+        if type(s) is slice and type(n) is slice:
+            if s == n:
+                continue
+            if axis is None and s.step == n.step and n.start == s.stop + s.step:
+                axis = a
+                continue
+        elif type(s) is not slice and type(n) is not slice and numpy.array_equal(s, n):
+            continue
+        return None
+    return axis
+
+
+class _slPiece(object):
+    """The values assigned to a selection in one partition.  Merged pieces are kept as a list of arrays along the
+       merged axis and only concatenated when they are written."""
+
+    def __init__(self, elem_slices, data):
+        self.elem_slices = elem_slices
+        self.axis = None
+        self.arrays = [data]
+
+    def merge(self, elem_slices, data):
+        """Merge the values for elem_slices if they continue this piece, return whether they were merged"""
+        axis = _continues(self.elem_slices, elem_slices)
+        if axis is None or (self.axis is not None and axis != self.axis):
+            return False
+        self.axis = axis
+        s = self.elem_slices[axis]
+        self.elem_slices = list(self.elem_slices)
+        self.elem_slices[axis] = slice(s.start, elem_slices[axis].stop, s.step)
+        self.arrays.append(data)
+        return True
+
+    def get_data(self):
+        if len(self.arrays) > 1:
+            if any(isinstance(a, numpy.ma.MaskedArray) for a in self.arrays):
+                self.arrays = [numpy.ma.concatenate(self.arrays, axis=self.axis)]
+            else:
+                self.arrays = [numpy.concatenate(self.arrays, axis=self.axis)]
+        return self.arrays[0]
+
+
+class slWriteBuffer(object):
+    """The write-back buffer of an slVariable, see above."""
+
+    def __init__(self, max_bytes=DEFAULT_WRITE_BUFFER_SIZE):
+        self.max_bytes = int(max_bytes)
+        # {subarray file: [partition, [_slPiece]]} in the order the partitions were first assigned to
+        self._pending = OrderedDict()
+        self.nbytes = 0
+        # the subarray files that have been written by a previous flush
+        self._written = set()
+
+    def __len__(self):
+        """The number of partitions with values in the buffer"""
+        return len(self._pending)
+
+    def add(self, partitions, elem_slices, data):
+        """Add the values in data to the buffer.  elem_slices are the filled selections from fill_selection and data
+           has the shape of the selections.  The values are copied, so data can be changed by the caller afterwards.
+           Return whether the buffer is full and should be flushed."""
+        for part in partitions:
+            part_slices, data_slices = get_source_target_slices(part, elem_slices)
+            # the selection in the master array of the values in this partition
+            piece_slices = []
+            for sel, d in zip(elem_slices, data_slices):
+                if type(sel) is slice:
+                    piece_slices.append(slice(sel.start + d.start * sel.step, sel.start + (d.stop - 1) * sel.step,
+                                              sel.step))
+                else:
+                    piece_slices.append(sel[d])
+            piece_data = data[tuple(data_slices)].copy()
+            self.nbytes += piece_data.nbytes
+
+            fid = part.subarray.file
+            if fid not in self._pending:
+                self._pending[fid] = [part, []]
+            pieces = self._pending[fid][1]
+            if not pieces or not pieces[-1].merge(piece_slices, piece_data):
+                pieces.append(_slPiece(piece_slices, piece_data))
+        return self.nbytes > self.max_bytes
+
+    def pop(self):
+        """Remove all the values from the buffer and return them as a list of (partition, pieces, mode), where pieces
+           is a list of (elem_slices, data) to write to the partition in order, for the write_pieces method of the
+           interfaces.  mode is 'a' if the subarray file has been written by a previous flush, so that a file
+           created in 'w' mode is appended to rather than recreated, otherwise None for the mode of the file."""
+        part_pieces = []
+        for fid, (part, pieces) in self._pending.items():
+            mode = 'a' if fid in self._written else None
+            part_pieces.append((part, [(p.elem_slices, p.get_data()) for p in pieces], mode))
+            self._written.add(fid)
+        self._pending = OrderedDict()
+        self.nbytes = 0
+        return part_pieces
+
+    def write_through(self, partitions, elem_slices, data):
+        """Get the (partition, pieces, mode) to write data to the partitions straight away, as for pop.  The buffer
+           should be flushed first, so that the values are written in the order they were assigned."""
+        part_pieces = []
+        for part in partitions:
+            fid = part.subarray.file
+            part_pieces.append((part, [(elem_slices, data)], 'a' if fid in self._written else None))
+            self._written.add(fid)
+        return part_pieces
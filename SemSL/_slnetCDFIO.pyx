@@ -13,11 +13,13 @@ from _CFAClasses import *
 from SemSL._slCacheManager import slCacheManager
 from SemSL._slConfigManager import slConfig
 from SemSL._slConnectionManager import slConnectionManager
-from SemSL._slExceptions import slIOException
+from SemSL._slExceptions import slIOException, slConfigFileException
 import SemSL._slUtils as slU
 from SemSL import Backends
 
-SL_CONFIG = slConfig()
+# the number of bytes fetched from the start of an object opened in 'r' mode to check that it is a netCDF file - objects
+# no larger than this are fetched whole by the same request, and opened from memory
+MEMORY_PREFETCH_SIZE = 64 * 1024
 
 cdef class s3netCDFFile:
     """
@@ -29,17 +31,23 @@ cdef class s3netCDFFile:
     cdef public basestring s3_uri
     cdef public basestring filemode
     cdef public basestring format
-    cdef public basestring memory
+    cdef public object memory
     cdef public cfa_file
+    # the CFAFile saved by a previous open of the file, and the validator (see slCacheManager.get_validator)
+    cdef public parsed_cfa_file
+    cdef public validator
+    # whether the file on the backend is created in memory and uploaded from there, rather than from the cache
+    cdef public bint diskless
 
     def __init__(self, filename = "", s3_uri = "", filemode = 'r', memory = ""):
         """
         :param filename: the original filename on disk (or openDAP URI) or the filename of the cached file - i.e. where
                          the S3 file is streamed (for 'r' and 'a' filemodes) or created (for 'w' filemodes).
-                         For memory streamed files this is the tempfile location.
+                         For memory streamed files this is the path in the cache, which is only used as the name
+                         of the file.
         :param s3_uri: S3 URI for S3 files only
         :param filemode: 'r'ead | 'w'rite | 'a'ppend
-        :param memory: the memory where the S3 file is streamed to, or None if filename on disk
+        :param memory: the contents of the S3 file, if it is streamed into memory, or "" if filename on disk
         """
 
         self.filename = filename
@@ -48,6 +56,9 @@ cdef class s3netCDFFile:
         self.memory = memory
         self.format = 'NOT_NETCDF'
         self.cfa_file = None
+        self.parsed_cfa_file = None
+        self.validator = None
+        self.diskless = False
 
     def __repr__(self):
         return "s3netCDFFile"
@@ -87,28 +98,36 @@ def _get_netCDF_filetype(s3_client, bucket_name, object_name, backend):
     # open the url/bucket/object as an s3_object and read the first 4 bytes
     #try:
     # todo create get_partial backend method to retrieve first 4 bytes, can just return the 'data', and remove .data
-    s3_object = backend.get_partial(s3_client, bucket_name, object_name, 0, 4)
+    s3_object = backend.get_partial(s3_client, bucket_name, object_name, 0, 4, binary=True)
     #except BaseException:
     #    raise s3IOException(s3_client.get_full_url(bucket_name, object_name) + " not found")
+    return _interpret_magic_number(s3_object)
 
+
+def _interpret_magic_number(s3_object):
+    """
+       Interpret the magic number in the first four bytes of a file, see _get_netCDF_filetype.
+
+       :return: string filetype, file version
+    """
     # start with NOT_NETCDF as the file_type
     file_version = 0
     file_type = 'NOT_NETCDF'
     # check whether it's a netCDF file (how can we tell if it's a NETCDF4_CLASSIC file?
-    if s3_object[1:5] == 'HDF':
+    if s3_object[1:4] == b'HDF':
         # netCDF4 (HD5 version)
         file_type = 'NETCDF4'
         file_version = 5
-    elif (s3_object[0] == '\016' and s3_object[1] == '\003' and s3_object[2] == '\023' and s3_object[3] == '\001'):
+    elif s3_object[0:4] == b'\016\003\023\001':
         file_type = 'NETCDF4'
         file_version = 4
-    elif s3_object[0:3] == 'CDF':
-        file_version = ord(s3_object[3])
+    elif s3_object[0:3] == b'CDF':
+        file_version = s3_object[3]
         if file_version == 1:
             file_type = 'NETCDF3_CLASSIC'
-        elif file_version == '2':
+        elif file_version == 2:
             file_type = 'NETCDF3_64BIT_OFFSET'
-        elif file_version == '5':
+        elif file_version == 5:
             file_type = 'NETCDF3_64BIT_DATA'
         else:
             file_version = 1 # default to one if no version
@@ -121,37 +140,24 @@ def _get_conn(s3_ep,sl_cache):
     """
     return end point object
     :param s3_ep: alias from config
-    :return:
+    :return: the connection from the connection pool, to use in a with block which releases it
     """
     sl_config = slConfig()
     conn_man = slConnectionManager(sl_config)
-    conn = conn_man.open(s3_ep)
-    s3_client = conn.get()
-    return s3_client
+    return conn_man.open(s3_ep)
 
 def _get_backend(endpoint):
-    host_name = None
     try:
-        hosts = SL_CONFIG["hosts"]
-        for h in hosts:
-            if endpoint in hosts[h]['alias']:
-                host_name = h
-    except Exception as e:
-        raise slIOException("Error in config file {} {}".format(
-                            SL_CONFIG["filename"],
-                            e))
-    host_config = SL_CONFIG["hosts"][host_name]
-    backend_name = host_config['backend']
-
-    backend = Backends.get_backend_from_id(backend_name)()
-
-    return backend
+        return slU._get_backend(endpoint)
+    except slConfigFileException as e:
+        raise slIOException(str(e))
 
 def get_netCDF_file_details(filename, filemode='r', diskless=False, persist=False, s3_client_config=None):
     """
     Get the details of a netCDF file which is either stored in S3 storage or on POSIX disk.
     If the file is on S3 storage, and the filemode is 'r' or 'a' then it will be streamed to either the cache or
-      into memory, depending on the filesize and the value of <max_object_size_for_memory> in the .s3nc4.json config file.
+      into memory, depending on the filesize and the value of <object_size_for_memory> in the .sem-sl.json config file.
+      Only files opened in 'r' mode are streamed into memory.
 
     :param filename: filename on POSIX / URI on S3 storage
     :param filemode: 'r'ead | 'w'rite | 'a'ppend
@@ -175,9 +181,6 @@ def get_netCDF_file_details(filename, filemode='r', diskless=False, persist=Fals
 
         sl_cache = slCacheManager()
 
-        # coonection object
-        conn = _get_conn(s3_ep,sl_cache)
-
         # return correct backend
         backend = _get_backend(s3_ep)
 
@@ -188,38 +191,66 @@ def get_netCDF_file_details(filename, filemode='r', diskless=False, persist=Fals
         # if the filemode is 'r' or 'a' then we have to stream the file to either the cache or to memory
         if filemode == 'r' or filemode == 'a' or filemode == 'r+':
 
-            # Check whether the object exists
-            if not backend.get_head_object(conn,s3_bucket_name,s3_object_name):
-                raise slIOException("Error: " + s3_object_name + " not found.")
-
-            # check whether this object is a netCDF file
-            file_type, file_version = _get_netCDF_filetype(conn, s3_bucket_name, s3_object_name, backend)
+            # the connection is returned to the pool before the file is fetched into the cache
+            with _get_conn(s3_ep,sl_cache) as sl_conn:
+                conn = sl_conn.get()
+                try:
+                    # get the size, ETag and magic number of the object in a single request - in 'r' mode this also
+                    # gets the whole of a small file, which can then be opened from memory
+                    object_info = backend.get_object_info(conn, s3_bucket_name, s3_object_name,
+                                                          MEMORY_PREFETCH_SIZE if filemode == 'r' else 4)
+                    if object_info is None:
+                        raise slIOException("Error: " + s3_object_name + " not found.")
+                    file_type, file_version = _interpret_magic_number(object_info['data'])
+                    file_size = object_info['size']
+                    file_start = object_info['data']
+                    file_details.validator = (object_info['etag'], object_info['size'])
+                except NotImplementedError:
+                    # Check whether the object exists
+                    if not backend.get_head_object(conn,s3_bucket_name,s3_object_name):
+                        raise slIOException("Error: " + s3_object_name + " not found.")
+
+                    # check whether this object is a netCDF file
+                    file_type, file_version = _get_netCDF_filetype(conn, s3_bucket_name, s3_object_name, backend)
+                    file_size = None
+                    file_start = b''
             if file_type == "NOT_NETCDF" or file_version == 0:
                 raise slIOException("Error: " + s3_object_name + " is not a netCDF file.")
 
             # retain the filetype
             file_details.format = file_type
 
+            if filemode == 'r':
+                # get the CFA metadata saved by a previous open - if the object has changed this also removes the copy
+                # in the cache, so it has to be done before the file is fetched into the cache
+                file_details.parsed_cfa_file, file_details.validator = sl_cache.load_parsed(filename,
+                                                                                            file_details.validator)
+
 
-            # check whether we should stream this object
+            # check whether we should stream this object into memory
             # - use diskless to indicate the file should be read into memory whatever its size
-            # - user persist to indicate that the file should be cached whatever its size
-            # TODO: reintroduce streaming files to memory
-            #if (s3_client.should_stream_to_cache(s3_bucket_name, s3_object_name) and not diskless) or persist:
-            #    # stream the file to the cache
-            file_details.filename = sl_cache.open(filename,filemode)#s3_client.stream_to_cache(s3_bucket_name, s3_object_name)
-            #else:
-            #    raise NotImplementedError
-            #    # the netCDF library needs to create a dummy file for files created from memory
-            #    # one dummy file can be used for all of the memory streaming
-            #    #file_details.filename = sl_cache.open(filename)#s3_client.get_cache_location() + "/" + file_type + "_dummy.nc"
-            #    # get the data from the object
-            #    #file_details.memory = s3_client.stream_to_memory(s3_bucket_name, s3_object_name)
+            # - use persist to indicate that the file should be cached whatever its size
+            memory = None
+            if filemode == 'r' and not persist:
+                memory = sl_cache.read_to_memory(filename, file_size, file_start, force=diskless)
+            if memory is not None:
+                # the path in the cache is only used as the name of the file, nothing is added to the cache
+                file_details.memory = memory
+                file_details.filename = sl_cache._get_cache_path(filename)
+            else:
+                # stream the file to the cache
+                file_details.filename = sl_cache.open(filename,filemode,file_size=file_size)
 
         # if the filemode is 'w' then we just have to construct the cache filename and return it
         elif filemode == 'w':
-            # get the cache file name
-            file_details.filename = sl_cache.open(filename,filemode)#s3_client.get_cachefile_path(s3_bucket_name, s3_object_name)
+            if diskless:
+                # the file is created in memory, the path in the cache is only used as its name and nothing is
+                # added to the cache
+                file_details.filename = sl_cache.open(filename,filemode,diskless=True)
+                file_details.diskless = True
+            else:
+                # get the cache file name
+                file_details.filename = sl_cache.open(filename,filemode)#s3_client.get_cachefile_path(s3_bucket_name, s3_object_name)
 
         # the created file in
         else:
@@ -230,6 +261,8 @@ def get_netCDF_file_details(filename, filemode='r', diskless=False, persist=Fals
     else:
         file_details.filename = filename
         file_details.format = 'NETCDF4'
+        if filemode == 'r':
+            file_details.parsed_cfa_file, file_details.validator = slCacheManager().load_parsed(filename)
 
     return file_details
 
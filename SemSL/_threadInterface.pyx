@@ -0,0 +1,259 @@
+"""
+   Class containing a threaded interface for reading / writing the netCDF files, to either disk or a backend.
+   This overloads the serial methods in _baseInterface.  The partitions are distributed to a pool of worker threads,
+   the size of which is set by the read_connections / write_connections settings for the host in ~/.sem-sl.json.
+
+   The netCDF-C and HDF5 libraries are not thread safe, so every call into them is serialised with NC_LOCK.  The
+   fetching of the subarray files from the backend into the cache, which is where the time is spent for files on
+   object storage, is performed concurrently.
+
+   If write_processes is set in the system section of ~/.sem-sl.json then the subarray files are written by a pool of
+   that many processes, so that their construction (compression etc.) runs in parallel.  The processes are spawned,
+   so a script that writes files with write_processes set must guard its main code with
+   if __name__ == '__main__'.
+"""
+
+__copyright__ = "(C) 2012 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+
+import threading
+import multiprocessing
+import numpy
+from concurrent.futures import ProcessPoolExecutor
+from queue import Queue, Empty
+from ._baseInterface import _baseInterface, write_fragment
+from SemSL._slConfigManager import slConfig
+from SemSL._slExceptions import (slIOException, slAPIException, slInterfaceException, slCacheException,
+                                 slConfigFileException, slDBException, slNetCDFException, CFAException)
+
+# lock around all calls to the netCDF library - shared by every instance of the interface
+NC_LOCK = threading.RLock()
+
+# the exceptions that are passed back from the worker threads to the calling thread.  The SemSL exceptions derive from
+# BaseException, so they are listed as well as Exception, but KeyboardInterrupt and SystemExit are not caught.
+WORKER_EXCEPTIONS = (Exception, slIOException, slAPIException, slInterfaceException, slCacheException,
+                     slConfigFileException, slDBException, slNetCDFException, CFAException)
+
+# the pool of write processes and its size, started on first use and shared by every instance of the interface
+_write_pool = None
+_write_pool_size = 0
+_write_pool_lock = threading.Lock()
+
+
+def _get_write_pool():
+    """Get the pool of processes to write the subarray files with and the number of processes in it, or (None, 0)
+       if write_processes is not set in the config file.  The pool is restarted if write_processes is changed."""
+    global _write_pool, _write_pool_size
+    try:
+        n_processes = int(slConfig()['system'].get('write_processes', 0))
+    except (TypeError, ValueError):
+        n_processes = 0
+    with _write_pool_lock:
+        if _write_pool is not None and _write_pool_size != n_processes:
+            # the writes already submitted to the old pool are completed
+            _write_pool.shutdown(wait=False)
+            _write_pool = None
+            _write_pool_size = 0
+        if _write_pool is None and n_processes > 0:
+            # spawn rather than fork the processes, as forking a process with other threads running is not safe
+            _write_pool = ProcessPoolExecutor(max_workers=n_processes,
+                                              mp_context=multiprocessing.get_context('spawn'))
+            _write_pool_size = n_processes
+        return _write_pool, _write_pool_size
+
+
+def _get_n_threads(n_threads, n_partitions):
+    """Get the number of worker threads to use: the number of connections from the config file, bounded by the
+       number of partitions to read / write."""
+    try:
+        n_threads = int(n_threads)
+    except (TypeError, ValueError):
+        n_threads = 1
+    return max(1, min(n_threads, n_partitions))
+
+
+class _threadInterface(_baseInterface):
+    """Class to read / write netCDF files to disk or S3 using a pool of worker threads.
+       The partitions are put on a queue which the worker threads take from until it is empty.  Each worker thread
+       has its own return queue so that the data from the subarray files can be copied into the target array once
+       the file has been fetched.
+    """
+
+    def _read_worker(self, thread_number, part_queue, error_queue, elem_slices):
+        """Worker thread for read: take partitions from the part_queue until it is empty, fetch them into the cache
+           and copy the data into the target array."""
+        return_queue = Queue()
+        while True:
+            part = part_queue.get()
+            if part is None:
+                break
+            try:
+                # fetch the file into the cache - this is the part that is done concurrently
+                file_details = self._fetch_partition(part, 'r')
+                # open, slice and copy the data in
+                with NC_LOCK:
+                    nc_file = self._read_partition(thread_number, return_queue, part, elem_slices, file_details)
+                    try:
+                        nc_var, py_source_slice, py_target_slice = return_queue.get()
+                        self._copy_from_partition(nc_var, py_source_slice, py_target_slice)
+                    finally:
+                        self._close_partition(nc_file)
+            except WORKER_EXCEPTIONS as e:
+                error_queue.put(e)
+
+
+    def _fetch_worker(self, thread_number, part_queue, error_queue):
+        """Worker thread for prefetch: take partitions from the part_queue until it is empty and fetch them into the
+           cache."""
+        while True:
+            part = part_queue.get()
+            if part is None:
+                break
+            try:
+                self._fetch_partition(part, 'r')
+            except WORKER_EXCEPTIONS as e:
+                error_queue.put(e)
+
+
+    def _write_in_process(self, mode):
+        """Return whether the subarray file of a partition can be written by one of the write processes: not for
+           files created in memory, and only for variables with a numpy datatype as the user defined types belong to
+           the master file."""
+        return (mode in ('w', 'a', 'r+') and not self._is_diskless() and
+                isinstance(self._nc_var.datatype, numpy.dtype))
+
+
+    def _write_worker(self, thread_number, part_queue, error_queue, return_queue, write_pool=None):
+        """Worker thread for write: take (partition, pieces, mode) from the part_queue until it is empty, write the
+           pieces to the subarray files and put the name of the subarray file on the return_queue.  If a write_pool
+           is passed in then the subarray files are written by its processes."""
+        while True:
+            part_pieces = part_queue.get()
+            if part_pieces is None:
+                break
+            try:
+                part, pieces, mode = part_pieces
+                # determining the mode may fetch an existing file from the backend, and getting the file adds it to
+                # the cache database - do these concurrently, only the netCDF calls are serialised
+                mode = self._get_write_mode(part, mode)
+                file_details = self._fetch_write_partition(part, mode)
+                if write_pool is not None and self._write_in_process(mode):
+                    # the file is written by the other process, so must not be open in this one
+                    with NC_LOCK:
+                        if self._file_handles is not None:
+                            self._file_handles.discard(file_details)
+                        spec = self._fragment_spec(part, mode)
+                    values = self._fragment_values(part, pieces)
+                    write_pool.submit(write_fragment, file_details, mode, spec, values).result()
+                    return_queue.put(part.subarray.file)
+                else:
+                    with NC_LOCK:
+                        return_queue.put(self._write_partition(part, pieces, mode, file_details))
+            except WORKER_EXCEPTIONS as e:
+                error_queue.put(e)
+
+
+    def _run_workers(self, target, n_threads, partitions, *args):
+        """Start n_threads worker threads running target, feed the partitions to them and wait for them to finish.
+           Re-raise the first exception raised in any of the worker threads.  If only one thread is required then
+           target is run in the calling thread."""
+        part_queue = Queue()
+        error_queue = Queue()
+        for part in partitions:
+            part_queue.put(part)
+        # one sentinel per thread to signal the end of the partitions
+        for t in range(0, n_threads):
+            part_queue.put(None)
+
+        if n_threads == 1:
+            # no need for the overhead of a thread
+            target(0, part_queue, error_queue, *args)
+        else:
+            threads = []
+            for t in range(0, n_threads):
+                thread = threading.Thread(target=target, args=(t, part_queue, error_queue) + args)
+                thread.daemon = True
+                thread.start()
+                threads.append(thread)
+            for thread in threads:
+                thread.join()
+
+        if not error_queue.empty():
+            raise error_queue.get()
+
+
+    def read(self, partitions, elem_slices):
+        """Read (in parallel) the list of partitions which are in a subgroup determined by slVariable.__getitem__"""
+        n_threads = _get_n_threads(self._read_threads, len(partitions))
+        self._run_workers(self._read_worker, n_threads, partitions, elem_slices)
+
+
+    def prefetch(self, blocks, n_ahead):
+        """Iterate over blocks, a sequence of (key, partitions), yielding each key once the subarray files of its
+           partitions have been fetched into the cache.  A background thread fetches the files for up to n_ahead
+           blocks ahead of the one being processed by the caller, the files for each block are fetched in parallel by
+           read_threads worker threads."""
+        if n_ahead < 1:
+            for key in _baseInterface.prefetch(self, blocks, n_ahead):
+                yield key
+            return
+
+        # the fetched blocks: (key, exception), or None when all the blocks have been fetched
+        ready_queue = Queue(maxsize=n_ahead)
+        stop = threading.Event()
+
+        def fetch_blocks():
+            try:
+                for key, partitions in blocks:
+                    if stop.is_set():
+                        return
+                    n_threads = _get_n_threads(self._read_threads, len(partitions))
+                    self._run_workers(self._fetch_worker, n_threads, partitions)
+                    ready_queue.put((key, None))
+                    if stop.is_set():
+                        return
+            except WORKER_EXCEPTIONS as e:
+                ready_queue.put((None, e))
+                return
+            ready_queue.put(None)
+
+        thread = threading.Thread(target=fetch_blocks)
+        thread.daemon = True
+        thread.start()
+        try:
+            while True:
+                ready = ready_queue.get()
+                if ready is None:
+                    break
+                key, e = ready
+                if e is not None:
+                    raise e
+                yield key
+        finally:
+            # the caller may stop iterating early - stop the thread and empty the queue so that it is not left waiting
+            # to put the next block
+            stop.set()
+            try:
+                while True:
+                    ready_queue.get_nowait()
+            except Empty:
+                pass
+
+
+    def write(self, partitions, elem_slices):
+        """Write (in parallel) the list of partitions which are in the subgroup determined by slVariable.__setitem__"""
+        return self.write_pieces([(part, [(elem_slices, self._data)], None) for part in partitions])
+
+
+    def write_pieces(self, part_pieces):
+        """Write (in parallel) a list of (partition, pieces, mode), see _baseInterface.write_pieces"""
+        write_pool, n_processes = _get_write_pool()
+        # enough threads to keep all the write processes busy
+        n_threads = max(_get_n_threads(self._write_threads, len(part_pieces)), min(n_processes, len(part_pieces)))
+        # the subarray files are collected in a queue as it is safe to put to from multiple threads
+        return_queue = Queue()
+        self._run_workers(self._write_worker, n_threads, part_pieces, return_queue, write_pool)
+        partitions_accessed = []
+        while not return_queue.empty():
+            partitions_accessed.append(return_queue.get())
+        return partitions_accessed
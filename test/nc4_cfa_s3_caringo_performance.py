@@ -57,14 +57,14 @@ def cleanup():
     # print(slDB.get_all_fids())
     cache_loc = sl_config['cache']['location']
     conn_man = slConnectionManager(sl_config)
-    conn = conn_man.open("s3://caringo")
-    sl_cache._clear_cache()
-    s3 = conn.get()
-    subfiles = s3.list_objects(Bucket='mjones07', Prefix='testnc/')['Contents']
-    for sf in subfiles:
-        s3.delete_object(Bucket='mjones07', Key=sf['Key'])
-    s3.delete_object(Bucket='mjones07', Key='testnc.nc')
-    #s3.delete_bucket(Bucket='databucket')
+    with conn_man.open("s3://caringo") as conn:
+        sl_cache._clear_cache()
+        s3 = conn.get()
+        subfiles = s3.list_objects(Bucket='mjones07', Prefix='testnc/')['Contents']
+        for sf in subfiles:
+            s3.delete_object(Bucket='mjones07', Key=sf['Key'])
+        s3.delete_object(Bucket='mjones07', Key='testnc.nc')
+        #s3.delete_bucket(Bucket='databucket')
 
 create_file()
 read_file()
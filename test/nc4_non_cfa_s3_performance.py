@@ -59,11 +59,11 @@ def cleanup():
     # print(slDB.get_all_fids())
     cache_loc = sl_config['cache']['location']
     conn_man = slConnectionManager(sl_config)
-    conn = conn_man.open("s3://test")
-    sl_cache._clear_cache()
-    s3 = conn.get()
-    s3.delete_object(Bucket='databucket', Key='testnc.nc')
-    s3.delete_bucket(Bucket='databucket')
+    with conn_man.open("s3://test") as conn:
+        sl_cache._clear_cache()
+        s3 = conn.get()
+        s3.delete_object(Bucket='databucket', Key='testnc.nc')
+        s3.delete_bucket(Bucket='databucket')
 
 
 create_file()
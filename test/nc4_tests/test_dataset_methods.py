@@ -1075,19 +1075,19 @@ class test_set5_Methods_s3_cfa(unittest.TestCase):
         slDB = slCacheDB()
         cache_loc = sl_config['cache']['location']
         conn_man = slConnectionManager(sl_config)
-        conn = conn_man.open("s3://test")
-        # construct list of subfiles
-        subfiles = glob('{}/testnc_methods/*.nc'.format(cache_loc))
-        subfiles = ['testnc_methods/'+file.split('/')[-1] for file in subfiles]
+        with conn_man.open("s3://test") as conn:
+            # construct list of subfiles
+            subfiles = glob('{}/testnc_methods/*.nc'.format(cache_loc))
+            subfiles = ['testnc_methods/'+file.split('/')[-1] for file in subfiles]
 
-        sl_cache._clear_cache()
-        s3 = conn.get()
-        s3.delete_object(Bucket='databucket', Key='testnc_methods.nc')
-        for file in subfiles:
-            #print(file)
-            s3.delete_object(Bucket='databucket', Key=file)
+            sl_cache._clear_cache()
+            s3 = conn.get()
+            s3.delete_object(Bucket='databucket', Key='testnc_methods.nc')
+            for file in subfiles:
+                #print(file)
+                s3.delete_object(Bucket='databucket', Key=file)
 
-        s3.delete_bucket(Bucket='databucket')
+            s3.delete_bucket(Bucket='databucket')
 
     def test_getVariables(self):
         # Create new variable to test that 2 are returned
@@ -1587,11 +1587,11 @@ class test_set4_Methods_s3_noncfa(unittest.TestCase):
         slDB = slCacheDB()
         cache_loc = sl_config['cache']['location']
         conn_man = slConnectionManager(sl_config)
-        conn = conn_man.open("s3://test")
-        sl_cache._clear_cache()
-        s3 = conn.get()
-        s3.delete_object(Bucket='databucket', Key='testnc_methods.nc')
-        s3.delete_bucket(Bucket='databucket')
+        with conn_man.open("s3://test") as conn:
+            sl_cache._clear_cache()
+            s3 = conn.get()
+            s3.delete_object(Bucket='databucket', Key='testnc_methods.nc')
+            s3.delete_bucket(Bucket='databucket')
 
     def test_getVariables(self):
         # Create new variable to test that 2 are returned
@@ -1696,10 +1696,10 @@ class test_set4_Methods_s3_noncfa(unittest.TestCase):
         slDB = slCacheDB()
         cache_loc = sl_config['cache']['location']
         conn_man = slConnectionManager(sl_config)
-        conn = conn_man.open("s3://test")
-        sl_cache._clear_cache()
-        s3 = conn.get()
-        s3.delete_object(Bucket='databucket', Key='complex.nc')
+        with conn_man.open("s3://test") as conn:
+            sl_cache._clear_cache()
+            s3 = conn.get()
+            s3.delete_object(Bucket='databucket', Key='complex.nc')
 
     def test_createEnumType_enumtypes(self):
         # from netcdf4-python docs
@@ -1722,10 +1722,10 @@ class test_set4_Methods_s3_noncfa(unittest.TestCase):
         slDB = slCacheDB()
         cache_loc = sl_config['cache']['location']
         conn_man = slConnectionManager(sl_config)
-        conn = conn_man.open("s3://test")
-        sl_cache._clear_cache()
-        s3 = conn.get()
-        s3.delete_object(Bucket='databucket', Key='clouds.nc')
+        with conn_man.open("s3://test") as conn:
+            sl_cache._clear_cache()
+            s3 = conn.get()
+            s3.delete_object(Bucket='databucket', Key='clouds.nc')
 
     def test_createGroup(self):
         # create group and add varaible and dims to group
@@ -1746,10 +1746,10 @@ class test_set4_Methods_s3_noncfa(unittest.TestCase):
         slDB = slCacheDB()
         cache_loc = sl_config['cache']['location']
         conn_man = slConnectionManager(sl_config)
-        conn = conn_man.open("s3://test")
-        sl_cache._clear_cache()
-        s3 = conn.get()
-        s3.delete_object(Bucket='databucket', Key='testnc_groups.nc')
+        with conn_man.open("s3://test") as conn:
+            sl_cache._clear_cache()
+            s3 = conn.get()
+            s3.delete_object(Bucket='databucket', Key='testnc_groups.nc')
 
     def test_createVLType_VLTypes(self):
         # from netcdf4-python docs
@@ -1780,10 +1780,10 @@ class test_set4_Methods_s3_noncfa(unittest.TestCase):
         slDB = slCacheDB()
         cache_loc = sl_config['cache']['location']
         conn_man = slConnectionManager(sl_config)
-        conn = conn_man.open("s3://test")
-        sl_cache._clear_cache()
-        s3 = conn.get()
-        s3.delete_object(Bucket='databucket', Key='tst_vlen.nc')
+        with conn_man.open("s3://test") as conn:
+            sl_cache._clear_cache()
+            s3 = conn.get()
+            s3.delete_object(Bucket='databucket', Key='tst_vlen.nc')
 
     def test_data_model(self):
         f = Dataset('s3://test/databucket/testnc_methods.nc', 'r')
@@ -1876,10 +1876,10 @@ class test_set4_Methods_s3_noncfa(unittest.TestCase):
         slDB = slCacheDB()
         cache_loc = sl_config['cache']['location']
         conn_man = slConnectionManager(sl_config)
-        conn = conn_man.open("s3://test")
-        sl_cache._clear_cache()
-        s3 = conn.get()
-        s3.delete_object(Bucket='databucket', Key='testnc_groups.nc')
+        with conn_man.open("s3://test") as conn:
+            sl_cache._clear_cache()
+            s3 = conn.get()
+            s3.delete_object(Bucket='databucket', Key='testnc_groups.nc')
 
     def test_path(self):
         f = Dataset('s3://test/databucket/testnc_methods.nc', 'r')
@@ -1936,10 +1936,10 @@ class test_set4_Methods_s3_noncfa(unittest.TestCase):
         slDB = slCacheDB()
         cache_loc = sl_config['cache']['location']
         conn_man = slConnectionManager(sl_config)
-        conn = conn_man.open("s3://test")
-        sl_cache._clear_cache()
-        s3 = conn.get()
-        s3.delete_object(Bucket='databucket', Key='testnc_groups.nc')
+        with conn_man.open("s3://test") as conn:
+            sl_cache._clear_cache()
+            s3 = conn.get()
+            s3.delete_object(Bucket='databucket', Key='testnc_groups.nc')
 
     def test_renameVariable(self):
         f = Dataset('s3://test/databucket/testnc_methods.nc', 'a')
@@ -146,14 +146,14 @@ class test_set0_ReadWrite(unittest.TestCase):
         #print(slDB.get_all_fids())
         cache_loc = sl_config['cache']['location']
         conn_man = slConnectionManager(sl_config)
-        conn = conn_man.open("s3://test")
-        sl_cache._clear_cache()
-        s3 = conn.get()
-        subfiles = s3.list_objects(Bucket='databucket',Prefix='testnc/')['Contents']
-        for sf in subfiles:
-            s3.delete_object(Bucket='databucket',Key=sf['Key'])
-        s3.delete_object(Bucket='databucket',Key='testnc.nc')
-        s3.delete_bucket(Bucket='databucket')
+        with conn_man.open("s3://test") as conn:
+            sl_cache._clear_cache()
+            s3 = conn.get()
+            subfiles = s3.list_objects(Bucket='databucket',Prefix='testnc/')['Contents']
+            for sf in subfiles:
+                s3.delete_object(Bucket='databucket',Key=sf['Key'])
+            s3.delete_object(Bucket='databucket',Key='testnc.nc')
+            s3.delete_bucket(Bucket='databucket')
 
     def test_07_write_none_cfa(self):
         self.f = Dataset('s3://test/databucket/testnc_noncfa.nc', 'w', format='NETCDF4')
@@ -221,11 +221,11 @@ class test_set0_ReadWrite(unittest.TestCase):
         #print(slDB.get_all_fids())
         cache_loc = sl_config['cache']['location']
         conn_man = slConnectionManager(sl_config)
-        conn = conn_man.open("s3://test")
-        sl_cache._clear_cache()
-        s3 = conn.get()
-        s3.delete_object(Bucket='databucket',Key='testnc_noncfa.nc')
-        s3.delete_bucket(Bucket='databucket')
+        with conn_man.open("s3://test") as conn:
+            sl_cache._clear_cache()
+            s3 = conn.get()
+            s3.delete_object(Bucket='databucket',Key='testnc_noncfa.nc')
+            s3.delete_bucket(Bucket='databucket')
 
     def test_10_posix_chunk_write(self):
 
@@ -189,6 +189,56 @@ class test_set3_Methods_posix_cfa(unittest.TestCase):
         self.assertTrue(test_bool)
         f.close()
 
+    def test_var_getitem_selections(self):
+        np.random.seed(0)
+        data = np.random.rand(DIMSIZE, DIMSIZE, DIMSIZE, DIMSIZE)
+        f = Dataset('./testnc_methods.nc', 'r')
+        v = f.variables['var']
+        self.assertTrue(len(v._cfa_var.partitions) > 1)
+        mask = np.arange(DIMSIZE) % 3 == 0
+        # the index arrays index each dimension independently, as with netCDF4
+        selections = [(slice(None, None, 2),),
+                      (slice(None, None, -1),),
+                      (slice(3, 15, 4), slice(None, None, -3)),
+                      (slice(18, 2, -5), Ellipsis, slice(1, None, 7)),
+                      ([5, 1, 1, 9],),
+                      (slice(None), [7, 2, 2, 19, 0], slice(1, 3)),
+                      (Ellipsis, [3, 0, 3]),
+                      (mask, slice(None, None, -2)),
+                      (slice(None), slice(None), mask)]
+        for sel in selections:
+            self.assertTrue(np.array_equal(v[sel], data[sel]), sel)
+        # unsorted and duplicate index arrays on more than one dimension
+        index = ([4, 0, 4], slice(None), [9, 3, 3, 1])
+        self.assertTrue(np.array_equal(v[index], data[np.ix_([4, 0, 4], range(DIMSIZE), [9, 3, 3, 1])]))
+        f.close()
+
+    def test_var_setitem_selections(self):
+        np.random.seed(0)
+        data = np.random.rand(DIMSIZE, DIMSIZE, DIMSIZE, DIMSIZE)
+        f = Dataset('./testnc_methods.nc', 'a')
+        v = f.variables['var']
+        self.assertTrue(len(v._cfa_var.partitions) > 1)
+        mask = np.arange(DIMSIZE) % 4 == 1
+        selections = [(slice(None, None, 3),),
+                      (slice(None, None, -1), slice(2, 9)),
+                      (slice(17, 1, -4), Ellipsis, slice(None, None, -6)),
+                      ([6, 2, 11],),
+                      (slice(None), [8, 0, 13], slice(4, 6)),
+                      (slice(None), mask)]
+        for sel in selections:
+            values = np.random.rand(*data[sel].shape)
+            v[sel] = values
+            data[sel] = values
+        # repeated indices take the last value, as with numpy
+        values = np.random.rand(3, DIMSIZE, DIMSIZE, DIMSIZE)
+        v[[12, 5, 12]] = values
+        data[[12, 5, 12]] = values
+        f.close()
+        f = Dataset('./testnc_methods.nc', 'r')
+        self.assertTrue(np.array_equal(f.variables['var'][:], data))
+        f.close()
+
     def test_get_var_chunk_cache(self):
         f = Dataset('./testnc_methods.nc', 'r')
         v = f.variables['var']
@@ -230,6 +280,32 @@ class test_set3_Methods_posix_cfa(unittest.TestCase):
         self.assertEqual(v.getncattr('renamedattr'), 'test unit')
         f.close()
 
+    def test_var_iter_partitions(self):
+        np.random.seed(0)
+        data = np.random.rand(DIMSIZE, DIMSIZE, DIMSIZE, DIMSIZE)
+        f = Dataset('./testnc_methods.nc', 'r')
+        v = f.variables['var']
+        n_read = np.zeros(data.shape, dtype='i4')
+        for index, block in v.iter_partitions(prefetch=2):
+            self.assertTrue(np.array_equal(block, data[index]))
+            n_read[index] += 1
+        # every element is read once
+        self.assertTrue((n_read == 1).all())
+        f.close()
+
+    def test_var_iter_chunks(self):
+        np.random.seed(0)
+        data = np.random.rand(DIMSIZE, DIMSIZE, DIMSIZE, DIMSIZE)
+        f = Dataset('./testnc_methods.nc', 'r')
+        v = f.variables['var']
+        for axis in range(0, 4):
+            n_read = np.zeros(data.shape, dtype='i4')
+            for index, block in v.iter_chunks(axis=axis, max_bytes=data.nbytes // 2):
+                self.assertTrue(np.array_equal(block, data[index]))
+                n_read[index] += 1
+            self.assertTrue((n_read == 1).all())
+        f.close()
+
     # These don't work for cfa files either... TODO
     # def test_var_set_auto_chartostring(self):
     #     f = Dataset('./testnc_methods.nc', 'a')
@@ -457,19 +533,19 @@ class test_set5_Methods_s3_cfa(unittest.TestCase):
         slDB = slCacheDB()
         cache_loc = sl_config['cache']['location']
         conn_man = slConnectionManager(sl_config)
-        conn = conn_man.open("s3://test")
-        # construct list of subfiles
-        subfiles = glob('{}/testnc_methods/*.nc'.format(cache_loc))
-        subfiles = ['testnc_methods/'+file.split('/')[-1] for file in subfiles]
+        with conn_man.open("s3://test") as conn:
+            # construct list of subfiles
+            subfiles = glob('{}/testnc_methods/*.nc'.format(cache_loc))
+            subfiles = ['testnc_methods/'+file.split('/')[-1] for file in subfiles]
 
-        sl_cache._clear_cache()
-        s3 = conn.get()
-        s3.delete_object(Bucket='databucket', Key='testnc_methods.nc')
-        for file in subfiles:
-            #print(file)
-            s3.delete_object(Bucket='databucket', Key=file)
+            sl_cache._clear_cache()
+            s3 = conn.get()
+            s3.delete_object(Bucket='databucket', Key='testnc_methods.nc')
+            for file in subfiles:
+                #print(file)
+                s3.delete_object(Bucket='databucket', Key=file)
 
-        s3.delete_bucket(Bucket='databucket')
+            s3.delete_bucket(Bucket='databucket')
 
 
     def test_var_setncattr(self):
@@ -681,11 +757,11 @@ class test_set4_Methods_s3_noncfa(unittest.TestCase):
         slDB = slCacheDB()
         cache_loc = sl_config['cache']['location']
         conn_man = slConnectionManager(sl_config)
-        conn = conn_man.open("s3://test")
-        sl_cache._clear_cache()
-        s3 = conn.get()
-        s3.delete_object(Bucket='databucket', Key='testnc_methods.nc')
-        s3.delete_bucket(Bucket='databucket')
+        with conn_man.open("s3://test") as conn:
+            sl_cache._clear_cache()
+            s3 = conn.get()
+            s3.delete_object(Bucket='databucket', Key='testnc_methods.nc')
+            s3.delete_bucket(Bucket='databucket')
 
     def test_var_ncattrs(self):
         f = Dataset('s3://test/databucket/testnc_methods.nc', 'r')
@@ -0,0 +1,160 @@
+""" Tests for the CFA classes, which hold the structure of a CFA-netCDF master array file.
+"""
+__copyright__ = "(C) 2012 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+
+from SemSL._CFAClasses import CFAFile, CFAVariable, CFAPartitionTable
+from SemSL._CFAFunctions import create_partitions
+from SemSL._slExceptions import CFAException
+import netCDF4
+import numpy as np
+import unittest
+import json
+import io
+
+# partitions with and without the (optional) index and location
+PARTITIONS = [{"index": [0, 0], "location": [[0, 9], [0, 4]],
+               "subarray": {"ncvar": "var", "file": "base/file_[0].nc", "format": "netCDF", "shape": [10, 5]}},
+              {"index": [], "location": [[0, 9], [5, 9]],
+               "subarray": {"ncvar": "var", "file": "base/file_[1].nc", "format": "netCDF", "shape": [10, 5]}},
+              {"index": [1, 0], "location": [],
+               "subarray": {"ncvar": "other", "file": "base/file_[2].nc", "format": "", "shape": [10, 5]}},
+              {"index": [], "location": [],
+               "subarray": {"ncvar": "var", "file": "", "format": "netCDF", "shape": [10, 5]}}]
+
+
+def _create_dataset(cfa_array, shape=(20, 10)):
+    """Create an in-memory netCDF variable with the cfa_array metadata"""
+    ds = netCDF4.Dataset('cfa_classes_test.nc', 'w', diskless=True)
+    ds.createDimension('y', shape[0])
+    ds.createDimension('x', shape[1])
+    var = ds.createVariable('var', 'f8', ())
+    var.setncattr('cf_role', 'cfa_variable')
+    var.setncattr('cfa_dimensions', 'y x')
+    var.setncattr('cfa_array', json.dumps(cfa_array))
+    return ds
+
+
+class TestCFAPartitionTable(unittest.TestCase):
+
+    def test_parse_mixed(self):
+        cfa_array = {"base": "base", "pmshape": [2, 2], "pmdimensions": ["y", "x"], "Partitions": PARTITIONS}
+        ds = _create_dataset(cfa_array)
+        cfa_var = CFAVariable()
+        cfa_var.parse(ds.variables['var'])
+        partitions = cfa_var.partitions
+        self.assertEqual(len(partitions), 4)
+        self.assertEqual(partitions.ndim, 2)
+        self.assertEqual(partitions.has_index.tolist(), [True, False, True, False])
+        self.assertEqual(partitions.has_location.tolist(), [True, True, False, False])
+        self.assertEqual(partitions.ncvars, ["var", "other"])
+        self.assertEqual(partitions[1].location.tolist(), [[0, 9], [5, 9]])
+        self.assertEqual(partitions[1].index.tolist(), [])
+        self.assertEqual(partitions[2].subarray.ncvar, "other")
+        self.assertEqual(partitions[-1].subarray.file, "")
+        self.assertEqual(cfa_var.pmshape.tolist(), [2, 2])
+        # the metadata written back is the same as that read
+        self.assertEqual(json.loads(json.dumps(cfa_var.dict()["cfa_array"])), cfa_array)
+        ds.close()
+
+    def test_from_partitions(self):
+        ds = netCDF4.Dataset('cfa_classes_test.nc', 'w', diskless=True)
+        dims = ['t', 'z', 'y', 'x']
+        shape = np.array([8, 4, 16, 32])
+        for d, n in zip(dims, shape):
+            ds.createDimension(d, n)
+            ds.createVariable(d, 'f8', (d,))
+        pmshape, table, subarray_shape = create_partitions('base/file', ds, dims, 'var', shape, np.dtype('f8'),
+                                                           max_file_size=16*1024, format='netCDF')
+        ds.close()
+        self.assertTrue(len(table) > 1)
+        # from a list of CFAPartition, as passed to CFAVariable
+        for other in [CFAPartitionTable.from_partitions(list(table)),
+                      CFAVariable(pmshape=pmshape, partitions=list(table)).partitions]:
+            self.assertEqual(other.dict(), table.dict())
+            for column in ['index', 'location', 'shape', 'has_index', 'has_location']:
+                self.assertTrue(np.array_equal(getattr(other, column), getattr(table, column)), column)
+            self.assertEqual(other.files, table.files)
+        self.assertIs(CFAPartitionTable.from_partitions(table), table)
+
+    def test_malformed(self):
+        no_shape = [{"index": [0], "location": [[0, 9]], "subarray": {"file": "file_[0].nc"}}]
+        for cfa_array in [{"base": "base"},
+                          {"Partitions": [{"index": [0, 0]}]},
+                          {"Partitions": no_shape},
+                          {"Partitions": [PARTITIONS[0], dict(PARTITIONS[1], location=[[0, 9]])]},
+                          {"Partitions": [PARTITIONS[0], dict(PARTITIONS[1], subarray={"shape": [10]})]}]:
+            ds = _create_dataset(cfa_array)
+            cfa_var = CFAVariable()
+            # the error is raised when the cfa_array is first accessed, not when the variable is parsed
+            cfa_var.parse(ds.variables['var'])
+            with self.assertRaises(CFAException):
+                cfa_var.partitions
+            with self.assertRaises(CFAException):
+                cfa_var.dict()
+            ds.close()
+
+
+class TestCFAFileArrays(unittest.TestCase):
+
+    def setUp(self):
+        # a master array file with a dimension with metadata, and two variables
+        self.ds = netCDF4.Dataset('cfa_classes_test.nc', 'w', diskless=True)
+        self.ds.setncattr('Conventions', 'CF-1.6 CFA-0.4')
+        for d, n in [('y', 20), ('x', 10)]:
+            self.ds.createDimension(d, n)
+            dim_var = self.ds.createVariable(d, 'f8', (d,))
+            dim_var.setncattr('units', 'm')
+            dim_var.setncattr('valid_range', np.array([0.0, 100.0]))
+            dim_var.setncattr('scale', np.float32(2.0))
+        for v in ['var', 'other']:
+            var = self.ds.createVariable(v, 'f8', ())
+            var.setncattr('cf_role', 'cfa_variable')
+            var.setncattr('cfa_dimensions', 'y x')
+            var.setncattr('cfa_array', json.dumps({"base": "base", "pmshape": [2, 2], "pmdimensions": ["y", "x"],
+                                                   "Partitions": PARTITIONS}))
+        self.cfa_file = CFAFile()
+        self.cfa_file.parse(self.ds)
+
+    def tearDown(self):
+        self.ds.close()
+
+    def _round_trip(self):
+        # saved and loaded as numpy would from the cache area, without pickle
+        fh = io.BytesIO()
+        np.savez(fh, **self.cfa_file.arrays())
+        fh.seek(0)
+        with np.load(fh, allow_pickle=False) as npz:
+            return CFAFile.from_arrays({k: npz[k] for k in npz.files})
+
+    def test_round_trip(self):
+        # only one of the variables has had its cfa_array parsed
+        self.cfa_file.cfa_vars['var'].partitions
+        loaded = self._round_trip()
+        self.assertEqual(loaded.format, self.cfa_file.format)
+        self.assertEqual(sorted(loaded.cfa_dims), ['x', 'y'])
+        metadata = loaded.cfa_dims['y'].metadata
+        self.assertEqual(metadata['units'], 'm')
+        self.assertEqual(metadata['valid_range'].tolist(), [0.0, 100.0])
+        self.assertEqual(metadata['scale'], self.cfa_file.cfa_dims['y'].metadata['scale'])
+        self.assertEqual(loaded.cfa_dims['x'].dim_len, 10)
+        self.assertTrue(loaded.cfa_vars['var'].is_parsed())
+        self.assertFalse(loaded.cfa_vars['other'].is_parsed())
+        for v in ['var', 'other']:
+            self.assertEqual(loaded.cfa_vars[v].cfa_dimensions, ['y', 'x'])
+            self.assertEqual(loaded.cfa_vars[v].dict(), self.cfa_file.cfa_vars[v].dict())
+        partitions = loaded.cfa_vars['var'].partitions
+        self.assertEqual(partitions.ncvars, ['var', 'other'])
+        self.assertEqual(partitions.has_location.tolist(), [True, True, False, False])
+
+    def test_malformed_columns(self):
+        self.cfa_file.cfa_vars['var'].partitions
+        arrays = self.cfa_file.arrays()
+        for key, value in [('var0_file_ids', np.array([0, 1, 2, 4], dtype='i')),
+                           ('var0_shape', np.zeros((4, 3), dtype='i')),
+                           ('var0_has_index', np.zeros(3, dtype=bool))]:
+            with self.assertRaises(CFAException):
+                CFAFile.from_arrays(dict(arrays, **{key: value}))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+""" Tests for the functions that find the partitions of a CFA variable.
+"""
+__copyright__ = "(C) 2012 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+
+from SemSL._CFAClasses import CFAVariable, CFAPartitionTable
+from SemSL._CFAFunctions import create_partitions, fill_selection, get_overlapping_partitions, partition_overlaps
+import netCDF4
+import numpy as np
+import unittest
+
+SHAPE = np.array([6, 4, 18, 30])
+MASK = np.arange(SHAPE[2]) % 7 == 2
+# selections on the variable, as passed to __getitem__ / __setitem__
+SELECTIONS = [(slice(None),),
+              (slice(2, 5), 1, slice(3, 15), slice(None)),
+              (slice(None, None, 4),),
+              (Ellipsis, slice(1, None, 11)),
+              (slice(None, None, -1), slice(None), [17, 2, 2, 9]),
+              (0, 0, MASK, [29, 0]),
+              (Ellipsis, [14, 15]),
+              (slice(None), [3, 0], [0, 13]),
+              (slice(None), slice(3, 1)),
+              (5, 3, 17, 29)]
+
+
+def _create_variable():
+    """Create a CFAVariable with the partitions from create_partitions"""
+    ds = netCDF4.Dataset('cfa_functions_test.nc', 'w', diskless=True)
+    dims = ['t', 'z', 'y', 'x']
+    for d, n in zip(dims, SHAPE):
+        ds.createDimension(d, n)
+        ds.createVariable(d, 'f8', (d,))
+    pmshape, partitions, subarray_shape = create_partitions('base/file', ds, dims, 'var', SHAPE, np.dtype('f8'),
+                                                            max_file_size=1024, format='netCDF')
+    ds.close()
+    return CFAVariable('var', cfa_dimensions=dims, pmdimensions=dims, pmshape=pmshape, partitions=partitions)
+
+
+class TestOverlappingPartitions(unittest.TestCase):
+
+    def setUp(self):
+        self.cfa_var = _create_variable()
+
+    def _check_overlaps(self):
+        # the partitions found are the same as checking every partition, in the same order
+        for sel in SELECTIONS:
+            slices = fill_selection(SHAPE, sel)[0]
+            expected = [p.dict() for p in self.cfa_var.partitions if partition_overlaps(p, slices)]
+            found = [p.dict() for p in get_overlapping_partitions(self.cfa_var, slices)]
+            self.assertEqual(found, expected, sel)
+
+    def test_regular_grid(self):
+        self.assertTrue(len(self.cfa_var.partitions) > 1)
+        self.assertTrue(np.all(self.cfa_var.pmshape > 1))
+        locations, grid = self.cfa_var.get_location_index()
+        self.assertEqual(locations.shape, (len(self.cfa_var.partitions), 4, 2))
+        self.assertEqual([len(g) for g in grid], self.cfa_var.pmshape.tolist())
+        self._check_overlaps()
+
+    def test_reordered(self):
+        self.cfa_var.partitions = list(reversed(list(self.cfa_var.partitions)))
+        locations, grid = self.cfa_var.get_location_index()
+        self.assertIsNotNone(locations)
+        self.assertIsNone(grid)
+        self._check_overlaps()
+
+    def test_irregular(self):
+        # move the boundary between the first two partitions along the last axis, for the first partition only
+        partitions = self.cfa_var.partitions
+        location = partitions.location.copy()
+        location[0,3,1] -= 1
+        location[1,3,0] -= 1
+        self.cfa_var.partitions = CFAPartitionTable(partitions.index, location, partitions.shape,
+                                                    [partitions.files[i] for i in partitions.file_ids], 'var')
+        locations, grid = self.cfa_var.get_location_index()
+        self.assertIsNone(grid)
+        self._check_overlaps()
+        # without locations every partition is checked
+        self.cfa_var.partitions = CFAPartitionTable(partitions.index, [], partitions.shape,
+                                                    [partitions.files[i] for i in partitions.file_ids], 'var')
+        self.assertEqual(self.cfa_var.get_location_index(), (None, None))
+        self._check_overlaps()
+
+    def test_reassign(self):
+        # the index is rebuilt when the partitions are changed
+        regular = self.cfa_var.partitions
+        self.assertIsNotNone(self.cfa_var.get_location_index()[1])
+        self.cfa_var.partitions = list(reversed(list(regular)))
+        self.assertIsNone(self.cfa_var.get_location_index()[1])
+        self._check_overlaps()
+        self.cfa_var.partitions = regular
+        self.assertIsNotNone(self.cfa_var.get_location_index()[1])
+        self._check_overlaps()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+__copyright__ = "(C) 2012 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+
+import SemSL._baseInterface as baseInterface
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import netCDF4
+import numpy as np
+import unittest
+import tempfile
+import shutil
+import os
+
+class TestReadDirect(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        path = os.path.join(self.tmp_dir, 'sub.nc')
+        nc = netCDF4.Dataset(path, 'w')
+        nc.createDimension('x', 6)
+        nc.createDimension('y', 5)
+        var = nc.createVariable('var', 'f4', ('x', 'y'), fill_value=-999.)
+        var[0:4] = np.arange(20.).reshape(4, 5)
+        scaled = nc.createVariable('scaled', 'i2', ('x', 'y'))
+        scaled.scale_factor = 0.5
+        scaled[:] = 1.
+        nc.close()
+        self.nc = netCDF4.Dataset(path, 'r')
+        # read every contiguous block directly, however small
+        self.min_block = baseInterface.DIRECT_MIN_BLOCK
+        baseInterface.DIRECT_MIN_BLOCK = 0
+
+    def tearDown(self):
+        baseInterface.DIRECT_MIN_BLOCK = self.min_block
+        self.nc.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_read_direct(self):
+        var = self.nc.variables['var']
+        for source in [(slice(0, 6), slice(0, 5)), (slice(1, 6, 2), slice(0, 5, 3))]:
+            shape = [len(range(*s.indices(n))) for s, n in zip(source, var.shape)]
+            target_slice = (slice(1, 1 + shape[0]), slice(2, 2 + shape[1]))
+            expected = np.zeros((8, 8), dtype='f4')
+            expected[target_slice] = var[source]
+            target = np.zeros((8, 8), dtype='f4')
+            self.assertTrue(baseInterface.read_direct(var, source, target[target_slice]))
+            # including the unwritten values
+            self.assertTrue(np.array_equal(target, expected))
+
+    def test_read_direct_not_possible(self):
+        target = np.zeros((6, 5), dtype='f4')
+        # scaled values
+        self.assertFalse(baseInterface.read_direct(self.nc.variables['scaled'], (slice(0, 6), slice(0, 5)),
+                                                   target.astype('i2')))
+        # index arrays
+        self.assertFalse(baseInterface.read_direct(self.nc.variables['var'], (np.array([0, 2]), slice(0, 5)),
+                                                   target[0:2]))
+        # different dtype
+        self.assertFalse(baseInterface.read_direct(self.nc.variables['var'], (slice(0, 6), slice(0, 5)),
+                                                   target.astype('f8')))
+        self.assertFalse(target.any())
+
+
+class TestWriteFragment(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'sub.nc')
+        # a partition of a variable in a group, with one dimension from the root group
+        self.spec = {'name': 'var', 'format': 'NETCDF4', 'group': 'grp',
+                     'dimensions': [('t', True, 2, np.array([4., 5.]), {'units': 'days'}, True),
+                                    ('x', False, 3, np.arange(3, dtype='i4'), {}, False)],
+                     'datatype': np.dtype('f4'), 'pmdimensions': ('t', 'x'),
+                     'var_params': {p: None for p in baseInterface.VARIABLE_PARAMS},
+                     'metadata': {'long_name': 'test'}, 'group_metadata': {'title': 'group'}}
+        self.spec['var_params'].update({'zlib': True, 'complevel': 4, 'shuffle': True, 'fletcher32': False,
+                                        'contiguous': False, 'endian': 'native', 'chunk_cache': None})
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_write_fragment(self):
+        # the subarray file is created in another process, as by the write processes of _threadInterface
+        values = [((slice(0, 2), slice(0, 3)), np.arange(6, dtype='f4').reshape(2, 3))]
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+            pool.submit(baseInterface.write_fragment, self.path, 'w', self.spec, values).result()
+        nc = netCDF4.Dataset(self.path, 'r')
+        try:
+            self.assertTrue(nc.dimensions['t'].isunlimited())
+            self.assertEqual(list(nc.variables['t'][:]), [4., 5.])
+            self.assertEqual(nc.variables['t'].units, 'days')
+            grp = nc.groups['grp']
+            self.assertEqual(grp.title, 'group')
+            self.assertEqual(list(grp.variables['x'][:]), [0, 1, 2])
+            var = grp.variables['var']
+            self.assertEqual(var.long_name, 'test')
+            self.assertTrue(var.filters()['zlib'])
+            self.assertTrue(np.array_equal(var[:], np.arange(6).reshape(2, 3)))
+        finally:
+            nc.close()
+
+    def test_write_fragment_append(self):
+        self.spec.update({'group': None, 'group_metadata': None})
+        baseInterface.write_fragment(self.path, 'w', self.spec, [((slice(0, 2), slice(0, 3)), np.ones((2, 3)))])
+        baseInterface.write_fragment(self.path, 'a', {'name': 'var'}, [((0, slice(1, 3)), np.array([7., 8.]))])
+        # the hint about the number of dimensions is added to an IndexError, and the file is closed
+        with self.assertRaises(IndexError) as cm:
+            baseInterface.write_fragment(self.path, 'a', {'name': 'var'}, [((0, [5]), np.array([1.]))])
+        self.assertIn('number of dimensions', str(cm.exception))
+        nc = netCDF4.Dataset(self.path, 'r')
+        try:
+            self.assertTrue(np.array_equal(nc.variables['var'][:], [[1., 7., 8.], [1., 1., 1.]]))
+        finally:
+            nc.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,9 +2,17 @@ __copyright__ = "(C) 2012 Science and Technology Facilities Council"
 __license__ = "BSD - see LICENSE file in top-level directory"
 
 from SemSL._slCacheManager import slCacheManager
+import SemSL._slCacheManager as slCacheManagerModule
 from SemSL._slConfigManager import slConfig
 from SemSL._slConnectionManager import slConnectionManager
+from SemSL._slExceptions import slIOException, slCacheException
+from SemSL._CFAClasses import CFAFile, CFADim, CFAVariable, CFAPartitionTable
+import SemSL._slUtils as slU
+import SemSL._slnetCDFIO as slnetCDFIO
+from unittest import mock
 import unittest
+import contextlib
+import threading
 import  pickle
 import os
 import time
@@ -95,6 +103,96 @@ class TestCacheDB(unittest.TestCase):
     def test_get_fid(self):
         self.assertEqual(self.sl_cache.DB.get_fid(self.FID_IN_CACHE),self.FID_IN_CACHE)
 
+    def test_index_remove_and_replace(self):
+        self.sl_cache.DB.add_entry(self.FID_NOT_IN_CACHE,30*10**6)
+        # replacing an entry doesn't count its size twice
+        self.sl_cache.DB.add_entry(self.FID_NOT_IN_CACHE,20*10**6)
+        self.assertEqual(self.sl_cache.DB.get_total_cache_size(),80*10**6)
+        self.sl_cache.DB.remove_entry(self.FID_IN_CACHE)
+        self.assertEqual(self.sl_cache.DB.get_total_cache_size(),20*10**6)
+        self.assertEqual(self.sl_cache.DB.get_least_recent(),self.FID_NOT_IN_CACHE)
+        self.sl_cache.DB.remove_entry(self.FID_NOT_IN_CACHE)
+        self.assertTrue(self.sl_cache.DB.check_db_empty())
+        self.assertEqual(self.sl_cache.DB.get_least_recent(),None)
+
+    def test_batch(self):
+        self.sl_cache.DB.add_entries([self.FID_NOT_IN_CACHE, self.EXTRA_FID_NOT_IN_CACHE], [10*10**6, 20*10**6])
+        self.assertEqual(self.sl_cache.DB.get_total_cache_size(),90*10**6)
+        self.sl_cache.DB.touch_many([self.FID_IN_CACHE])
+        self.assertEqual(self.sl_cache.DB.get_least_recent(),self.FID_NOT_IN_CACHE)
+        # changes are not committed if the batch fails
+        try:
+            with self.sl_cache.DB.batch():
+                self.sl_cache.DB.remove_entry(self.FID_IN_CACHE)
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertTrue(self.sl_cache.DB.check_cache(self.FID_IN_CACHE))
+        self.sl_cache.DB.remove_many([self.FID_NOT_IN_CACHE, self.EXTRA_FID_NOT_IN_CACHE])
+        self.assertEqual(self.sl_cache.DB.get_all_fids(),[self.FID_IN_CACHE])
+
+    def test_index_rebuild(self):
+        self.sl_cache.DB.add_entry(self.FID_NOT_IN_CACHE,30*10**6)
+        # remove the index, as for a database created before the index existed
+        DB = self.sl_cache.DB
+        with DB.env.begin(write=True) as txn:
+            txn.drop(DB.index_db, delete=False)
+            txn.drop(DB.meta_db, delete=False)
+        DB = slCacheManager().DB
+        self.assertEqual(DB.get_total_cache_size(),90*10**6)
+        self.assertEqual(DB.get_least_recent(),self.FID_IN_CACHE)
+        self.assertEqual(len(DB.get_all_fids()),2)
+
+    def test_index_upgrade(self):
+        # a database from before the times and sizes were packed, with them stored as strings
+        DB = self.sl_cache.DB
+        with DB.env.begin(write=True) as txn:
+            for key, value in [('create_time', '2019-01-02 03:04:05.000006'),
+                               ('access_time', '2019-01-02 03:04:05.000006'),
+                               ('file_size', '30000000.0'), ('cache_loc', '/cache/old')]:
+                txn.put('{}_{}'.format(self.FID_NOT_IN_CACHE, key).encode(), value.encode())
+            txn.put(b'index_version', b'1', db=DB.meta_db)
+        DB = slCacheManager().DB
+        self.assertEqual(DB.get_total_cache_size(),90*10**6)
+        self.assertEqual(DB.get_file_size(self.FID_NOT_IN_CACHE),30*10**6)
+        self.assertEqual(DB.get_access_time(self.FID_NOT_IN_CACHE),datetime.datetime(2019, 1, 2, 3, 4, 5, 6))
+        self.assertEqual(DB.get_least_recent(),self.FID_NOT_IN_CACHE)
+        DB.update_access_time(self.FID_NOT_IN_CACHE)
+        self.assertEqual(DB.get_least_recent(),self.FID_IN_CACHE)
+
+    def test_remove_oldest_failed(self):
+        path = self.sl_cache.DB.get_cache_loc(self.FID_IN_CACHE)
+        with open(path, 'w') as f:
+            f.write('testwrite')
+        # nothing is removed for a file that can never fit
+        self.assertRaises(slCacheException, self.sl_cache._remove_oldest, self.sl_config['cache']['cache_size'] + 1)
+        self.assertTrue(self.sl_cache.DB.check_cache(self.FID_IN_CACHE))
+        # the files are only deleted once the removal of the entries has been committed
+        try:
+            with self.sl_cache.DB.batch():
+                self.sl_cache._remove_oldest(self.sl_config['cache']['cache_size'])
+                self.assertFalse(self.sl_cache.DB.check_cache(self.FID_IN_CACHE))
+                self.assertTrue(os.path.exists(path))
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertTrue(self.sl_cache.DB.check_cache(self.FID_IN_CACHE))
+        self.assertTrue(os.path.exists(path))
+        self.sl_cache._remove_oldest(self.sl_config['cache']['cache_size'])
+        self.assertFalse(self.sl_cache.DB.check_cache(self.FID_IN_CACHE))
+        self.assertFalse(os.path.exists(path))
+
+    def test_close_shared(self):
+        # the instances share the lmdb environment, which is only closed when the last of them is closed
+        DB = slCacheManager().DB
+        self.assertIs(DB.env, self.sl_cache.DB.env)
+        DB.close_db()
+        DB.close_db()
+        self.assertTrue(self.sl_cache.DB.check_cache(self.FID_IN_CACHE))
+        with self.sl_cache.DB.batch():
+            self.sl_cache.DB.add_entry(self.FID_NOT_IN_CACHE,10*10**6)
+        self.assertEqual(self.sl_cache.DB.get_total_cache_size(),70*10**6)
+
 class TestCacheManager(unittest.TestCase):
     # Test ability to take a file which isn't currently in the cache and put it in there then return the file path
     def setUp(self):
@@ -113,20 +211,20 @@ class TestCacheManager(unittest.TestCase):
         with open('{}/{}'.format(self.cache_loc, self.EXTRA_FID_NOT_IN_CACHE.split('/')[-1]), 'w') as f:
             f.write('testwrite')
         conn_man = slConnectionManager(self.sl_config)
-        conn = conn_man.open("s3://test")
-        s3 = conn.get()
-        s3.create_bucket(Bucket='cachetest')
-        s3.upload_file('{}/{}'.format(self.cache_loc, self.FID_IN_CACHE.split('/')[-1]),
-                        'cachetest',
-                        '{}'.format(self.FID_IN_CACHE.split('/')[-1]))
-        s3.upload_file('{}/{}'.format(self.cache_loc, self.FID_NOT_IN_CACHE.split('/')[-1]),
-                        'cachetest',
-                        '{}'.format(self.FID_NOT_IN_CACHE.split('/')[-1]))
-        s3.upload_file('{}/{}'.format(self.cache_loc, self.EXTRA_FID_NOT_IN_CACHE.split('/')[-1]),
-                        'cachetest',
-                        '{}'.format(self.EXTRA_FID_NOT_IN_CACHE.split('/')[-1]))
-        os.remove('{}/{}'.format(self.cache_loc, self.FID_NOT_IN_CACHE.split('/')[-1]))
-        os.remove('{}/{}'.format(self.cache_loc, self.EXTRA_FID_NOT_IN_CACHE.split('/')[-1]))
+        with conn_man.open("s3://test") as conn:
+            s3 = conn.get()
+            s3.create_bucket(Bucket='cachetest')
+            s3.upload_file('{}/{}'.format(self.cache_loc, self.FID_IN_CACHE.split('/')[-1]),
+                            'cachetest',
+                            '{}'.format(self.FID_IN_CACHE.split('/')[-1]))
+            s3.upload_file('{}/{}'.format(self.cache_loc, self.FID_NOT_IN_CACHE.split('/')[-1]),
+                            'cachetest',
+                            '{}'.format(self.FID_NOT_IN_CACHE.split('/')[-1]))
+            s3.upload_file('{}/{}'.format(self.cache_loc, self.EXTRA_FID_NOT_IN_CACHE.split('/')[-1]),
+                            'cachetest',
+                            '{}'.format(self.EXTRA_FID_NOT_IN_CACHE.split('/')[-1]))
+            os.remove('{}/{}'.format(self.cache_loc, self.FID_NOT_IN_CACHE.split('/')[-1]))
+            os.remove('{}/{}'.format(self.cache_loc, self.EXTRA_FID_NOT_IN_CACHE.split('/')[-1]))
 
     def tearDown(self):
         try:
@@ -134,15 +232,15 @@ class TestCacheManager(unittest.TestCase):
         except:
             print("Couldn't clear cache in tearDown?")
         conn_man = slConnectionManager(self.sl_config)
-        conn = conn_man.open("s3://test")
-        s3 = conn.get()
-        s3.delete_object(Bucket='cachetest',
-                       Key='{}'.format(self.FID_IN_CACHE.split('/')[-1]))
-        s3.delete_object(Bucket='cachetest',
-                       Key='{}'.format(self.FID_NOT_IN_CACHE.split('/')[-1]))
-        s3.delete_object(Bucket='cachetest',
-                       Key='{}'.format(self.EXTRA_FID_NOT_IN_CACHE.split('/')[-1]))
-        s3.delete_bucket(Bucket='cachetest')
+        with conn_man.open("s3://test") as conn:
+            s3 = conn.get()
+            s3.delete_object(Bucket='cachetest',
+                           Key='{}'.format(self.FID_IN_CACHE.split('/')[-1]))
+            s3.delete_object(Bucket='cachetest',
+                           Key='{}'.format(self.FID_NOT_IN_CACHE.split('/')[-1]))
+            s3.delete_object(Bucket='cachetest',
+                           Key='{}'.format(self.EXTRA_FID_NOT_IN_CACHE.split('/')[-1]))
+            s3.delete_bucket(Bucket='cachetest')
 
 
     def test_space_in_cache(self):
@@ -212,6 +310,63 @@ class TestCacheManager(unittest.TestCase):
     #     s3.delete_bucket(Bucket='newtestbucket')
 
 
+    def test_save_load_parsed(self):
+        self.assertEqual(self.sl_cache.load_parsed(self.FID_IN_CACHE), (None, None))
+        validator = self.sl_cache.get_validator(self.FID_IN_CACHE)
+        partitions = CFAPartitionTable([[0], [1]], [[[0, 4]], [[5, 9]]], [[5], [5]],
+                                       ['base/file_[0].nc', 'base/file_[1].nc'], 'var', 'netCDF')
+        cfa_file = CFAFile(cfa_dims={'x': CFADim('x', 10, {'units': 'm'})},
+                           cfa_vars={'var': CFAVariable('var', cfa_dimensions=['x'], pmdimensions=['x'], pmshape=[2],
+                                                        base='base', partitions=partitions)})
+        self.sl_cache.save_parsed(self.FID_IN_CACHE, cfa_file, validator)
+        path = self.sl_cache._get_parsed_path(self.FID_IN_CACHE)
+        # the CFAFile is saved as numpy arrays, not pickled
+        with open(path, 'rb') as fh:
+            self.assertEqual(fh.read(2), b'PK')
+        loaded, loaded_validator = self.sl_cache.load_parsed(self.FID_IN_CACHE)
+        self.assertEqual(loaded_validator, validator)
+        self.assertEqual(loaded.cfa_dims['x'].metadata, {'units': 'm'})
+        self.assertEqual(loaded.cfa_vars['var'].dict(), cfa_file.cfa_vars['var'].dict())
+        self.assertEqual([p.subarray.file for p in loaded.cfa_vars['var'].partitions], partitions.files)
+        # changing the object on the backend removes the saved metadata and the copy of the file in the cache
+        conn_man = slConnectionManager(self.sl_config)
+        with conn_man.open("s3://test") as conn:
+            conn.get().put_object(Bucket='cachetest', Key=self.FID_IN_CACHE.split('/')[-1], Body=b'changed')
+        self.assertIsNone(self.sl_cache.load_parsed(self.FID_IN_CACHE)[0])
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(self.sl_cache.DB.check_cache(self.FID_IN_CACHE))
+        # as does passing in a validator with another ETag
+        new_validator = self.sl_cache.get_validator(self.FID_IN_CACHE)
+        self.assertNotEqual(new_validator[0], validator[0])
+        self.sl_cache.save_parsed(self.FID_IN_CACHE, cfa_file, new_validator)
+        self.assertIsNotNone(self.sl_cache.load_parsed(self.FID_IN_CACHE, new_validator)[0])
+        self.assertEqual(self.sl_cache.load_parsed(self.FID_IN_CACHE, validator), (None, validator))
+        self.assertFalse(os.path.exists(path))
+        # a pickled file, e.g. written by another user in a shared cache, is not loaded
+        with open(path, 'wb') as fh:
+            pickle.dump({'fid': self.FID_IN_CACHE, 'validator': new_validator, 'cfa_file': None}, fh)
+        self.assertEqual(self.sl_cache.load_parsed(self.FID_IN_CACHE, new_validator), (None, new_validator))
+        self.assertFalse(os.path.exists(path))
+
+    def test_read_to_memory(self):
+        used = slCacheManagerModule._memory_used
+        data = self.sl_cache.read_to_memory(self.FID_NOT_IN_CACHE)
+        self.assertEqual(data, b'testwrite')
+        self.assertEqual(slCacheManagerModule._memory_used, used + 9)
+        slCacheManagerModule.release_memory(len(data))
+        self.assertEqual(slCacheManagerModule._memory_used, used)
+        # nothing is added to the cache
+        self.assertFalse(self.sl_cache.DB.check_cache(self.FID_NOT_IN_CACHE))
+        # the start of the file is the whole file
+        self.assertEqual(self.sl_cache.read_to_memory(self.FID_NOT_IN_CACHE, 4, b'test'), b'test')
+        slCacheManagerModule.release_memory(4)
+        # too large, or larger than the upper limit on the size
+        self.assertIsNone(self.sl_cache.read_to_memory(self.FID_NOT_IN_CACHE, 10 ** 12))
+        self.assertIsNone(self.sl_cache.read_to_memory(self.FID_NOT_IN_CACHE, 4))
+        # already in the cache
+        self.assertIsNone(self.sl_cache.read_to_memory(self.FID_IN_CACHE))
+        self.assertEqual(slCacheManagerModule._memory_used, used)
+
     def test_read_fail(self):
         # read should fail when file doesn't exist
         try:
@@ -254,6 +409,204 @@ class TestCacheManager(unittest.TestCase):
             self.assertEqual(glob.glob('{}test*'.format(self.cache_loc)),[])
 
 
+class _StubBackend(object):
+    """A backend holding the objects in memory, which counts the calls made to it"""
+
+    def __init__(self, buckets=()):
+        self.objects = {}
+        self.buckets = set(buckets)
+        # the keys of the objects that cannot be transferred
+        self.fail = set()
+        # whether the backend supports byte-range URLs
+        self.range_urls = True
+        self.calls = collections.Counter()
+        self.lock = threading.Lock()
+
+    def _call(self, name, fname=None):
+        with self.lock:
+            self.calls[name] += 1
+        if fname in self.fail:
+            raise IOError('Could not transfer {}'.format(fname))
+
+    def list_buckets(self, conn):
+        self._call('list_buckets')
+        return [{'Name': bucket} for bucket in self.buckets]
+
+    def create_bucket(self, conn, bucket):
+        self._call('create_bucket')
+        self.buckets.add(bucket)
+
+    def upload(self, conn, cloc, bucket, fname):
+        self._call('upload', fname)
+        with open(cloc, 'rb') as fh:
+            self.objects[(bucket, fname)] = fh.read()
+
+    def upload_data(self, conn, data, bucket, fname):
+        self._call('upload', fname)
+        self.objects[(bucket, fname)] = bytes(data)
+
+    def get_object_size(self, conn, bucket, fname):
+        self._call('head')
+        return len(self.objects[(bucket, fname)])
+
+    def download(self, conn, bucket, fname, cloc):
+        self._call('get', fname)
+        with open(cloc, 'wb') as fh:
+            fh.write(self.objects[(bucket, fname)])
+
+    def get_head_object(self, conn, bucket, fname):
+        self._call('head')
+        return {'ETag': 'etag', 'ContentLength': len(self.objects[(bucket, fname)])}
+
+    def get_object_info(self, conn, bucket, fname, n_bytes):
+        self._call('get', fname)
+        data = self.objects.get((bucket, fname))
+        if data is None:
+            return None
+        return {'size': len(data), 'etag': 'etag', 'data': data[:n_bytes]}
+
+    def get_range_url(self, conn, bucket, fname):
+        self._call('get_range_url')
+        if not self.range_urls:
+            raise NotImplementedError
+        return 'http://stub/{}/{}#mode=bytes'.format(bucket, fname)
+
+
+@contextlib.contextmanager
+def _stub_client(self, fid, access_type='r'):
+    yield None
+
+
+class _StubConnection(object):
+    def get(self):
+        return None
+
+
+@contextlib.contextmanager
+def _stub_conn(alias, sl_cache):
+    yield _StubConnection()
+
+
+class TestCacheManagerStubBackend(unittest.TestCase):
+    """Tests of the transfers to and from a backend, with the backend replaced by _StubBackend"""
+
+    def setUp(self):
+        self.sl_cache = slCacheManager()
+        self.backend = _StubBackend(buckets=['bucket'])
+        self.patches = [mock.patch.object(slU, '_get_backend', lambda fid: self.backend),
+                        mock.patch.object(slCacheManager, '_client', _stub_client),
+                        mock.patch.object(slnetCDFIO, '_get_conn', _stub_conn)]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+        self.sl_cache._clear_cache()
+
+    def _write_cached(self, fid, data):
+        path = self.sl_cache._get_cache_path(fid)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as fh:
+            fh.write(data)
+
+    def test_upload(self):
+        fids = ['s3://test/bucket/master.nc', 's3://test/bucket/sub/sub_0.nc', 's3://test/newbucket/sub_1.nc',
+                's3://test/bucket/sub/sub_2.nc']
+        for fid in fids:
+            self._write_cached(fid, fid.encode())
+        self.backend.fail.add('sub/sub_0.nc')
+        self.backend.fail.add('sub/sub_2.nc')
+        # every file is attempted, and the failures are reported together
+        with self.assertRaises(slIOException) as cm:
+            self.sl_cache.close(fids[0], 'w', subfiles_accessed=fids[1:] + fids[1:2])
+        self.assertIn('Failed to upload 2 file(s)', str(cm.exception))
+        self.assertIn(fids[1], str(cm.exception))
+        self.assertIn(fids[3], str(cm.exception))
+        self.assertEqual(self.backend.calls['upload'], 4)
+        self.assertEqual(self.backend.objects, {('bucket', 'master.nc'): fids[0].encode(),
+                                                ('newbucket', 'sub_1.nc'): fids[2].encode()})
+        # the buckets are checked once for the backend
+        self.assertEqual(self.backend.calls['list_buckets'], 1)
+        self.assertEqual(self.backend.calls['create_bucket'], 1)
+        # files in memory are uploaded from there
+        self.backend.fail.clear()
+        self.sl_cache.bulk_upload([fids[1]])
+        self.sl_cache._upload_files([fids[3]], {fids[3]: memoryview(b'in memory')})
+        self.assertEqual(self.backend.objects[('bucket', 'sub/sub_0.nc')], fids[1].encode())
+        self.assertEqual(self.backend.objects[('bucket', 'sub/sub_2.nc')], b'in memory')
+        self.assertEqual(self.backend.calls['list_buckets'], 3)
+
+    def test_download(self):
+        fids = ['s3://test/bucket/sub_{}.nc'.format(i) for i in range(0, 4)]
+        for fid in fids:
+            self.backend.objects[('bucket', slU._get_key(fid))] = fid.encode() * 10
+        self.sl_cache.DB.add_entry(fids[0], 1)
+        self.backend.fail.add('sub_2.nc')
+        with mock.patch.object(self.sl_cache, '_remove_oldest', wraps=self.sl_cache._remove_oldest) as remove:
+            self.assertRaises(slIOException, self.sl_cache.bulk_download, fids + fids[1:2])
+        # the space for the files not in the cache is reserved once
+        remove.assert_called_once_with(3 * len(fids[1]) * 10)
+        self.assertEqual(self.backend.calls['head'], 3)
+        self.assertEqual(self.backend.calls['get'], 3)
+        # the failed download is not added to the cache
+        self.assertEqual([self.sl_cache.DB.check_cache(fid) for fid in fids], [True, True, False, True])
+        self.assertEqual(self.sl_cache.DB.get_total_cache_size(), 1 + 2 * len(fids[1]) * 10)
+        with open(self.sl_cache._get_cache_path(fids[3]), 'rb') as fh:
+            self.assertEqual(fh.read(), fids[3].encode() * 10)
+
+    def _set_byte_range_reads(self, byte_range_reads):
+        host = dict(self.sl_cache.sl_config['hosts']['test'])
+        host['byte_range_reads'] = byte_range_reads
+        self.sl_cache.sl_config = {'hosts': {'test': host}}
+
+    def test_open_range(self):
+        fid = 's3://test/bucket/sub/sub_0.nc'
+        # byte_range_reads not set
+        self.assertIsNone(self.sl_cache.open_range(fid))
+        self._set_byte_range_reads(False)
+        self.assertIsNone(self.sl_cache.open_range(fid))
+        self.assertEqual(self.backend.calls['get_range_url'], 0)
+        self._set_byte_range_reads(True)
+        self.assertEqual(self.sl_cache.open_range(fid), 'http://stub/bucket/sub/sub_0.nc#mode=bytes')
+        # not supported by the backend
+        self.backend.range_urls = False
+        self.assertIsNone(self.sl_cache.open_range(fid))
+        # POSIX files, and files already in the cache, are not read with byte-ranges
+        self.backend.range_urls = True
+        self.assertIsNone(self.sl_cache.open_range('/tmp/sub_0.nc'))
+        self.sl_cache.DB.add_entry(fid, 1)
+        self.assertIsNone(self.sl_cache.open_range(fid))
+        self.assertEqual(self.backend.calls['get_range_url'], 2)
+
+    def test_open_requests(self):
+        # the number of requests made to open a master file on the backend
+        small = b'\x89HDF\r\n\x1a\n' + bytes(1000)
+        large = b'\x89HDF\r\n\x1a\n' + bytes(int(self.sl_cache.sl_config['system']['object_size_for_memory']))
+        self.backend.objects[('bucket', 'small.nc')] = small
+        self.backend.objects[('bucket', 'large.nc')] = large
+        # a small file is fetched whole, with the magic number, and opened from memory
+        file_details = slnetCDFIO.get_netCDF_file_details('s3://test/bucket/small.nc', 'r')
+        slCacheManagerModule.release_memory(len(file_details.memory))
+        self.assertEqual(file_details.format, 'NETCDF4')
+        self.assertEqual(bytes(file_details.memory), small)
+        self.assertEqual(self.backend.calls, {'get': 1})
+        # larger files are downloaded to the cache, without a HEAD for their size
+        self.backend.calls.clear()
+        file_details = slnetCDFIO.get_netCDF_file_details('s3://test/bucket/large.nc', 'r')
+        self.assertEqual(self.backend.calls, {'get': 2})
+        self.assertEqual(os.path.getsize(file_details.filename), len(large))
+        self.assertEqual(file_details.validator, ('etag', len(large)))
+        self.backend.calls.clear()
+        slnetCDFIO.get_netCDF_file_details('s3://test/bucket/small.nc', 'a')
+        self.assertEqual(self.backend.calls, {'get': 2})
+        # files already in the cache are only checked
+        self.backend.calls.clear()
+        slnetCDFIO.get_netCDF_file_details('s3://test/bucket/large.nc', 'a')
+        self.assertEqual(self.backend.calls, {'get': 1})
+        self.assertRaises(slIOException, slnetCDFIO.get_netCDF_file_details, 's3://test/bucket/missing.nc', 'r')
+
+
 class TestCacheManagerUtils(unittest.TestCase):
 
     def setUp(self):
@@ -132,6 +132,22 @@ class testslConfig(unittest.TestCase):
         self.assertEqual(self.sl_config['hosts'][list(self.sl_config['hosts'].keys())[0]]['alias'],
                          self.json_config['hosts'][list(self.json_config['hosts'].keys())[0]]['alias'])
 
+    def test_config_cached(self):
+        # the file is only read once
+        self.assertIs(slConfig()['hosts'], self.sl_config['hosts'])
+
+    def test_config_read_only(self):
+        with self.assertRaises(TypeError):
+            self.sl_config['cache']['location'] = '/tmp'
+
+    def test_config_reload(self):
+        old_hosts = self.sl_config['hosts']
+        self.sl_config.reload()
+        self.assertIsNot(self.sl_config['hosts'], old_hosts)
+        self.assertEqual(self.sl_config['cache']['location'],self.json_config['cache']['location'])
+        # new instances get the reloaded config
+        self.assertIs(slConfig()['hosts'], self.sl_config['hosts'])
+
 
 
 
@@ -3,6 +3,9 @@ __license__ = "BSD - see LICENSE file in top-level directory"
 
 from SemSL._slConfigManager import slConfig
 from SemSL._slConnectionManager import slConnectionManager
+from SemSL import Backends
+import threading
+import gc
 
 def test_slConnectionManager():
     # create config manager
@@ -43,5 +46,75 @@ def test_slConnectionManager():
     #       conn_man.total_connections("ftp://vagrant"),
     #       conn_man.open_connections("ftp://vagrant")))
 
+def test_slConnectionManager_pool():
+    sl_config = slConfig()
+    # the pool is shared between connection managers
+    conn = slConnectionManager(sl_config).open("s3://test")
+    conn.release()
+    conn2 = slConnectionManager(sl_config).open("s3://test")
+    assert conn2 is conn
+    conn2.release()
+
+    # the number of read connections is limited - opening another connection in a different thread waits until one
+    # of them is released
+    n_conns = int(sl_config['hosts']['test']['read_connections'])
+    conns = [slConnectionManager(sl_config).open("s3://test", 'r') for c in range(0, n_conns)]
+    opened = threading.Event()
+    def open_conn():
+        slConnectionManager(sl_config).open("s3://test", 'r').release()
+        opened.set()
+    thread = threading.Thread(target=open_conn)
+    thread.start()
+    assert not opened.wait(0.5)
+    conns[0].release()
+    assert opened.wait(5)
+    thread.join()
+    for c in conns[1:]:
+        c.release()
+    assert slConnectionManager(sl_config).open_connections("s3://test") == 0
+
+def test_slConnectionManager_cycle():
+    sl_config = slConfig()
+    in_use = slConnectionManager(sl_config).open_connections("s3://test")
+    def lease():
+        # the connection is not released, and is kept in a reference cycle by the traceback of the exception
+        conn = slConnectionManager(sl_config).open("s3://test")
+        try:
+            raise ValueError()
+        except ValueError as e:
+            err = e
+    lease()
+    gc.collect()
+    # the connection no longer counts as in use, and its client is not reused
+    assert slConnectionManager(sl_config).open_connections("s3://test") == in_use
+    with slConnectionManager(sl_config).open("s3://test") as conn:
+        conn.get().list_buckets()
+
+def test_slConnectionManager_gc_close():
+    sl_config = slConfig()
+    # record the clients closed by the backend
+    closed = []
+    get_backend_from_id = Backends.get_backend_from_id
+    def recording_backend(backend_id):
+        backend = get_backend_from_id(backend_id)
+        class RecordingBackend(backend):
+            def close(self, conn):
+                closed.append(conn)
+                backend.close(self, conn)
+        return RecordingBackend
+    Backends.get_backend_from_id = recording_backend
+    try:
+        conn = slConnectionManager(sl_config).open("s3://test")
+        client = conn.get()
+        del conn
+        gc.collect()
+    finally:
+        Backends.get_backend_from_id = get_backend_from_id
+    # a connection dropped without being released has its client closed
+    assert closed == [client]
+
 if __name__ == "__main__":
     test_slConnectionManager()
+    test_slConnectionManager_pool()
+    test_slConnectionManager_cycle()
+    test_slConnectionManager_gc_close()
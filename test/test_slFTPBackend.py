@@ -0,0 +1,110 @@
+__copyright__ = "(C) 2012 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+
+from SemSL.Backends._slFTPBackend import slFTPBackend
+from SemSL._slExceptions import slIOException
+from concurrent.futures import ThreadPoolExecutor
+import unittest
+import tempfile
+import threading
+import shutil
+import time
+import os
+
+try:
+    from pyftpdlib.authorizers import DummyAuthorizer
+    from pyftpdlib.handlers import FTPHandler
+    from pyftpdlib.servers import ThreadedFTPServer
+except ImportError:
+    ThreadedFTPServer = None
+
+CREDENTIALS = {'user': 'user', 'password': 'password', 'account': ''}
+
+@unittest.skipIf(ThreadedFTPServer is None, 'pyftpdlib is not installed')
+class TestFTPBackend(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # a local FTP server, run in a thread
+        cls.root = tempfile.mkdtemp()
+        authorizer = DummyAuthorizer()
+        authorizer.add_user(CREDENTIALS['user'], CREDENTIALS['password'], cls.root, perm='elradfmwMT')
+        cls.handler = type('Handler', (FTPHandler,), {'authorizer': authorizer})
+        cls.server = ThreadedFTPServer(('127.0.0.1', 0), cls.handler)
+        cls.endpoint = '127.0.0.1:{}'.format(cls.server.address[1])
+        cls.thread = threading.Thread(target=cls.server.serve_forever, kwargs={'timeout': 0.1})
+        cls.thread.daemon = True
+        cls.thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.close_all()
+        shutil.rmtree(cls.root)
+
+    def setUp(self):
+        self.cache = tempfile.mkdtemp()
+        self.backend = slFTPBackend()
+        self.conn = self.backend.connect(self.endpoint, CREDENTIALS)
+        self.backend.create_bucket(self.conn, 'bucket')
+        self.data = bytes(range(256)) * 100
+        self.backend.upload_data(self.conn, self.data, 'bucket', 'dir/file.nc')
+
+    def tearDown(self):
+        self.backend.close(self.conn)
+        shutil.rmtree(self.cache)
+        shutil.rmtree(os.path.join(self.root, 'bucket'))
+
+    def test_upload_download(self):
+        cloc = os.path.join(self.cache, 'file.nc')
+        self.backend.download(self.conn, 'bucket', 'dir/file.nc', cloc)
+        with open(cloc, 'rb') as fh:
+            self.assertEqual(fh.read(), self.data)
+        self.backend.upload(self.conn, cloc, 'bucket', 'dir/sub/copy.nc')
+        self.assertEqual(self.backend.get_object_size(self.conn, 'bucket', 'dir/sub/copy.nc'), len(self.data))
+        self.assertEqual([b['Name'] for b in self.backend.list_buckets(self.conn)], ['bucket'])
+        self.assertRaises(slIOException, self.backend.download, self.conn, 'bucket', 'missing.nc', cloc)
+
+    def test_parallel(self):
+        # one control connection for each transfer, as from the connection pool
+        def transfer(i):
+            conn = self.backend.connect(self.endpoint, CREDENTIALS)
+            try:
+                self.backend.upload_data(conn, self.data[i:], 'bucket', 'part_{}.nc'.format(i))
+                cloc = os.path.join(self.cache, 'part_{}.nc'.format(i))
+                self.backend.download(conn, 'bucket', 'part_{}.nc'.format(i), cloc)
+                with open(cloc, 'rb') as fh:
+                    return fh.read() == self.data[i:]
+            finally:
+                self.backend.close(conn)
+        with ThreadPoolExecutor(4) as executor:
+            self.assertTrue(all(executor.map(transfer, range(0, 8))))
+
+    def test_partial(self):
+        self.assertEqual(self.backend.get_partial(self.conn, 'bucket', 'dir/file.nc', 300, 309, binary=True),
+                         self.data[300:310])
+        # the connection can be used after a transfer stopped before the end of the file
+        info = self.backend.get_object_info(self.conn, 'bucket', 'dir/file.nc', 4)
+        self.assertEqual(info['size'], len(self.data))
+        self.assertEqual(info['data'], self.data[0:4])
+        self.assertEqual(info['etag'], self.backend.get_head_object(self.conn, 'bucket', 'dir/file.nc')['ETag'])
+        self.assertEqual(self.backend.get_object_info(self.conn, 'bucket', 'dir/file.nc', 10 ** 6)['data'], self.data)
+        self.assertIsNone(self.backend.get_object_info(self.conn, 'bucket', 'missing.nc', 4))
+
+    def test_remove(self):
+        self.assertTrue(self.backend.object_exists(self.conn, 'bucket', 'dir/file.nc'))
+        self.backend.remove_obj(self.conn, 'bucket', 'dir/file.nc')
+        self.assertFalse(self.backend.object_exists(self.conn, 'bucket', 'dir/file.nc'))
+
+    def test_reopen(self):
+        # the server closes connections that are idle for longer than its timeout
+        self.handler.timeout = 1
+        try:
+            conn = self.backend.connect(self.endpoint, CREDENTIALS)
+            time.sleep(2)
+            self.assertEqual(self.backend.get_object_size(conn, 'bucket', 'dir/file.nc'), len(self.data))
+            self.backend.close(conn)
+        finally:
+            self.handler.timeout = FTPHandler.timeout
+
+if __name__ == '__main__':
+    unittest.main()
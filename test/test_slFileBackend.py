@@ -0,0 +1,107 @@
+__copyright__ = "(C) 2012 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+
+from SemSL.Backends._slFileBackend import slFileBackend
+from SemSL._slExceptions import slIOException
+import unittest
+import tempfile
+import shutil
+import os
+import stat
+from SemSL.Backends import _slFileBackend
+
+class TestFileBackend(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.cache = tempfile.mkdtemp()
+        self.backend = slFileBackend()
+        self.conn = self.backend.connect(self.root, {})
+        self.backend.create_bucket(self.conn, 'bucket')
+        self.backend.upload_data(self.conn, b'0123456789', 'bucket', 'dir/file.nc')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+        shutil.rmtree(self.cache)
+
+    def _read(self, path):
+        with open(path, 'rb') as fh:
+            return fh.read()
+
+    def test_download(self):
+        cloc = os.path.join(self.cache, 'file.nc')
+        for method in ['reflink', 'link', 'copy']:
+            conn = self.backend.connect(self.root, {}, {'download_method': method})
+            self.backend.download(conn, 'bucket', 'dir/file.nc', cloc)
+            self.assertEqual(self._read(cloc), b'0123456789')
+        self.assertRaises(slIOException, self.backend.download, self.conn, 'bucket', 'missing.nc', cloc)
+
+    def test_upload(self):
+        cloc = os.path.join(self.cache, 'file.nc')
+        with open(cloc, 'wb') as fh:
+            fh.write(b'abc')
+        self.backend.upload(self.conn, cloc, 'bucket', 'dir/file.nc')
+        self.assertEqual(self._read(os.path.join(self.root, 'bucket', 'dir', 'file.nc')), b'abc')
+        self.assertEqual([b['Name'] for b in self.backend.list_buckets(self.conn)], ['bucket'])
+        # no temporary files are left behind
+        self.assertEqual(os.listdir(os.path.join(self.root, 'bucket', 'dir')), ['file.nc'])
+
+    def test_upload_mode(self):
+        cloc = os.path.join(self.cache, 'file.nc')
+        with open(cloc, 'wb') as fh:
+            fh.write(b'abc')
+        # a new file gets the permissions from the umask, not those of the temporary file it is written to
+        umask = os.umask(0o027)
+        try:
+            self.backend.upload(self.conn, cloc, 'bucket', 'new.nc')
+            self.backend.upload_data(self.conn, b'abc', 'bucket', 'new_data.nc')
+        finally:
+            os.umask(umask)
+        for fname in ['new.nc', 'new_data.nc']:
+            self.assertEqual(stat.S_IMODE(os.stat(os.path.join(self.root, 'bucket', fname)).st_mode), 0o640)
+        # a file that is replaced keeps its permissions
+        path = os.path.join(self.root, 'bucket', 'dir', 'file.nc')
+        os.chmod(path, 0o604)
+        self.backend.upload(self.conn, cloc, 'bucket', 'dir/file.nc')
+        self.assertEqual(stat.S_IMODE(os.stat(path).st_mode), 0o604)
+        self.assertEqual(self._read(path), b'abc')
+
+    def test_reflink_unsupported(self):
+        # if the file cannot be cloned then the destination is left as it was
+        src = os.path.join(self.root, 'bucket', 'dir', 'file.nc')
+        dst = os.path.join(self.cache, 'clone.nc')
+        if _slFileBackend._reflink(src, dst):
+            self.skipTest('the filesystem supports reflinks')
+        self.assertFalse(os.path.lexists(dst))
+        with open(dst, 'wb') as fh:
+            fh.write(b'abc')
+        self.assertFalse(_slFileBackend._reflink(src, dst))
+        self.assertEqual(self._read(dst), b'abc')
+
+    def test_link_written_in_place(self):
+        conn = self.backend.connect(self.root, {}, {'download_method': 'link'})
+        cloc = os.path.join(self.cache, 'file.nc')
+        self.backend.download(conn, 'bucket', 'dir/file.nc', cloc)
+        with open(cloc, 'r+b') as fh:
+            fh.write(b'x')
+        self.backend.upload(conn, cloc, 'bucket', 'dir/file.nc')
+        self.assertEqual(self._read(os.path.join(self.root, 'bucket', 'dir', 'file.nc')), b'x123456789')
+
+    def test_partial(self):
+        self.assertEqual(self.backend.get_partial(self.conn, 'bucket', 'dir/file.nc', 2, 4, binary=True), b'234')
+        info = self.backend.get_object_info(self.conn, 'bucket', 'dir/file.nc', 4)
+        self.assertEqual(info['size'], 10)
+        self.assertEqual(info['data'], b'0123')
+        self.assertEqual(info['etag'], self.backend.get_head_object(self.conn, 'bucket', 'dir/file.nc')['ETag'])
+        self.assertIsNone(self.backend.get_object_info(self.conn, 'bucket', 'missing.nc', 4))
+        # read in place
+        self.assertEqual(self.backend.get_range_url(self.conn, 'bucket', 'dir/file.nc'),
+                         os.path.join(self.root, 'bucket', 'dir', 'file.nc'))
+
+    def test_remove(self):
+        self.assertTrue(self.backend.object_exists(self.conn, 'bucket', 'dir/file.nc'))
+        self.backend.remove_obj(self.conn, 'bucket', 'dir/file.nc')
+        self.assertFalse(self.backend.object_exists(self.conn, 'bucket', 'dir/file.nc'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+__copyright__ = "(C) 2012 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+
+from SemSL._slFileHandles import slFileHandles
+import netCDF4
+import unittest
+import tempfile
+import shutil
+import os
+
+class TestFileHandles(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.paths = []
+        for i in range(0, 3):
+            path = os.path.join(self.tmp_dir, 'sub_{}.nc'.format(i))
+            nc = netCDF4.Dataset(path, 'w')
+            nc.createDimension('x', 4)
+            nc.createVariable('var', 'f4', ('x',))[:] = i
+            nc.close()
+            self.paths.append(path)
+        self.handles = slFileHandles(2)
+
+    def tearDown(self):
+        self.handles.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_reuse(self):
+        nc = self.handles.acquire(self.paths[0], 'r')
+        self.handles.release(nc)
+        self.assertIs(self.handles.acquire(self.paths[0], 'r'), nc)
+        self.handles.release(nc)
+        # opening for writing replaces the read only file, which is then also used for reading
+        nc_a = self.handles.acquire(self.paths[0], 'a')
+        self.assertFalse(nc.isopen())
+        self.handles.release(nc_a)
+        self.assertIs(self.handles.acquire(self.paths[0], 'r'), nc_a)
+        self.handles.release(nc_a)
+        self.assertEqual(len(self.handles), 1)
+
+    def test_lru(self):
+        ncs = []
+        for path in self.paths:
+            nc = self.handles.acquire(path, 'r')
+            self.handles.release(nc)
+            ncs.append(nc)
+        # the least recently used file is closed
+        self.assertEqual(len(self.handles), 2)
+        self.assertFalse(ncs[0].isopen())
+        self.assertTrue(ncs[2].isopen())
+
+    def test_acquired_not_closed(self):
+        ncs = [self.handles.acquire(path, 'r') for path in self.paths]
+        self.assertEqual(len(self.handles), 3)
+        for nc in ncs:
+            self.assertTrue(nc.isopen())
+            self.handles.release(nc)
+        self.assertEqual(len(self.handles), 2)
+
+    def test_close(self):
+        nc = self.handles.acquire(self.paths[0], 'a')
+        nc.variables['var'][:] = 10
+        self.handles.release(nc)
+        self.handles.close()
+        self.assertEqual(len(self.handles), 0)
+        self.assertFalse(nc.isopen())
+        nc = netCDF4.Dataset(self.paths[0], 'r')
+        self.assertEqual(nc.variables['var'][0], 10)
+        nc.close()
+
+    def test_diskless(self):
+        handles = slFileHandles(1, diskless=True)
+        paths = [os.path.join(self.tmp_dir, 'mem_{}.nc'.format(i)) for i in range(0, 2)]
+        for i, path in enumerate(paths):
+            nc = handles.acquire(path, 'w', format='NETCDF4')
+            nc.createDimension('x', 4)
+            nc.createVariable('var', 'f4', ('x',))[:] = i
+            handles.release(nc)
+        # the files in memory are not closed to keep within the limit, and are written to by append
+        self.assertEqual(len(handles), 2)
+        self.assertTrue(handles.is_open(paths[0]))
+        nc = handles.acquire(paths[0], 'a')
+        nc.variables['var'][0] = 10
+        handles.release(nc)
+        memory_files = handles.close()
+        self.assertEqual(sorted(memory_files.keys()), paths)
+        for path in paths:
+            self.assertFalse(os.path.exists(path))
+        nc = netCDF4.Dataset('mem', 'r', memory=memory_files[paths[0]])
+        self.assertEqual(list(nc.variables['var'][:]), [10, 0, 0, 0])
+        nc.close()
+
+if __name__ == '__main__':
+    unittest.main()
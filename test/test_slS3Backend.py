@@ -0,0 +1,33 @@
+__copyright__ = "(C) 2012 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+
+from SemSL.Backends._slS3Backend import get_client_config, get_transfer_config, DEFAULT_MULTIPART_THRESHOLD
+import unittest
+
+class TestS3Config(unittest.TestCase):
+
+    def test_transfer_config(self):
+        tc = get_transfer_config({'object_size': 128e6})
+        # the subarray files are not split into parts
+        self.assertEqual(tc.multipart_threshold, 128000000)
+        self.assertEqual(get_transfer_config({}).multipart_threshold, DEFAULT_MULTIPART_THRESHOLD)
+        tc = get_transfer_config({'object_size': 128e6, 'multipart_threshold': 8e6, 'multipart_chunksize': 32e6,
+                                  'max_concurrency': '20'})
+        self.assertEqual(tc.multipart_threshold, 8000000)
+        self.assertEqual(tc.multipart_chunksize, 32000000)
+        self.assertEqual(tc.max_concurrency, 20)
+
+    def test_client_config(self):
+        config = get_client_config({'api': 'S3v4', 'max_concurrency': 32,
+                                    'retries': {'mode': 'adaptive', 'max_attempts': 10}, 'connect_timeout': 5})
+        self.assertEqual(config.signature_version, 's3v4')
+        # enough connections for the parts of a transfer
+        self.assertEqual(config.max_pool_connections, 32)
+        self.assertEqual(config.retries['mode'], 'adaptive')
+        self.assertEqual(config.connect_timeout, 5)
+        config = get_client_config({'api': 'S3v2', 'max_pool_connections': 4})
+        self.assertEqual(config.signature_version, 's3')
+        self.assertEqual(config.max_pool_connections, 4)
+
+if __name__ == '__main__':
+    unittest.main()
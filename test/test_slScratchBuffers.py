@@ -0,0 +1,74 @@
+__copyright__ = "(C) 2012 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+
+from SemSL._slScratchBuffers import slScratchBuffers
+from SemSL._slCacheManager import slCacheManager
+import unittest
+import numpy as np
+import gc
+import os
+
+class TestScratchBuffers(unittest.TestCase):
+
+    def setUp(self):
+        self.sl_cache = slCacheManager()
+        self.buffers = slScratchBuffers()
+
+    def tearDown(self):
+        self.buffers.close()
+
+    def test_cache_size(self):
+        size = self.sl_cache.DB.get_total_cache_size()
+        buffer = self.buffers.get((10, 10), 'f8')
+        self.assertEqual(buffer.shape, (10, 10))
+        self.assertTrue(os.path.exists(buffer.filename))
+        self.assertEqual(self.sl_cache.DB.get_total_cache_size(), size + 800)
+        path = buffer.filename
+        del buffer
+        gc.collect()
+        self.buffers.close()
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(self.sl_cache.DB.get_total_cache_size(), size)
+
+    def test_reuse(self):
+        buffer = self.buffers.get((10, 10), 'f8')
+        path = buffer.filename
+        # in use - a new file is created
+        buffer2 = self.buffers.get((10, 10), 'f8')
+        self.assertNotEqual(buffer2.filename, path)
+        buffer[:] = 1
+        del buffer
+        gc.collect()
+        buffer = self.buffers.get((10, 10), 'f8')
+        self.assertEqual(buffer.filename, path)
+        # the data of the previous slice is not returned
+        self.assertFalse(buffer.any())
+        del buffer
+        # a different shape is not reused
+        self.assertNotEqual(self.buffers.get((5, 10), 'f8').filename, path)
+
+    def test_eviction(self):
+        # a buffer that needs the whole cache removes the other files, but only once the entry for it is added
+        cache_size = int(self.sl_cache.sl_config['cache']['cache_size'])
+        buffer = self.buffers.get((cache_size // 16,), 'f8')
+        path = buffer.filename
+        del buffer
+        gc.collect()
+        buffer = self.buffers.get((cache_size // 16 + 1,), 'f8')
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(self.sl_cache.DB.get_all_fids(), [os.path.relpath(buffer.filename, self.sl_cache.cache_loc)])
+
+    def test_deleted_after_close(self):
+        buffer = self.buffers.get((10, 10), 'f4')
+        buffer[:] = 1
+        path = buffer.filename
+        self.buffers.close()
+        # still in use
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(buffer.sum(), 100)
+        del buffer
+        gc.collect()
+        self.assertFalse(os.path.exists(path))
+
+if __name__ == '__main__':
+    unittest.main()
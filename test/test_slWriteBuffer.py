@@ -0,0 +1,77 @@
+__copyright__ = "(C) 2012 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+
+from SemSL._slWriteBuffer import slWriteBuffer
+from SemSL._CFAClasses import CFAPartition, CFASubarray
+from SemSL._CFAFunctions import fill_selection
+import numpy as np
+import unittest
+
+class TestWriteBuffer(unittest.TestCase):
+
+    def setUp(self):
+        # a (10, 4) variable split into two partitions along the second axis
+        self.parts = []
+        for i in range(0, 2):
+            subarray = CFASubarray(ncvar='var', file='sub_{}.nc'.format(i), format='netCDF', shape=[10, 2])
+            self.parts.append(CFAPartition(index=[0, i], location=[[0, 9], [2*i, 2*i+1]], subarray=subarray))
+        self.buffer = slWriteBuffer(1000)
+
+    def _add(self, elem, data, parts=None):
+        elem_slices = fill_selection((10, 4), elem)[0]
+        return self.buffer.add(parts or self.parts, elem_slices, np.asanyarray(data))
+
+    def _write(self, part_pieces):
+        # write the pieces to arrays for the partitions, as the interface does
+        result = np.zeros((10, 4))
+        for part, pieces, mode in part_pieces:
+            for elem_slices, data in pieces:
+                index = tuple([slice(s.start, s.stop + 1, s.step) for s in elem_slices])
+                result[index] = data
+        return result
+
+    def test_merge_time_steps(self):
+        expected = np.arange(40.).reshape(10, 4)
+        for t in range(0, 10):
+            self.assertFalse(self._add(t, expected[t:t+1]))
+        self.assertEqual(len(self.buffer), 2)
+        self.assertEqual(self.buffer.nbytes, 320)
+        part_pieces = self.buffer.pop()
+        # one piece for each partition, covering all the time steps
+        self.assertEqual([len(pieces) for part, pieces, mode in part_pieces], [1, 1])
+        self.assertEqual(part_pieces[0][1][0][0], [slice(0, 9, 1), slice(0, 1, 1)])
+        self.assertTrue(np.array_equal(self._write(part_pieces), expected))
+        self.assertEqual(len(self.buffer), 0)
+        self.assertEqual(self.buffer.nbytes, 0)
+
+    def test_order(self):
+        data = np.ones((2, 4))
+        self._add(slice(0, 2), data)
+        # the caller can reuse the array
+        data[:] = 2
+        self._add(slice(5, 7), data)
+        self._add((slice(0, 10, 3), 1), 3 * np.ones((4, 1)), self.parts[:1])
+        part_pieces = self.buffer.pop()
+        self.assertEqual([len(pieces) for part, pieces, mode in part_pieces], [3, 2])
+        expected = np.zeros((10, 4))
+        expected[0:2] = 1
+        expected[5:7] = 2
+        expected[::3, 1] = 3
+        self.assertTrue(np.array_equal(self._write(part_pieces), expected))
+
+    def test_full(self):
+        self.buffer.max_bytes = 200
+        self.assertFalse(self._add(slice(0, 3), np.ones((3, 4))))
+        self.assertTrue(self._add(slice(3, 10), np.ones((7, 4))))
+
+    def test_mode(self):
+        self._add(0, np.ones((1, 4)))
+        self.assertEqual([mode for part, pieces, mode in self.buffer.pop()], [None, None])
+        # the files have been written, and are appended to after that
+        self._add((0, 0), np.ones((1, 1)), self.parts[:1])
+        self.assertEqual([mode for part, pieces, mode in self.buffer.pop()], ['a'])
+        self.assertEqual([mode for part, pieces, mode in self.buffer.write_through(self.parts, None, None)],
+                         ['a', 'a'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+__copyright__ = "(C) 2012 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+
+from SemSL._threadInterface import _threadInterface
+from SemSL._CFAClasses import CFAPartition, CFASubarray
+from SemSL._CFAFunctions import fill_slices
+from SemSL._slExceptions import slIOException
+import netCDF4
+import numpy as np
+import unittest
+import tempfile
+import threading
+import shutil
+import time
+import os
+
+SHAPE = (8, 6)
+N_PARTS = 4
+ROWS = SHAPE[0] // N_PARTS
+
+
+class TestThreadInterfaceRead(unittest.TestCase):
+
+    def setUp(self):
+        # a variable split into partitions along the first axis, each in its own subarray file
+        self.tmp_dir = tempfile.mkdtemp()
+        self.expected = np.arange(np.prod(SHAPE), dtype='f8').reshape(SHAPE)
+        self.partitions = []
+        for i in range(0, N_PARTS):
+            path = os.path.join(self.tmp_dir, 'sub_[{}].nc'.format(i))
+            nc = netCDF4.Dataset(path, 'w')
+            nc.createDimension('x', ROWS)
+            nc.createDimension('y', SHAPE[1])
+            nc.createVariable('var', 'f8', ('x', 'y'))[:] = self.expected[i*ROWS:(i+1)*ROWS]
+            nc.close()
+            location = [[i*ROWS, (i+1)*ROWS - 1], [0, SHAPE[1] - 1]]
+            self.partitions.append(CFAPartition([i, 0], location, CFASubarray('var', path, 'netCDF', [ROWS, SHAPE[1]])))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _read(self, partitions, elems):
+        # the target array has the shape of the selection, as in slVariable.__getitem__
+        data = np.zeros(self.expected[elems].shape, dtype='f8')
+        interface = _threadInterface()
+        interface.set_read_params(data, N_PARTS)
+        interface.read(partitions, fill_slices(SHAPE, elems))
+        return data
+
+    def test_read(self):
+        # the partitions are read in any order by the threads, but each lands in its own part of the target
+        data = self._read(list(reversed(self.partitions)), (slice(None), slice(None)))
+        self.assertTrue(np.array_equal(data, self.expected))
+        data = self._read(self.partitions[1:3], (slice(ROWS, 3*ROWS), slice(1, 4)))
+        self.assertTrue(np.array_equal(data, self.expected[ROWS:3*ROWS, 1:4]))
+
+    def test_read_error(self):
+        # an error in one of the worker threads is raised by read
+        os.remove(self.partitions[2].subarray.file)
+        self.assertRaises(slIOException, self._read, self.partitions, (slice(None), slice(None)))
+        self.partitions[1].subarray.ncvar = 'missing'
+        self.assertRaises(KeyError, self._read, self.partitions[0:2], (slice(None), slice(None)))
+
+
+class _RecordingInterface(_threadInterface):
+    """_threadInterface with the fetching and writing of the subarray files replaced by recording the calls"""
+
+    def __init__(self, fail=None):
+        self.fail = fail
+        self.written = {}
+        self.fetched = []
+        self.concurrent = 0
+        self.max_concurrent = 0
+        self.lock = threading.Lock()
+
+    def _get_write_mode(self, part, mode=None):
+        return mode
+
+    def _fetch_write_partition(self, part, mode):
+        # the fetches are not serialised with the writes
+        with self.lock:
+            self.concurrent += 1
+            self.max_concurrent = max(self.max_concurrent, self.concurrent)
+        time.sleep(0.05)
+        with self.lock:
+            self.concurrent -= 1
+            self.fetched.append(part.subarray.file)
+        if part.subarray.file == self.fail:
+            raise slIOException('Could not fetch {}'.format(self.fail))
+        return part.subarray.file + '.cache'
+
+    def _write_partition(self, part, pieces, mode, file_details=None):
+        self.written[file_details] = (mode, len(pieces))
+        return part.subarray.file
+
+
+class TestThreadInterfaceWrite(unittest.TestCase):
+
+    def setUp(self):
+        self.part_pieces = []
+        for i in range(0, 8):
+            subarray = CFASubarray('var', 'sub_[{}].nc'.format(i), 'netCDF', [1])
+            self.part_pieces.append((CFAPartition([i], [[i, i]], subarray), [None] * (i % 3 + 1), 'w' if i % 2 else 'a'))
+
+    def test_write(self):
+        interface = _RecordingInterface()
+        interface._write_threads = 4
+        partitions_accessed = interface.write_pieces(self.part_pieces)
+        files = ['sub_[{}].nc'.format(i) for i in range(0, 8)]
+        self.assertEqual(sorted(partitions_accessed), files)
+        self.assertEqual(interface.written, {f + '.cache': (pp[2], len(pp[1])) for f, pp in zip(files, self.part_pieces)})
+        self.assertTrue(interface.max_concurrent > 1)
+
+    def test_write_error(self):
+        interface = _RecordingInterface(fail='sub_[5].nc')
+        interface._write_threads = 4
+        self.assertRaises(slIOException, interface.write_pieces, self.part_pieces)
+        # the other partitions are still written
+        self.assertEqual(len(interface.fetched), 8)
+        self.assertEqual(len(interface.written), 7)
+
+if __name__ == '__main__':
+    unittest.main()
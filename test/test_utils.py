@@ -1,4 +1,71 @@
 """ Tests for utility functions of SemSL.
 """
 __copyright__ = "(C) 2012 Science and Technology Facilities Council"
-__license__ = "BSD - see LICENSE file in top-level directory"
\ No newline at end of file
+__license__ = "BSD - see LICENSE file in top-level directory"
+import SemSL._slUtils as slU
+from SemSL._slConfigManager import slConfig
+import unittest
+import tempfile
+import shutil
+import json
+import os
+
+class TestParseFid(unittest.TestCase):
+
+    def test_parse_fid(self):
+        fid = slU.parse_fid('s3://test/testbucket/path/to/file.nc')
+        self.assertEqual(fid.alias, 's3://test')
+        self.assertEqual(fid.host_name, slU._get_hostname('s3://test/testbucket/path/to/file.nc'))
+        self.assertEqual(fid.bucket, 'testbucket')
+        self.assertEqual(fid.key, 'path/to/file.nc')
+        self.assertEqual(fid.backend_name, 'slS3Backend')
+
+    def test_bucket_in_key(self):
+        # the bucket name is only removed from the start of the key
+        self.assertEqual(slU._get_key('s3://test/data/data/file_data.nc'), 'data/file_data.nc')
+
+    def test_alias_substring(self):
+        # s3://test is a substring of the alias, but not a whole path component of it
+        self.assertIsNone(slU._get_alias('s3://testing/testbucket/file.nc'))
+
+    def test_posix_fid(self):
+        fid = slU.parse_fid('/tmp/path/file.nc')
+        self.assertIsNone(fid.alias)
+        self.assertEqual(fid.key, '/tmp/path/file.nc')
+        # there is no host or backend for a fid without an alias
+        with self.assertRaises(slU.slConfigFileException):
+            slU._get_hostname('/tmp/path/file.nc')
+        with self.assertRaises(slU.slConfigFileException):
+            slU._get_backend('/tmp/path/file.nc')
+
+class TestConfigChange(unittest.TestCase):
+
+    def setUp(self):
+        # a copy of the config in a temporary home directory
+        self.home = os.environ['HOME']
+        with open(os.path.join(self.home, '.sem-sl.json')) as fh:
+            self.config = json.load(fh)
+        self.tmp_dir = tempfile.mkdtemp()
+        os.environ['HOME'] = self.tmp_dir
+        self._write_config()
+
+    def tearDown(self):
+        os.environ['HOME'] = self.home
+        shutil.rmtree(self.tmp_dir)
+
+    def _write_config(self):
+        with open(os.path.join(self.tmp_dir, '.sem-sl.json'), 'w') as fh:
+            json.dump(self.config, fh)
+        slConfig().reload()
+
+    def test_alias_changed(self):
+        # the aliases are read from the config when it is reloaded
+        self.assertEqual(slU._get_alias('s3://test/testbucket/file.nc'), 's3://test')
+        self.config['hosts']['test']['alias'] = 's3://renamed'
+        self._write_config()
+        self.assertIsNone(slU._get_alias('s3://test/testbucket/file.nc'))
+        self.assertEqual(slU._get_hostname('s3://renamed/testbucket/file.nc'), 'test')
+        self.assertEqual(slU._get_key('s3://renamed/testbucket/file.nc'), 'file.nc')
+
+if __name__ == '__main__':
+    unittest.main()